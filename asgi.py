@@ -0,0 +1,214 @@
+"""
+ASGI entry point for the public read pages.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8001 --workers 2
+
+Serves GET/HEAD requests for the home page, /destinations, /culture,
+/infos-pratiques, /pages/<slug> and the small JSON endpoints (/validate_slug,
+/healthz, /readyz). A page is rendered by the regular Flask view on a small
+thread pool, with the same stores, sessions and snapshots as the WSGI server.
+The rendering thread is released as soon as the body is built. Sending the
+body to the client is then awaited on the event loop, so a slow mobile
+connection costs a socket and a buffer, not a worker thread. Bodies larger
+than RENDER_BUFFER_SIZE (files, streamed responses) are not held whole: past
+that size they are forwarded chunk by chunk, each chunk read on the pool.
+
+Everything else (admin, login, forms, media) stays on the WSGI server
+(wsgi.py). Route it there from the proxy, e.g. with nginx:
+
+    location ~ ^/(|destinations|culture|infos-pratiques|pages/.*|validate_slug|healthz|readyz)$ {
+        if ($request_method !~ ^(GET|HEAD)$) { proxy_pass http://gunicorn; }
+        proxy_pass http://uvicorn;
+    }
+    location / { proxy_pass http://gunicorn; }
+
+With ASGI_WSGI_FALLBACK=1 the other routes are served here too, through the
+same thread pool. This is convenient for a single local server, but those
+requests hold a thread while their body is read.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+from main import app as flask_app, create_app
+
+# Flask endpoints answered by the ASGI app (GET and HEAD only)
+PUBLIC_ENDPOINTS = {
+    'index',
+    'liste_destinations',
+    'culture_niger',
+    'informations_pratiques_route',
+    'custom_page_route',
+    'validate_slug',
+    'healthz',
+    'readyz',
+}
+
+RENDER_THREADS = int(os.environ.get('ASGI_RENDER_THREADS', 8))
+WSGI_FALLBACK = os.environ.get('ASGI_WSGI_FALLBACK') == '1'
+SEND_CHUNK_SIZE = 64 * 1024
+RENDER_BUFFER_SIZE = 1024 * 1024
+
+executor = ThreadPoolExecutor(max_workers=RENDER_THREADS, thread_name_prefix='asgi-render')
+url_adapter = flask_app.url_map.bind('localhost')
+
+
+def is_public(method, path):
+    if method not in ('GET', 'HEAD'):
+        return False
+    try:
+        endpoint, _ = url_adapter.match(path, method=method)
+    except HTTPException:
+        return False
+    return endpoint in PUBLIC_ENDPOINTS
+
+
+def wsgi_environ(scope, body):
+    """
+    The WSGI environ equivalent to an ASGI HTTP scope.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def close_result(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+def render(environ):
+    """
+    Runs the Flask app on one request and returns (status, headers, body, rest).
+    body holds what the app produced, up to RENDER_BUFFER_SIZE bytes. Past
+    that, rest is (result, chunks): the WSGI result, to be closed with
+    close_result(), and the iterator of its remaining chunks. Otherwise rest
+    is None.
+    """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [
+            (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+        ]
+
+    result = flask_app(environ, start_response)
+    chunks = iter(result)
+    body = []
+    size = 0
+    try:
+        for chunk in chunks:
+            body.append(chunk)
+            size += len(chunk)
+            if size >= RENDER_BUFFER_SIZE:
+                return response['status'], response['headers'], b''.join(body), (result, chunks)
+    except BaseException:
+        close_result(result)
+        raise
+    close_result(result)
+    return response['status'], response['headers'], b''.join(body), None
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_plain(send, status, text):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+
+async def lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await loop.run_in_executor(executor, create_app)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    if not (WSGI_FALLBACK or is_public(scope['method'], scope['path'])):
+        return await send_plain(send, 404, "Served by the WSGI server.")
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    status, headers, content, rest = await loop.run_in_executor(executor, render, wsgi_environ(scope, body))
+
+    # From here on the client sets the pace; no thread is involved
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    view = memoryview(content)
+    for start in range(0, len(content), SEND_CHUNK_SIZE):
+        await send({
+            'type': 'http.response.body',
+            'body': bytes(view[start:start + SEND_CHUNK_SIZE]),
+            'more_body': rest is not None or start + SEND_CHUNK_SIZE < len(content),
+        })
+    if rest is not None:
+        # A large body: a thread only while each chunk is read
+        result, chunks = rest
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await loop.run_in_executor(executor, close_result, result)
+    elif not content:
+        await send({'type': 'http.response.body', 'body': b''})
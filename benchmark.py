@@ -0,0 +1,1075 @@
+"""
+Reproducible HTTP benchmark of the site on synthetic catalogues.
+
+    python benchmark.py run                                  # 100, 10 000 and 100 000 items, both modes
+    python benchmark.py run --sizes 100,10000 --modes client --duration 1
+    python benchmark.py run --routes /destinations,/manage/inbox --output before.json
+
+    python benchmark.py run --trials 3 && python benchmark.py baseline   # record the baseline
+    python benchmark.py run --trials 3 --baseline bench-baseline.json    # exit 1 on a regression
+    python benchmark.py compare bench-baseline.json bench-results.json --all
+
+For each size, the site is started on a fresh set of stores (in a temporary
+directory; nothing in the working tree is touched) and seeded with that many
+destinations, culture items, contact messages and activity log entries, plus a
+few pages, users and images. The data comes from a seeded random generator
+(--seed), so two runs with the same arguments see the same catalogue.
+
+Every public and admin page is then requested in two modes:
+
+    client  the Flask test client, in one process, one request at a time: the
+            cost of the view code alone
+    server  gunicorn with the wsgi.py settings (--preload, no recycling) on a
+            local port, driven by --concurrency keep-alive clients: adds HTTP
+            parsing, the workers and the contention between them
+
+Each size and mode runs in its own process, so the peak RSS reported is that
+of the catalogue at hand (in server mode, the sum over the gunicorn master and
+workers, sampled during the run). Routes with side effects on a GET (the
+delete and mark-as-read links) are left out; so are the POST forms.
+
+Results go to --output as JSON: the environment (Python, CPUs, git commit), the
+settings, and for each (mode, size) the seeding time, peak RSS and, per route,
+the request and error counts, throughput (requests/s) and latencies in ms
+(mean, p50, p95, p99, max, plus up to SAMPLE_LIMIT raw samples).
+
+`baseline` records the routes of a results file in the baseline file (routes
+not in the results keep their previous baseline). `compare`, or `run
+--baseline`, prints a table of the routes that changed and exits with status 1
+when one of them regressed: its p95 went up, or its throughput down, by more
+than --threshold, consistently across the trials and beyond what the trial to
+trial noise explains (see "Comparison with a baseline" below). Run the baseline
+and the check with the same settings, on the same kind of machine, with at
+least 3 trials each. On a shared machine whose speed drifts, --normalize
+compares each route with the others instead of with its raw baseline.
+"""
+import argparse
+import atexit
+import functools
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+DEFAULT_SIZES = '100,10000,100000'
+ADMIN_USERNAME = 'issou'
+ADMIN_PASSWORD = 'benchmark'
+PAGE_COUNT = 20
+USER_COUNT = 20
+IMAGE_COUNT = 24
+MESSAGE_BATCH = 5000
+SAMPLE_LIMIT = 2000
+DEFAULT_BASELINE = 'bench-baseline.json'
+# Samples per trial kept for the bootstrap (evenly spaced in the sorted samples)
+BOOTSTRAP_SAMPLES = 200
+# Timestamps of the synthetic messages and logs count back from this instant
+REFERENCE_TIME = 1_700_000_000
+
+PLACES = [
+    'Agadez', 'Niamey', 'Zinder', 'Maradi', 'Tahoua', 'Dosso', 'Tillabéri', 'Diffa',
+    'Arlit', 'Birni-N\'Konni', 'Ayorou', 'Iférouane', 'Timia', 'Bilma', 'Djado', 'Say',
+]
+THEMES = [
+    'Festival', 'Artisanat', 'Musique', 'Danse', 'Cuisine', 'Marché', 'Architecture',
+    'Cérémonie', 'Lutte traditionnelle', 'Bijouterie', 'Tissage', 'Conte',
+]
+WORDS = (
+    'désert dunes fleuve oasis caravane mosquée marché sable savane girafes '
+    'nomades touareg haoussa peul zarma festival tradition artisanat cuir argent '
+    'musique danse griot cuisine mil thé hospitalité village ville région parc '
+    'montagne aïr ténéré niger sahel patrimoine histoire voyage découverte route'
+).split()
+
+
+###########################################################
+#  Synthetic catalogue
+###########################################################
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def synthetic_id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def store_config(directory):
+    """
+    Settings that point every store of the app into `directory`.
+    """
+    return {
+        'SECRET_KEY': 'benchmark',
+        'UPLOAD_FOLDER': os.path.join(directory, 'uploads'),
+        'MESSAGES_DB_PATH': os.path.join(directory, 'messages.sqlite3'),
+        'MAIL_OUTBOX_PATH': os.path.join(directory, 'mail_outbox.sqlite3'),
+        'SESSION_SQLITE_PATH': os.path.join(directory, 'sessions.sqlite3'),
+        'SESSION_FILE_DIR': os.path.join(directory, 'sessions'),
+        'CONTENT_JOURNAL_PATH': os.path.join(directory, 'content_journal.sqlite3'),
+        'JOBS_DB_PATH': os.path.join(directory, 'jobs.sqlite3'),
+        'METRICS_DIR': os.path.join(directory, 'metrics'),
+        'PROFILE_DIR': os.path.join(directory, 'profiles'),
+        'SEED_ADMIN_PASSWORD': ADMIN_PASSWORD,
+        'MAIL_SUPPRESS_SEND': True,
+        # The evictors would trim the synthetic activity log mid-run
+        'MEMORY_BUDGETS': {},
+    }
+
+def make_images(folder, rng):
+    from PIL import Image
+
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for i in range(IMAGE_COUNT):
+        name = f"bench-{i:02d}.jpg"
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new('RGB', (1200, 800), color).save(os.path.join(folder, name), quality=85)
+        names.append(name)
+    return names
+
+def seed_catalogue(site, size, seed):
+    """
+    Replaces the content collections of the `site` module by a synthetic
+    catalogue of `size` items per collection. Call after create_app() and
+    before any request.
+    """
+    rng = random.Random(seed)
+    images = make_images(site.app.config['UPLOAD_FOLDER'], rng)
+
+    destinations = [
+        {
+            "id": synthetic_id(rng),
+            "nom": f"{rng.choice(PLACES)} {i}",
+            "description": synthetic_text(rng, 25),
+            "image": f"/static/uploads/{rng.choice(images)}",
+            "order": i
+        }
+        for i in range(1, size + 1)
+    ]
+    culture = [
+        {
+            "id": synthetic_id(rng),
+            "nom": f"{rng.choice(THEMES)} {i}",
+            "description": synthetic_text(rng, 25),
+            "image": rng.choice([None, f"/static/uploads/{rng.choice(images)}"])
+        }
+        for i in range(1, size + 1)
+    ]
+    custom_pages = [
+        {
+            "id": synthetic_id(rng),
+            "title": f"Page {i}",
+            "url": f"page-{i}",
+            "content": ''.join(
+                f"<p>{synthetic_text(rng, 60)}</p>" for _ in range(8)
+            ) + f'<img src="/static/uploads/{rng.choice(images)}">',
+            "meta_title": f"Page {i}",
+            "meta_description": synthetic_text(rng, 15)
+        }
+        for i in range(1, PAGE_COUNT + 1)
+    ]
+    admin = site.users[0]
+    users = [admin] + [
+        {
+            "id": synthetic_id(rng),
+            "username": f"editeur{i}",
+            "password": admin['password'],
+            "role": 'user'
+        }
+        for i in range(1, USER_COUNT)
+    ]
+    activity_logs = [
+        {
+            "user": rng.choice(users)['username'],
+            "action": f"Modifié la destination: {rng.choice(destinations)['nom']}",
+            "timestamp": datetime.fromtimestamp(
+                REFERENCE_TIME - (size - i) * 60
+            ).strftime('%Y-%m-%d %H:%M:%S')
+        }
+        for i in range(size)
+    ]
+
+    with site.content_lock:
+        site.destinations = destinations
+        site.culture = culture
+        site.custom_pages = custom_pages
+        site.users = users
+        site.activity_logs[:] = activity_logs
+    site.app.config['ACTIVITY_LOG_LIMIT'] = max(site.app.config['ACTIVITY_LOG_LIMIT'], size)
+    site.rebuild_media_references()
+
+    for start in range(0, size, MESSAGE_BATCH):
+        site.store_messages([
+            {
+                "id": synthetic_id(rng),
+                "nom": f"Visiteur {i}",
+                "email": f"visiteur{i}@example.org",
+                "message": synthetic_text(rng, rng.randrange(10, 120)),
+                "lu": int(rng.random() < 0.7),
+                "received_at": REFERENCE_TIME - (size - i) * 300
+            }
+            for i in range(start, min(start + MESSAGE_BATCH, size))
+        ])
+
+def remove_directory(directory, owner):
+    # Forked gunicorn workers inherit the atexit handler; only the owner cleans up
+    if os.getpid() == owner:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def start_site(size, seed):
+    """
+    Imports the site, initializes it on stores in a temporary directory (removed
+    at exit) and seeds it. Returns (module, seconds spent seeding).
+    """
+    directory = tempfile.mkdtemp(prefix='bench-')
+    # Registered before the site's own exit handlers, so it runs after them
+    atexit.register(remove_directory, directory, os.getpid())
+
+    import main as site
+
+    site.create_app(store_config(directory))
+    started = time.perf_counter()
+    seed_catalogue(site, size, seed)
+    return site, time.perf_counter() - started
+
+def bench_routes(site):
+    """
+    (name, path, admin) for each page benchmarked. The name stays the same from
+    one catalogue to the next (it is what results are compared on), the path
+    points at an item or page in the middle of the catalogue.
+    """
+    def middle(items):
+        return items[len(items) // 2]
+
+    word = WORDS[0]
+    image = sorted(os.listdir(site.app.config['UPLOAD_FOLDER']))[0]
+    with closing(site.messages_connect()) as conn:
+        message_id = conn.execute(
+            "SELECT id FROM messages ORDER BY received_at LIMIT 1 OFFSET ?",
+            (len(site.destinations) // 2,)
+        ).fetchone()[0]
+    inbox_pages = len(site.destinations) // site.app.config['INBOX_PER_PAGE'] + 1
+    listing_pages = len(site.destinations) // 6 + 1
+
+    return [
+        ('/', '/', False),
+        ('/destinations', '/destinations', False),
+        ('/destinations?page=<middle>', f'/destinations?page={listing_pages // 2 + 1}', False),
+        ('/destinations?search=<word>', '/destinations?' + urlencode({'search': word}), False),
+        ('/culture', '/culture', False),
+        ('/culture?page=<middle>', f'/culture?page={listing_pages // 2 + 1}', False),
+        ('/culture?search=<word>', '/culture?' + urlencode({'search': word}), False),
+        ('/infos-pratiques', '/infos-pratiques', False),
+        ('/pages/<url>', f"/pages/{middle(site.custom_pages)['url']}", False),
+        ('/contact', '/contact', False),
+        ('/login', '/login', False),
+        ('/register', '/register', False),
+        ('/validate_slug', '/validate_slug?slug=page-1', False),
+        ('/media/<image>', f'/media/{image}', False),
+        ('/media/thumbs/<image>', f'/media/thumbs/{image}', False),
+        ('/healthz', '/healthz', False),
+        ('/readyz', '/readyz', False),
+        ('/manage', '/manage', True),
+        ('/manage/add_destination', '/manage/add_destination', True),
+        ('/manage/edit_destination/<id>',
+         f"/manage/edit_destination/{middle(site.destinations)['id']}", True),
+        ('/manage/add_culture', '/manage/add_culture', True),
+        ('/manage/edit_culture/<id>', f"/manage/edit_culture/{middle(site.culture)['id']}", True),
+        ('/manage/add_page', '/manage/add_page', True),
+        ('/manage/edit_page/<id>', f"/manage/edit_page/{middle(site.custom_pages)['id']}", True),
+        ('/manage/add_user', '/manage/add_user', True),
+        ('/manage/edit_user/<id>', f"/manage/edit_user/{middle(site.users)['id']}", True),
+        ('/manage/media', '/manage/media', True),
+        ('/manage/media/search', '/manage/media/search?' + urlencode({'type': 'image', 'q': 'bench'}), True),
+        ('/manage/inbox', '/manage/inbox', True),
+        ('/manage/inbox?page=<middle>', f'/manage/inbox?page={inbox_pages // 2 + 1}', True),
+        ('/manage/inbox?q=<word>', '/manage/inbox?' + urlencode({'q': word}), True),
+        ('/manage/inbox?status=unread', '/manage/inbox?status=unread', True),
+        ('/manage/reply_message/<id>', f'/manage/reply_message/{message_id}', True),
+        ('/manage/jobs', '/manage/jobs', True),
+        ('/manage/profiling', '/manage/profiling', True),
+        ('/manage/memory', '/manage/memory', True),
+        ('/manage/memory.json', '/manage/memory.json', True),
+        ('/metrics', '/metrics', True),
+    ]
+
+def select_routes(routes, selection):
+    if not selection:
+        return routes
+    wanted = set(selection.split(','))
+    return [route for route in routes if route[0] in wanted or route[1] in wanted]
+
+
+###########################################################
+#  Measurements
+###########################################################
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return None
+    rank = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def summarize(latencies, statuses, elapsed):
+    """
+    Statistics of one route: `latencies` in seconds, `statuses` {status: count}
+    (0 for a connection error), `elapsed` the wall time of the run.
+    """
+    ordered = sorted(latency * 1000 for latency in latencies)
+    errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+    samples = ordered
+    if len(samples) > SAMPLE_LIMIT:
+        samples = sorted(random.Random(0).sample(ordered, SAMPLE_LIMIT))
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(ordered) / elapsed, 2) if elapsed else None,
+        'mean': round(sum(ordered) / len(ordered), 3) if ordered else None,
+        'p50': round(percentile(ordered, 0.50), 3) if ordered else None,
+        'p95': round(percentile(ordered, 0.95), 3) if ordered else None,
+        'p99': round(percentile(ordered, 0.99), 3) if ordered else None,
+        'max': round(ordered[-1], 3) if ordered else None,
+        'samples': [round(sample, 3) for sample in samples],
+    }
+
+def report_route(mode, size, name, stats):
+    print(
+        f"{mode:6} {size:>7} {name:40} {stats['throughput'] or 0:9.1f} req/s  "
+        f"p50 {stats['p50'] or 0:8.2f} ms  p95 {stats['p95'] or 0:8.2f} ms  "
+        f"p99 {stats['p99'] or 0:8.2f} ms  errors {stats['errors']}",
+        file=sys.stderr, flush=True
+    )
+
+def peak_memory():
+    """
+    Peak RSS of this process in bytes (ru_maxrss is in KiB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+###########################################################
+#  Client mode (Flask test client, in-process)
+###########################################################
+
+def run_client(args):
+    """
+    One (client, size) run in this process; writes the run to args.result.
+    """
+    site, seed_seconds = start_site(args.size, args.seed)
+    visitor = site.app.test_client()
+    admin = site.app.test_client()
+    response = admin.post('/login', data={'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+    if response.status_code != 302 or admin.get('/manage').status_code != 200:
+        raise SystemExit("Login failed")
+
+    routes = {}
+    for name, path, is_admin in select_routes(bench_routes(site), args.routes):
+        client = admin if is_admin else visitor
+        deadline = time.perf_counter() + args.warmup
+        while time.perf_counter() < deadline:
+            client.get(path)
+
+        latencies, statuses = [], {}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        while time.perf_counter() < deadline or len(latencies) < args.min_requests:
+            request_started = time.perf_counter()
+            status = client.get(path).status_code
+            latencies.append(time.perf_counter() - request_started)
+            statuses[status] = statuses.get(status, 0) + 1
+        routes[name] = summarize(latencies, statuses, time.perf_counter() - started)
+        report_route('client', args.size, name, routes[name])
+
+    run = {
+        'mode': 'client',
+        'size': args.size,
+        'seed_seconds': round(seed_seconds, 3),
+        'peak_rss': peak_memory(),
+        'routes': routes,
+    }
+    with open(args.result, 'w') as f:
+        json.dump(run, f)
+
+
+###########################################################
+#  Server mode (gunicorn on a local port)
+###########################################################
+
+def serve_seeded(args):
+    """
+    Seeds the site in this process, then runs it under gunicorn with --preload,
+    so that the workers are forked with the catalogue already in memory.
+    The (name, path, admin) routes are written to args.result first.
+    """
+    site, seed_seconds = start_site(args.size, args.seed)
+    with open(args.result, 'w') as f:
+        json.dump({'seed_seconds': seed_seconds, 'routes': bench_routes(site)}, f)
+
+    import wsgi
+
+    options = wsgi.server_options(argparse.Namespace(
+        bind=f'127.0.0.1:{args.port}',
+        worker_class='gthread',
+        workers=args.workers,
+        threads=args.threads,
+        max_requests=0,
+        preload=True,
+    ))
+    options['accesslog'] = None
+    wsgi.serve(options)
+
+def free_port():
+    import socket
+
+    with closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def process_tree(pid):
+    """
+    `pid` and its descendants (Linux).
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f'/proc/{parent}/task'):
+                with open(f'/proc/{parent}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+def tree_rss(pid):
+    """
+    Total RSS of `pid` and its descendants in bytes, or None off Linux.
+    Pages shared between the master and the forked workers count once per process.
+    """
+    total = None
+    for member in process_tree(pid):
+        try:
+            with open(f'/proc/{member}/statm') as f:
+                total = (total or 0) + int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the RSS of a process tree every `interval` seconds and keeps the peak.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(name='memory-sampler', daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+def http_request(conn, path, cookie):
+    headers = {'Cookie': cookie} if cookie else {}
+    conn.request('GET', path, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    return response
+
+def wait_until_ready(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The server exited with status {process.returncode}")
+        try:
+            with closing(http.client.HTTPConnection('127.0.0.1', port, timeout=5)) as conn:
+                if http_request(conn, '/readyz', None).status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("The server did not become ready in time")
+
+def admin_cookie(port):
+    body = urlencode({'username': ADMIN_USERNAME, 'password': ADMIN_PASSWORD})
+    with closing(http.client.HTTPConnection('127.0.0.1', port, timeout=30)) as conn:
+        conn.request('POST', '/login', body=body, headers={
+            'Content-Type': 'application/x-www-form-urlencoded'
+        })
+        response = conn.getresponse()
+        response.read()
+        cookies = [
+            value.split(';', 1)[0] for name, value in response.getheaders()
+            if name.lower() == 'set-cookie'
+        ]
+    if response.status != 302 or not cookies:
+        raise SystemExit("Login failed")
+    return '; '.join(cookies)
+
+def load(port, path, cookie, concurrency, duration, min_requests=0):
+    """
+    `concurrency` keep-alive clients request `path` for `duration` seconds.
+    Returns (latencies, statuses, elapsed).
+    """
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        mine, counts = [], {}
+        while time.perf_counter() < deadline or len(latencies) + len(mine) < min_requests:
+            request_started = time.perf_counter()
+            try:
+                response = http_request(conn, path, cookie)
+                status = response.status
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+            mine.append(time.perf_counter() - request_started)
+            counts[status] = counts.get(status, 0) + 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - started
+
+def run_server(args, size, scratch):
+    port = free_port()
+    result = os.path.join(scratch, f'serve-{size}.json')
+    command = [
+        sys.executable, os.path.abspath(__file__), '_serve',
+        '--size', str(size), '--seed', str(args.seed),
+        '--port', str(port), '--result', result,
+    ]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        wait_until_ready(port, process, args.startup_timeout)
+        with open(result) as f:
+            info = json.load(f)
+        cookie = admin_cookie(port)
+        sampler = MemorySampler(process.pid)
+        sampler.start()
+
+        routes = {}
+        for name, path, is_admin in select_routes(info['routes'], args.routes):
+            route_cookie = cookie if is_admin else None
+            load(port, path, route_cookie, args.concurrency, args.warmup)
+            latencies, statuses, elapsed = load(
+                port, path, route_cookie, args.concurrency, args.duration, args.min_requests
+            )
+            routes[name] = summarize(latencies, statuses, elapsed)
+            report_route('server', size, name, routes[name])
+
+        return {
+            'mode': 'server',
+            'size': size,
+            'seed_seconds': round(info['seed_seconds'], 3),
+            'peak_rss': sampler.stop(),
+            'routes': routes,
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+###########################################################
+#  Runs
+###########################################################
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'git_commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+def run_client_process(args, size, scratch):
+    result = os.path.join(scratch, f'client-{size}.json')
+    command = [
+        sys.executable, os.path.abspath(__file__), '_client',
+        '--size', str(size), '--seed', str(args.seed), '--result', result,
+        '--duration', str(args.duration), '--warmup', str(args.warmup),
+        '--min-requests', str(args.min_requests),
+    ]
+    if args.routes:
+        command += ['--routes', args.routes]
+    subprocess.run(command, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    with open(result) as f:
+        return json.load(f)
+
+def run_benchmark(args):
+    """
+    Every (mode, size) run of `args`, as the results document.
+    """
+    sizes = [int(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    results = {
+        'format': 1,
+        'environment': environment(),
+        'settings': {
+            'sizes': sizes,
+            'modes': modes,
+            'seed': args.seed,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'min_requests': args.min_requests,
+            'concurrency': args.concurrency,
+            'workers': args.workers,
+            'threads': args.threads,
+            'trials': args.trials,
+        },
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory(prefix='bench-') as scratch:
+        # Trials are interleaved rather than back to back, so that a slow spell
+        # of the machine hits one trial of several routes, not every trial of one
+        for trial in range(1, args.trials + 1):
+            for size in sizes:
+                if 'client' in modes:
+                    results['runs'].append({**run_client_process(args, size, scratch), 'trial': trial})
+                if 'server' in modes:
+                    results['runs'].append({**run_server(args, size, scratch), 'trial': trial})
+    return results
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+        f.write('\n')
+
+###########################################################
+#  Comparison with a baseline
+###########################################################
+
+# A route regresses when its p95 or its throughput gets worse by more than
+# --threshold and the change stands out from the noise:
+#  - p95: the bootstrap resamples the trials, then the requests within each
+#    trial, so that a trial run on a busy machine widens the interval rather
+#    than passing for a change. The slowdown must still exceed the threshold
+#    at the lower end of the one-sided 1 - alpha interval. With 3 trials or
+#    more, the per-trial p95s must also differ by a one-sided Mann-Whitney
+#    test: a change in the code slows every trial, a busy spell only some.
+#  - throughput (one figure per trial): one-sided Mann-Whitney test on the
+#    per-trial figures. It takes 3 trials on each side to reach alpha = 0.05.
+# Errors on a route that had none are a regression too.
+# With --normalize, a slowdown shared by all the routes of a mode (their
+# median change) is factored out first: on a shared machine a neighbour's load
+# slows every route alike. So does a change to code every page runs (e.g.
+# render_page), which then passes with a warning only; the default compares
+# raw figures and fails on it.
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def route_key(mode, size, route):
+    return f"{mode} {size} {route}"
+
+def route_trials(document):
+    """
+    {key: {'mode', 'size', 'route', 'environment', 'trials': [stats, ...]}}
+    from a results document or a baseline.
+    """
+    if 'runs' not in document:
+        return document['routes']
+    routes = {}
+    for run in document['runs']:
+        for route, stats in run['routes'].items():
+            entry = routes.setdefault(route_key(run['mode'], run['size'], route), {
+                'mode': run['mode'],
+                'size': run['size'],
+                'route': route,
+                'environment': document['environment'],
+                'trials': [],
+            })
+            entry['trials'].append(stats)
+    return routes
+
+def update_baseline(path, results):
+    """
+    Records the routes of `results` as their baseline in the file at `path`;
+    the baseline of the other routes is kept. Returns how many were recorded.
+    """
+    try:
+        baseline = load_json(path)
+    except FileNotFoundError:
+        baseline = {'format': 1, 'routes': {}}
+    routes = route_trials(results)
+    baseline['routes'].update(routes)
+    write_results(baseline, path)
+    return len(routes)
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+def thinned(samples, count):
+    """
+    `count` evenly spaced values of the sorted `samples`.
+    """
+    if len(samples) <= count:
+        return samples
+    return [samples[int((i + 0.5) * len(samples) / count)] for i in range(count)]
+
+def resampled_p95(trials, rng):
+    pool = []
+    for samples in rng.choices(trials, k=len(trials)):
+        pool.extend(rng.choices(samples, k=len(samples)))
+    pool.sort()
+    return percentile(pool, 0.95)
+
+def p95_ratio_bound(base_trials, trials, alpha, rounds, rng):
+    """
+    Lower end of the one-sided 1 - alpha bootstrap interval of
+    p95(trials) / p95(base_trials), or None without samples.
+    """
+    base = [thinned(t['samples'], BOOTSTRAP_SAMPLES) for t in base_trials if t['samples']]
+    now = [thinned(t['samples'], BOOTSTRAP_SAMPLES) for t in trials if t['samples']]
+    if not base or not now:
+        return None
+    ratios = sorted(
+        resampled_p95(now, rng) / max(resampled_p95(base, rng), 1e-9)
+        for _ in range(rounds)
+    )
+    return ratios[int(alpha * rounds)]
+
+@functools.lru_cache(maxsize=None)
+def u_distribution(n, m):
+    """
+    counts[u]: orderings of n x's and m y's with u pairs where x < y.
+    """
+    if n == 0 or m == 0:
+        return (1,)
+    counts = [0] * (n * m + 1)
+    # The largest value is either an x (below no y) or a y (above all n x's)
+    for u, count in enumerate(u_distribution(n - 1, m)):
+        counts[u] += count
+    for u, count in enumerate(u_distribution(n, m - 1)):
+        counts[u + n] += count
+    return tuple(counts)
+
+def mann_whitney_less(xs, ys):
+    """
+    One-sided p-value of the Mann-Whitney U test that the xs tend to be
+    smaller than the ys: exact for small samples, normal approximation beyond.
+    """
+    n, m = len(xs), len(ys)
+    if not n or not m:
+        return 1.0
+    u = sum((x < y) + 0.5 * (x == y) for x in xs for y in ys)
+    if n * m <= 400:
+        counts = u_distribution(n, m)
+        return sum(counts[math.ceil(u):]) / sum(counts)
+    z = (u - n * m / 2 - 0.5) / math.sqrt(n * m * (n + m + 1) / 12)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def machine_factors(base_routes, routes):
+    """
+    {mode: (p95 factor, throughput factor)}: the median change over all the
+    routes compared, taken as the machine being slower overall. Only a slowdown
+    is factored out; a machine that got faster must not make the routes that
+    did not change look slower.
+    """
+    ratios = {}
+    for key, entry in routes.items():
+        base = base_routes.get(key)
+        if base is None:
+            continue
+        p95, base_p95 = median(t['p95'] for t in entry['trials']), median(t['p95'] for t in base['trials'])
+        throughput = median(t['throughput'] for t in entry['trials'])
+        base_throughput = median(t['throughput'] for t in base['trials'])
+        if p95 and base_p95 and throughput and base_throughput:
+            ratios.setdefault(entry['mode'], []).append((p95 / base_p95, throughput / base_throughput))
+    return {
+        mode: (
+            max(statistics.median(r[0] for r in pairs), 1),
+            min(statistics.median(r[1] for r in pairs), 1)
+        )
+        for mode, pairs in ratios.items()
+    }
+
+def compare_route(base, entry, factors, args, rng):
+    trials = [t for t in entry['trials'] if t['requests']]
+    row = {
+        'mode': entry['mode'],
+        'size': entry['size'],
+        'route': entry['route'],
+        'base_p95': None,
+        'p95': median(t['p95'] for t in trials),
+        'base_throughput': None,
+        'throughput': median(t['throughput'] for t in trials),
+        'result': 'new',
+        'regression': False,
+    }
+    if base is None:
+        return row
+    base_trials = [t for t in base['trials'] if t['requests']]
+    row['base_p95'] = median(t['p95'] for t in base_trials)
+    row['base_throughput'] = median(t['throughput'] for t in base_trials)
+    p95_factor, throughput_factor = factors
+    worse, better = [], []
+
+    if any(t['errors'] for t in trials) and not any(t['errors'] for t in base_trials):
+        worse.append('errors')
+
+    if row['p95'] and row['base_p95']:
+        ratio = row['p95'] / row['base_p95']
+        if ratio / p95_factor > 1 + args.threshold and row['p95'] - row['base_p95'] * p95_factor > args.min_delta:
+            bound = p95_ratio_bound(base_trials, trials, args.alpha, args.rounds, rng)
+            consistent = len(trials) < 3 or len(base_trials) < 3 or mann_whitney_less(
+                [t['p95'] for t in base_trials],
+                [t['p95'] / p95_factor for t in trials]
+            ) <= args.alpha
+            if bound is not None and bound / p95_factor > 1 + args.threshold and consistent:
+                worse.append('p95')
+        elif ratio < 1 / (1 + args.threshold):
+            better.append('p95')
+
+    if row['throughput'] and row['base_throughput']:
+        ratio = row['throughput'] / row['base_throughput']
+        if ratio / throughput_factor < 1 - args.threshold:
+            p_value = mann_whitney_less(
+                [t['throughput'] / throughput_factor for t in trials],
+                [t['throughput'] for t in base_trials]
+            )
+            if p_value <= args.alpha:
+                worse.append('req/s')
+        elif ratio > 1 + args.threshold:
+            better.append('req/s')
+
+    if worse:
+        row['result'] = f"REGRESSION ({', '.join(worse)})"
+        row['regression'] = True
+    elif better:
+        row['result'] = f"improved ({', '.join(better)})"
+    else:
+        row['result'] = 'ok'
+    return row
+
+def format_number(value, digits):
+    return '–' if value is None else f"{value:,.{digits}f}"
+
+def format_change(base, value):
+    if not base or value is None:
+        return ''
+    return f"{(value / base - 1) * 100:+.0f}%"
+
+def print_table(rows):
+    header = ('mode', 'size', 'route', 'p95 base', 'p95 ms', 'change',
+              'req/s base', 'req/s', 'change', 'result')
+    lines = [header] + [
+        (
+            row['mode'], str(row['size']), row['route'],
+            format_number(row['base_p95'], 2), format_number(row['p95'], 2),
+            format_change(row['base_p95'], row['p95']),
+            format_number(row['base_throughput'], 1), format_number(row['throughput'], 1),
+            format_change(row['base_throughput'], row['throughput']),
+            row['result'],
+        )
+        for row in rows
+    ]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    left = {0, 2, 9}
+    for line in lines:
+        print('  '.join(
+            cell.ljust(width) if i in left else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(line, widths))
+        ).rstrip())
+
+def environment_differences(base_routes, environment):
+    differences = set()
+    for entry in base_routes.values():
+        for field in ('python', 'implementation', 'cpus'):
+            if entry['environment'].get(field) != environment.get(field):
+                differences.add(f"{field} {entry['environment'].get(field)} -> {environment.get(field)}")
+    return sorted(differences)
+
+def compare_results(baseline, results, args):
+    """
+    Prints the comparison of `results` with `baseline`. Returns the exit
+    status: 1 if a route regressed, 0 otherwise.
+    """
+    rng = random.Random(0)
+    base_routes = route_trials(baseline)
+    routes = route_trials(results)
+    factors = machine_factors(base_routes, routes) if args.normalize else {}
+
+    rows = [
+        compare_route(base_routes.get(key), entry, factors.get(entry['mode'], (1, 1)), args, rng)
+        for key, entry in routes.items()
+    ]
+    shown = rows if args.all else [row for row in rows if row['result'] != 'ok']
+    if shown:
+        print_table(shown)
+        print()
+
+    regressions = sum(row['regression'] for row in rows)
+    improved = sum(row['result'].startswith('improved') for row in rows)
+    new = sum(row['result'] == 'new' for row in rows)
+    print(
+        f"{len(rows)} routes compared: {regressions} regressed, {improved} improved, "
+        f"{new} without baseline (threshold {args.threshold:.0%}, alpha {args.alpha})"
+    )
+    for mode, (p95_factor, throughput_factor) in sorted(factors.items()):
+        if p95_factor < 1.01 and throughput_factor > 0.99:
+            continue
+        print(f"Median change of the {mode} routes, factored out: p95 x{p95_factor:.2f}, "
+              f"throughput x{throughput_factor:.2f}")
+        if p95_factor > 1 + args.threshold or throughput_factor < 1 - args.threshold:
+            print(f"Warning: every {mode} route is slower; a busy machine or a change that "
+                  f"affects all routes (check without --normalize on a quiet machine)")
+    for difference in environment_differences(base_routes, results['environment']):
+        print(f"Warning: the baseline was measured with a different {difference}")
+    if any(
+        min(len(entry['trials']), len(base_routes[key]['trials'])) < 3
+        for key, entry in routes.items() if key in base_routes
+    ):
+        print("Note: fewer than 3 trials on a side; throughput is not tested (use --trials 3)")
+    return 1 if regressions else 0
+
+###########################################################
+#  Command line
+###########################################################
+
+def add_run_arguments(parser):
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f"catalogue sizes, comma-separated (default {DEFAULT_SIZES})")
+    parser.add_argument('--modes', default='client,server', help="client, server or both (default)")
+    parser.add_argument('--routes', help="only these routes (names or paths, comma-separated)")
+    parser.add_argument('--duration', type=float, default=3, help="seconds per route (default 3)")
+    parser.add_argument('--warmup', type=float, default=0.5, help="unmeasured seconds per route first")
+    parser.add_argument('--min-requests', type=int, default=5,
+                        help="keep going past --duration until this many requests (default 5)")
+    parser.add_argument('--concurrency', type=int, default=16, help="server mode clients (default 16)")
+    parser.add_argument('--workers', type=int, help="gunicorn workers (default: as wsgi.py)")
+    parser.add_argument('--threads', type=int, help="threads per worker (default: as wsgi.py)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the catalogue")
+    parser.add_argument('--startup-timeout', type=float, default=300,
+                        help="seconds to wait for the server to seed and start")
+    parser.add_argument('--trials', type=int, default=1,
+                        help="repeat every run this many times (3 or more to compare)")
+
+def add_compare_arguments(parser):
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="relative change of p95 or throughput that counts (default 0.15)")
+    parser.add_argument('--min-delta', type=float, default=1.0,
+                        help="ignore p95 increases smaller than this many ms (default 1)")
+    parser.add_argument('--alpha', type=float, default=0.05,
+                        help="significance level of the tests (default 0.05)")
+    parser.add_argument('--rounds', type=int, default=1000, help="bootstrap rounds (default 1000)")
+    parser.add_argument('--normalize', action='store_true',
+                        help="factor out the median change of all the routes (shared, noisy "
+                             "machines); a slowdown of every route then only warns")
+    parser.add_argument('--all', action='store_true', help="list unchanged routes too")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the site on synthetic catalogues.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the benchmark and write the results")
+    add_run_arguments(run)
+    run.add_argument('--output', default='bench-results.json', help="results file (JSON)")
+    run.add_argument('--baseline', help="then compare with this baseline; exit 1 on a regression")
+    add_compare_arguments(run)
+
+    compare = commands.add_parser('compare', help="compare results with a baseline; exit 1 on a regression")
+    compare.add_argument('baseline', help="baseline file (or a results file)")
+    compare.add_argument('results', nargs='?', default='bench-results.json', help="results file")
+    add_compare_arguments(compare)
+
+    baseline = commands.add_parser('baseline', help="record results as the baseline of their routes")
+    baseline.add_argument('results', nargs='?', default='bench-results.json', help="results file")
+    baseline.add_argument('--baseline', default=DEFAULT_BASELINE, help=f"default {DEFAULT_BASELINE}")
+
+    # Internal: one run in a fresh process
+    client = commands.add_parser('_client')
+    server = commands.add_parser('_serve')
+    for internal in (client, server):
+        internal.add_argument('--size', type=int, required=True)
+        internal.add_argument('--seed', type=int, required=True)
+        internal.add_argument('--result', required=True)
+    client.add_argument('--routes')
+    client.add_argument('--duration', type=float, required=True)
+    client.add_argument('--warmup', type=float, required=True)
+    client.add_argument('--min-requests', type=int, required=True)
+    server.add_argument('--port', type=int, required=True)
+    server.add_argument('--workers', type=int)
+    server.add_argument('--threads', type=int)
+
+    args = parser.parse_args()
+    if getattr(args, 'baseline', None) and args.command != 'baseline' and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline} (record one with `benchmark.py baseline`)")
+    if args.command == '_client':
+        run_client(args)
+    elif args.command == '_serve':
+        serve_seeded(args)
+    elif args.command == 'baseline':
+        count = update_baseline(args.baseline, load_json(args.results))
+        print(f"Baseline of {count} routes written to {args.baseline}", file=sys.stderr)
+    elif args.command == 'compare':
+        sys.exit(compare_results(load_json(args.baseline), load_json(args.results), args))
+    else:
+        results = run_benchmark(args)
+        write_results(results, args.output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+        if args.baseline:
+            sys.exit(compare_results(load_json(args.baseline), results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,38 @@
 # app.py
 
 import os
+import sys
+import gc
+import tracemalloc
 import uuid
 import re
-from datetime import datetime
+import mimetypes
+import struct
+import io
+import base64
+import time
+import threading
+import shutil
+import subprocess
+import sqlite3
+import smtplib
+import json
+import random
+import secrets
+import collections
+import queue
+import atexit
+import multiprocessing
+import pickle
+import fcntl
+import cProfile
+import pstats
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from urllib.parse import unquote, urlencode
+from datetime import datetime, timedelta, timezone
 from functools import wraps
 
 from flask import (
@@ -14,14 +43,36 @@ from flask import (
     flash,
     session,
     get_flashed_messages,
-    jsonify
+    jsonify,
+    send_file,
+    Response,
+    g,
+    has_request_context
 )
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import wrap_file
+from werkzeug.datastructures import CallbackDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from markupsafe import escape
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+import click
 
 # If you install Flask-Mail: pip install Flask-Mail
-from flask_mail import Mail, Message
+from flask_mail import Mail, Message, Connection
+
+# Optional: pip install Pillow to generate blurred image placeholders (LQIP)
+try:
+    from PIL import Image, ImageFilter, ImageOps
+except ImportError:
+    Image = None
+
+# Startup cost is measured from here (module body) and per create_app() step
+MODULE_LOAD_STARTED = time.perf_counter()
 
 ###########################################################
 #  1. Application and Configuration
@@ -29,40 +80,324 @@ from flask_mail import Mail, Message
 
 app = Flask(__name__)
 
-# Setting up the secret key for session/flash usage:
-app.secret_key = os.urandom(24)
+def load_secret_key():
+    """
+    The key signing cookies must be the same in every worker and survive
+    restarts: SECRET_KEY from the environment, else the content of
+    SECRET_KEY_FILE, which is generated once (atomically, so concurrent
+    workers agree on it) when it does not exist yet.
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    path = os.environ.get('SECRET_KEY_FILE', '.secret_key')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                key = f.read()
+            if key:
+                return key
+            time.sleep(0.01)  # another worker is writing it
+        raise RuntimeError(f"Secret key file {path} is empty")
+    key = secrets.token_hex(32).encode()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+# The secret key for session/flash usage is set by create_app() (section 15)
 
 # Configuration of your upload folder and allowed file types
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'webm', 'ogg'}
+VIDEO_EXTENSIONS = {'mp4', 'webm', 'ogg'}
 
-# Ensure the folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
+# Read from app.config when used, so that create_app({'UPLOAD_FOLDER': ...}) applies
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
 
-# Configuration for Flask-Mail
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = 'entreprise2rc@gmail.com'
-app.config['MAIL_PASSWORD'] = 'your_secure_app_password'
+# Configuration for Flask-Mail (overridable from the environment, e.g. to point
+# at a local SMTP stand-in: MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0)
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'entreprise2rc@gmail.com')
+app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'your_secure_app_password')
 app.config['MAIL_DEFAULT_SENDER'] = 'info@2rc.com'
 
-mail = Mail(app)
+# Outgoing mail is persisted in an SQLite outbox and delivered by a background worker
+app.config['MAIL_OUTBOX_PATH'] = os.environ.get('MAIL_OUTBOX_PATH', 'mail_outbox.sqlite3')
+app.config['MAIL_OUTBOX_POLL_INTERVAL'] = 5        # seconds between scans when idle
+app.config['MAIL_OUTBOX_BATCH_SIZE'] = 20
+app.config['MAIL_OUTBOX_LEASE'] = 300              # a claimed message is retried after 5 min
+app.config['MAIL_RETRY_BASE_DELAY'] = 30           # 30s, 1min, 2min, 4min... (with jitter)
+app.config['MAIL_RETRY_MAX_DELAY'] = 6 * 3600
+app.config['MAIL_MAX_ATTEMPTS'] = 8                # then the message is dead-lettered
+# Authenticated SMTP connections are kept open and reused between sends
+app.config['MAIL_POOL_SIZE'] = 4
+app.config['MAIL_POOL_IDLE_TIMEOUT'] = 60          # close connections unused for 1 min
+app.config['MAIL_POOL_CHECK_AFTER'] = 15           # NOOP-check connections idle longer
+
+# Media serving: set MEDIA_OFFLOAD to 'x-accel' (nginx) or 'x-sendfile' (Apache/lighttpd)
+# when running behind a proxy that can stream the uploads itself.
+app.config['MEDIA_OFFLOAD'] = os.environ.get('MEDIA_OFFLOAD')
+app.config['MEDIA_ACCEL_PREFIX'] = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-uploads/')
+app.config['MEDIA_MAX_AGE'] = 7 * 24 * 3600  # 1 week
+app.config['MEDIA_CHUNK_SIZE'] = 256 * 1024
+# Orphaned uploads (referenced by nothing) are swept every MEDIA_SWEEP_INTERVAL
+# seconds once older than MEDIA_ORPHAN_GRACE; leave the interval unset to disable.
+app.config['MEDIA_SWEEP_INTERVAL'] = int(os.environ.get('MEDIA_SWEEP_INTERVAL', 0)) or None
+app.config['MEDIA_ORPHAN_GRACE'] = 7 * 24 * 3600  # 1 week
+# Media library: thumbnail bounding box, and ffmpeg for video poster frames (optional)
+app.config['THUMBNAIL_SIZE'] = (320, 320)
+app.config['FFMPEG_BINARY'] = os.environ.get('FFMPEG_BINARY') or shutil.which('ffmpeg')
+app.config['MEDIA_LIBRARY_PER_PAGE'] = 24
+# Contact form: each client IP gets a bucket of CONTACT_RATE_BURST messages,
+# refilled by one every CONTACT_RATE_REFILL seconds. With several workers, point
+# CONTACT_RATE_BACKEND at an SQLite file so they share the same buckets.
+app.config['CONTACT_RATE_BURST'] = 5
+app.config['CONTACT_RATE_REFILL'] = 60
+app.config['CONTACT_RATE_BACKEND'] = os.environ.get('CONTACT_RATE_BACKEND')
+app.config['CONTACT_MIN_FILL_TIME'] = 3            # seconds; faster submissions are bots
+app.config['CONTACT_HONEYPOT_FIELD'] = 'website'   # hidden field humans leave empty
+app.config['CONTACT_MAX_LENGTH'] = 5000
+app.config['CONTACT_FORM_MAX_AGE'] = 2 * 3600      # the form must be sent back within 2h
+# Accepted messages are queued and stored in batches by a background thread
+app.config['CONTACT_QUEUE_SIZE'] = 1000
+app.config['CONTACT_FLUSH_INTERVAL'] = 0.5
+app.config['CONTACT_FLUSH_BATCH'] = 200
+# Reverse proxies in front of the app (nginx before gunicorn: 1). That many
+# X-Forwarded-For / X-Forwarded-Proto hops are trusted for the client IP (login
+# throttle, contact limiter) and the scheme; with 0 they are ignored.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Contact messages are stored in SQLite so the inbox can be paged and searched
+app.config['MESSAGES_DB_PATH'] = os.environ.get('MESSAGES_DB_PATH', 'messages.sqlite3')
+app.config['INBOX_PER_PAGE'] = 25
+# Password hashing runs in a small process pool so a burst of logins cannot pin
+# the request threads. Past PASSWORD_QUEUE_LIMIT waiting jobs, requests are
+# turned away at once. PASSWORD_POOL_SIZE = 0 hashes in the request thread.
+app.config['PASSWORD_POOL_SIZE'] = int(os.environ.get('PASSWORD_POOL_SIZE', min(2, os.cpu_count() or 1)))
+app.config['PASSWORD_QUEUE_LIMIT'] = 8
+app.config['PASSWORD_HASH_TIMEOUT'] = 5            # seconds
+# Login throttling: failures are counted over a sliding window per username and
+# per IP. From the 3rd failure each new attempt must wait LOGIN_DELAY_BASE seconds,
+# doubling every time; reaching the limit locks the key for LOGIN_LOCKOUT seconds.
+# Set LOGIN_THROTTLE_BACKEND to an SQLite file to share the counters between workers.
+app.config['LOGIN_FAILURE_WINDOW'] = 15 * 60
+app.config['LOGIN_MAX_FAILURES_PER_USER'] = 5
+app.config['LOGIN_MAX_FAILURES_PER_IP'] = 20
+app.config['LOGIN_DELAY_BASE'] = 1
+app.config['LOGIN_LOCKOUT'] = 15 * 60
+app.config['LOGIN_THROTTLE_BACKEND'] = os.environ.get('LOGIN_THROTTLE_BACKEND')
+# Sessions are stored server-side ('sqlite' or 'file'), the cookie only carries
+# an opaque id. 'cookie' keeps Flask's signed-cookie sessions.
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+app.config['SESSION_SQLITE_PATH'] = os.environ.get('SESSION_SQLITE_PATH', 'sessions.sqlite3')
+app.config['SESSION_FILE_DIR'] = os.environ.get('SESSION_FILE_DIR', 'sessions')
+app.config['SESSION_IDLE_TIMEOUT'] = 2 * 3600      # sessions unused for 2h expire
+app.config['SESSION_REFRESH_AFTER'] = 60           # extend the expiry at most once a minute
+app.config['SESSION_SWEEP_INTERVAL'] = 10 * 60
+# Example admin account; pass SEED_ADMIN_PASSWORD_HASH to skip hashing at startup
+app.config['SEED_ADMIN_PASSWORD'] = os.environ.get('SEED_ADMIN_PASSWORD', '12')
+app.config['SEED_ADMIN_PASSWORD_HASH'] = os.environ.get('SEED_ADMIN_PASSWORD_HASH')
+# Content edits go through a journal followed by every worker (and replayed on restart)
+app.config['CONTENT_JOURNAL_PATH'] = os.environ.get('CONTENT_JOURNAL_PATH', 'content_journal.sqlite3')
+# Other workers' changes are checked for every CONTENT_POLL_INTERVAL seconds when
+# idle; after a change, every CONTENT_POLL_MIN_INTERVAL, backing off by doubling
+app.config['CONTENT_POLL_INTERVAL'] = 0.5
+app.config['CONTENT_POLL_MIN_INTERVAL'] = 0.01
+# Background jobs (section 3j): queue name -> threads per process, plus a forked
+# pool of `processes` for CPU-bound work
+app.config['JOBS_DB_PATH'] = os.environ.get('JOBS_DB_PATH', 'jobs.sqlite3')
+app.config['JOB_QUEUES'] = {
+    'default': {'threads': 2},
+    'media': {'threads': 1, 'processes': 1},
+    'maintenance': {'threads': 1},
+}
+app.config['JOB_POLL_INTERVAL'] = 2                # seconds; enqueueing wakes the local runner at once
+app.config['JOB_LEASE'] = 300                      # renewed while the job runs; taken over once it lapses
+app.config['JOB_TIMEOUT'] = 30 * 60                # pool workers still running a job after 30 min are killed
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_RETRY_BASE_DELAY'] = 10            # 10s, 20s, 40s... (with jitter)
+app.config['JOB_RETENTION'] = 24 * 3600            # finished jobs stay visible for a day
+app.config['CACHE_WARMUP_INTERVAL'] = 3600
+app.config['ACTIVITY_LOG_LIMIT'] = 1000            # older entries are rotated out
+# Metrics (/metrics): each process writes its counters to METRICS_DIR, the
+# scrape adds them up. Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>".
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', 'metrics')
+app.config['METRICS_FLUSH_INTERVAL'] = 1
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# Server-Timing header: always for admins, and for this share of other requests
+app.config['SERVER_TIMING_SAMPLE_RATE'] = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0))
+# Request profiles (section 3l): the PROFILE_KEEP slowest sampled ones and the
+# PROFILE_KEEP latest requested ones are kept. "X-Profile: <PROFILE_TOKEN>"
+# profiles a request without an admin session.
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_KEEP'] = 20
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+# Memory budgets (section 3m): collection -> (deep size in bytes, action). Over
+# budget, 'warn' logs a warning; 'evict' also drops entries (logs and caches only).
+app.config['MEMORY_BUDGETS'] = {
+    'activity_logs': (4 * 1024 * 1024, 'evict'),
+    'upload_catalogue': (16 * 1024 * 1024, 'evict'),
+    'users': (16 * 1024 * 1024, 'warn'),
+    'destinations': (64 * 1024 * 1024, 'warn'),
+    'culture': (64 * 1024 * 1024, 'warn'),
+    'custom_pages': (64 * 1024 * 1024, 'warn'),
+    'media_references': (16 * 1024 * 1024, 'warn'),
+}
+app.config['MEMORY_CHECK_INTERVAL'] = 300
+app.config['MEMORY_TRACE_SECONDS'] = 60            # default tracemalloc window
+
+
+class PooledConnection(Connection):
+    """
+    A Flask-Mail connection owned by an SMTPConnectionPool. Leaving the `with`
+    block hands it back to the pool instead of sending QUIT.
+    """
+    def __init__(self, state, pool):
+        super().__init__(state)
+        self.pool = pool
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.pool.release(self, discard=self.broken or exc_type is not None)
+
+    def is_alive(self):
+        if self.host is None:
+            return self.mail.suppress
+        try:
+            return self.host.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        if self.host is None:
+            return
+        try:
+            self.host.quit()
+        except (smtplib.SMTPException, OSError):
+            self.host.close()
+        self.host = None
+
+
+class SMTPConnectionPool:
+    """
+    Keeps up to `size` authenticated SMTP connections so consecutive sends skip
+    the connect/STARTTLS/LOGIN handshake. Idle connections are closed after
+    `idle_timeout` seconds and NOOP-checked before reuse after `check_after`.
+    """
+    def __init__(self, state, size, idle_timeout, check_after):
+        self.state = state
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=60):
+        if not self.slots.acquire(timeout=timeout):
+            raise RuntimeError("SMTP connection pool exhausted")
+        try:
+            while True:
+                with self.lock:
+                    conn = self.idle.pop() if self.idle else None
+                if conn is None:
+                    conn = PooledConnection(self.state, self)
+                    if not self.state.suppress:
+                        conn.host = conn.configure_host()
+                    return conn
+                idle_for = time.monotonic() - conn.last_used
+                if idle_for > self.idle_timeout or (idle_for > self.check_after and not conn.is_alive()):
+                    conn.close()
+                    continue
+                return conn
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        if discard:
+            conn.close()
+        else:
+            conn.last_used = time.monotonic()
+            with self.lock:
+                self.idle.append(conn)
+        self.slots.release()
+
+    def close_all(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+    def forget_all(self):
+        """
+        Drops pooled sockets without QUIT: called in forked children, where the
+        sockets still belong to the parent process.
+        """
+        self.idle = []
+        self.lock = threading.Lock()
+
+
+class PooledMail(Mail):
+    """
+    Flask-Mail with a shared SMTP connection pool. `mail.send()` and
+    `mail.connect()` keep their usual API; a send that hits a dropped
+    connection is retried once on a fresh one.
+    """
+    def init_app(self, app):
+        state = super().init_app(app)
+        self.pool = SMTPConnectionPool(
+            state,
+            app.config['MAIL_POOL_SIZE'],
+            app.config['MAIL_POOL_IDLE_TIMEOUT'],
+            app.config['MAIL_POOL_CHECK_AFTER']
+        )
+        os.register_at_fork(after_in_child=self.pool.forget_all)
+        return state
+
+    def connect(self):
+        return self.pool.acquire()
+
+    def send(self, message):
+        for attempt in (1, 2):
+            with self.connect() as connection:
+                try:
+                    message.send(connection)
+                    return
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    connection.broken = True
+                    if attempt == 2:
+                        raise
+
+# Bound to the app by create_app()
+mail = PooledMail()
 
 ###########################################################
 #  2. Dummy Data Structures (emulating a simple DB)
 ###########################################################
 
+SEED_NAMESPACE = uuid.UUID('6f1c2a52-3c0e-4d4b-9a57-2e1f0c8d5b3e')
+
+def seed_id(collection, key):
+    """
+    Stable id for a seed item: the same in every worker and after a restart,
+    so that content changes recorded against it (section 3i) still apply.
+    """
+    return str(uuid.uuid5(SEED_NAMESPACE, f"{collection}/{key}"))
+
 # Users
 # ------------------------------------------------------------------------------
 users = [
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('users', "issou"),
         "username": "issou",  # Example admin user
-        "password": generate_password_hash("12"),  # Example admin password
+        "password": None,  # hashed by create_app() from SEED_ADMIN_PASSWORD
         "role": "admin"
     }
 ]
@@ -71,35 +406,35 @@ users = [
 # ------------------------------------------------------------------------------
 destinations = [
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('destinations', "Agadez"),
         "nom": "Agadez",
         "description": "Porte du désert, connue pour sa Grande Mosquée et le festival Cure Salée.",
         "image": "/static/uploads/agadez.jpg",
         "order": 1
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('destinations', "Niamey"),
         "nom": "Niamey",
         "description": "Capitale animée du Niger, avec son grand marché et le Musée National.",
         "image": "/static/uploads/niamey.jpg",
         "order": 2
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('destinations', "Le Parc National du W"),
         "nom": "Le Parc National du W",
         "description": "Magnifique réserve naturelle abritant une faune diversifiée.",
         "image": "/static/uploads/parc_w.jpg",
         "order": 3
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('destinations', "Zinder"),
         "nom": "Zinder",
         "description": "Ancienne capitale, riche en histoire et en culture, avec son palais du Sultan.",
         "image": "/static/uploads/zinder.jpg",
         "order": 4
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('destinations', "Arbre du Ténéré (disparu)"),
         "nom": "Arbre du Ténéré (disparu)",
         "description": "Autrefois l'arbre le plus isolé du monde, un symbole du Sahara.",
         "image": "/static/uploads/arbre_tenere.jpg",
@@ -111,25 +446,25 @@ destinations = [
 # ------------------------------------------------------------------------------
 culture = [
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('culture', "Les Touaregs"),
         "nom": "Les Touaregs",
         "description": "Peuple nomade du Sahara, connu pour sa culture et ses traditions uniques.",
         "image": None
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('culture', "La musique Haoussa"),
         "nom": "La musique Haoussa",
         "description": "Rythmes vibrants et chants traditionnels de l'ethnie Haoussa.",
         "image": None
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('culture', "L'artisanat nigérien"),
         "nom": "L'artisanat nigérien",
         "description": "Travail du cuir, poterie, tissage, reflétant le savoir-faire local.",
         "image": None
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": seed_id('culture', "Les fêtes traditionnelles"),
         "nom": "Les fêtes traditionnelles",
         "description": "Célébrations colorées marquant les événements importants de la vie communautaire.",
         "image": None
@@ -179,13 +514,59 @@ site_settings = {
     "footer_text": "© 2025 Tourisme Niger. Tous droits réservés."
 }
 
+# Request profiling, set from /manage/profiling (share of requests profiled)
+# ------------------------------------------------------------------------------
+profiler_settings = {
+    "sample_rate": 0.0
+}
+
 # Activity log: store admin actions
 # ------------------------------------------------------------------------------
 activity_logs = []
 
-# Contact messages
+# Contact messages live in an SQLite store (see section 3e)
+
+# Reply templates for bulk answers ({nom}, {email} and {message} are substituted)
+# ------------------------------------------------------------------------------
+reply_templates = [
+    {
+        "id": seed_id('reply_templates', "Remerciement"),
+        "name": "Remerciement",
+        "subject": "Réponse à votre message",
+        "body": (
+            "Bonjour {nom},\n\n"
+            "Merci pour votre message. Notre équipe revient vers vous très rapidement.\n\n"
+            "Cordialement,\nL'équipe de Tourisme Niger"
+        )
+    },
+    {
+        "id": seed_id('reply_templates', "Informations visa"),
+        "name": "Informations visa",
+        "subject": "Votre demande d'informations",
+        "body": (
+            "Bonjour {nom},\n\n"
+            "Les conditions de visa dépendent de votre nationalité. Nous vous invitons à "
+            "contacter l'ambassade du Niger la plus proche et à consulter notre page "
+            "Infos Pratiques.\n\n"
+            "Cordialement,\nL'équipe de Tourisme Niger"
+        )
+    }
+]
+
+# Upload catalogue: metadata probed from each file of the upload folder
+# ------------------------------------------------------------------------------
+upload_catalogue = {
+    # Example:
+    # "clip.mp4": {"kind": "video", "width": 1280, "height": 720, "duration": 42.0,
+    #              "size": 1048576, "mtime": 1719130000000000000}
+}
+
+# Media references: upload filename -> {(collection, item id), ...} using it,
+# plus the reverse mapping so an item's old references can be dropped on save
 # ------------------------------------------------------------------------------
-messages = []
+media_references = {}
+media_owner_files = {}
+media_refs_lock = threading.Lock()
 
 ###########################################################
 #  3. Helper Functions
@@ -212,136 +593,3468 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Server-Timing phases, in header order, with their devtools label (ASCII:
+# header values are Latin-1)
+SERVER_TIMING_PHASES = {
+    'db': "SQLite",
+    'files': "Uploads",
+    'data': "Filtrage et tri",
+    'content': "Contenu",
+    'layout': "Mise en page",
+}
+
+@contextmanager
+def server_timing(phase):
+    """
+    Adds the time spent in the block to `phase` of the Server-Timing header,
+    when timing is on for the current request (a no-op otherwise). Time spent
+    in a nested phase is counted only there.
+    """
+    stack = g.get('timing_stack') if has_request_context() else None
+    if stack is None:
+        yield
+        return
+    entry = [phase, time.perf_counter(), 0.0]
+    stack.append(entry)
+    try:
+        yield
+    finally:
+        close_timing_phase(stack)
+
+def close_timing_phase(stack):
+    phase, started, nested = stack.pop()
+    elapsed = time.perf_counter() - started
+    g.timing_totals[phase] = g.timing_totals.get(phase, 0) + elapsed - nested
+    if stack:
+        stack[-1][2] += elapsed
+
+def timed(phase):
+    """
+    Decorator: the function's calls count towards a Server-Timing phase.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with server_timing(phase):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def media_url(path: str) -> str:
+    """
+    Maps a "/static/uploads/<file>" path to the range-aware /media/<file> route.
+    Any other path (external URL, missing value) is returned unchanged.
+    """
+    prefix = '/static/uploads/'
+    if path and path.startswith(prefix):
+        return '/media/' + path[len(prefix):]
+    return path
+
+def iter_file_range(file, start, length, chunk_size):
+    """
+    Yields `length` bytes of `file` starting at `start`, then closes the file.
+    Used for bounded byte ranges that the server cannot hand to sendfile().
+    """
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
 
 ###########################################################
-#  4. Global HTML Template Rendering
+#  3b. Media Metadata (header probe, no decoding)
 ###########################################################
 
-def render_page(title, content, active_page=None):
+def probe_jpeg(f):
     """
-    Renders a full-page HTML layout with a sidebar, navbar, footer, and given content.
-    `title` is for the <title> tag, while `content` is inserted as the main body.
-    `active_page` highlights the corresponding link in the nav.
+    Reads the SOFn segment of a JPEG for its size. EXIF orientations 5-8
+    rotate the picture by 90°, so width and height are swapped for those.
     """
-    # Generate sidebar items
-    sidebar_items = [
-        ('Accueil', '/'),
-        ('Destinations', '/destinations'),
-        ('Culture', '/culture'),
-        ('Infos Pratiques', '/infos-pratiques'),
-        ('Contact', '/contact'),
-    ]
-
-    # Extend items if user is logged in
-    if session.get('logged_in'):
-        sidebar_items.extend([
-            ('Gestion', '/manage'),
-            ('Déconnexion', '/logout')
-        ])
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0x01, 0xd8) or 0xd0 <= marker <= 0xd7:
+            continue
+        if marker == 0xd9:
+            return None
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker == 0xe1:
+            segment = f.read(length - 2)
+            orientation = exif_orientation(segment) or orientation
+            continue
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            height, width = struct.unpack('>HH', data[1:5])
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return {"kind": "image", "width": width, "height": height}
+        f.seek(length - 2, os.SEEK_CUR)
+
+def exif_orientation(segment):
+    """
+    Returns the Orientation tag (0x0112) of an APP1/Exif segment, if present.
+    """
+    if not segment.startswith(b'Exif\x00\x00') or len(segment) < 14:
+        return None
+    tiff = segment[6:]
+    endian = '<' if tiff[:2] == b'II' else '>'
+    try:
+        ifd_offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+        count = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(count):
+            entry = tiff[ifd_offset + 2 + 12 * i:ifd_offset + 14 + 12 * i]
+            tag, _type, _count, value = struct.unpack(endian + 'HHIH', entry[:10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        return None
+    return None
+
+def probe_png(f):
+    """
+    Reads width and height from the IHDR chunk of a PNG.
+    """
+    f.seek(0)
+    data = f.read(24)
+    if len(data) < 24 or data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return {"kind": "image", "width": width, "height": height}
+
+def probe_gif(f):
+    """
+    Reads the logical screen size of a GIF.
+    """
+    f.seek(0)
+    data = f.read(10)
+    if len(data) < 10:
+        return None
+    width, height = struct.unpack('<HH', data[6:10])
+    return {"kind": "image", "width": width, "height": height}
+
+def probe_webp(f):
+    """
+    Reads the canvas size of a lossy (VP8), lossless (VP8L) or extended (VP8X) WebP.
+    """
+    f.seek(0)
+    data = f.read(30)
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        width, height = width & 0x3fff, height & 0x3fff
+    elif chunk == b'VP8L' and data[20] == 0x2f:
+        bits = struct.unpack('<I', data[21:25])[0]
+        width, height = (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    elif chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
     else:
-        sidebar_items.extend([
-            ('Connexion', '/login'),
-            ('Inscription', '/register')
-        ])
+        return None
+    return {"kind": "image", "width": width, "height": height}
 
-    # Generate the HTML for the sidebar links
-    def icon_for_label(label):
-        """
-        A small helper to add relevant icons depending on the label.
-        """
-        if label == "Accueil":
-            return "home"
-        elif label == "Destinations":
-            return "map"
-        elif label == "Culture":
-            return "culture"  # (not a real FA icon, you can pick another if you want)
-        elif label == "Infos Pratiques":
-            return "info-circle"
-        elif label == "Contact":
-            return "envelope"
-        elif label == "Gestion":
-            return "cogs"
-        elif label == "Connexion":
-            return "sign-in-alt"
-        elif label == "Inscription":
-            return "user-plus"
-        elif label == "Déconnexion":
-            return "sign-out-alt"
-        return "file"
+def iter_mp4_boxes(f, start, end):
+    """
+    Yields (type, payload_offset, payload_end) for each ISO-BMFF box in [start, end).
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        payload = offset + 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            size = end - offset
+        if size < payload - offset:
+            return
+        yield box_type, payload, min(offset + size, end)
+        offset += size
+
+def probe_mp4(f, file_size):
+    """
+    Reads duration from moov/mvhd and the video size from the first trak/tkhd
+    with non-zero dimensions. The media data (mdat) is skipped, never read.
+    """
+    info = {"kind": "video", "width": None, "height": None, "duration": None}
+    for box_type, start, end in iter_mp4_boxes(f, 0, file_size):
+        if box_type != b'moov':
+            continue
+        for child, c_start, c_end in iter_mp4_boxes(f, start, end):
+            if child == b'mvhd':
+                f.seek(c_start)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(16, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>IQ', f.read(12))
+                else:
+                    f.seek(8, os.SEEK_CUR)
+                    timescale, duration = struct.unpack('>II', f.read(8))
+                if timescale:
+                    info['duration'] = round(duration / timescale, 3)
+            elif child == b'trak' and info['width'] is None:
+                for leaf, l_start, l_end in iter_mp4_boxes(f, c_start, c_end):
+                    if leaf == b'tkhd' and l_end - l_start >= 8:
+                        f.seek(l_end - 8)
+                        width, height = struct.unpack('>II', f.read(8))
+                        if width and height:
+                            info['width'], info['height'] = width >> 16, height >> 16
+        break
+    return info
+
+# Matroska / WebM element IDs used by probe_webm()
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_VIDEO = 0xE0
+EBML_CLUSTER = 0x1F43B675
+
+def read_ebml_vint(f, keep_marker=False):
+    """
+    Reads an EBML variable-length integer. IDs keep their length marker bit,
+    sizes drop it; an all-ones size means "unknown" and is returned as None.
+    """
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first[0] & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("invalid EBML integer")
+    value = first[0] if keep_marker else first[0] & (mask - 1)
+    rest = f.read(length - 1)
+    for b in rest:
+        value = (value << 8) | b
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None
+    return value
+
+def probe_webm(f, file_size):
+    """
+    Walks the EBML tree down to Segment/Info (duration) and
+    Segment/Tracks/TrackEntry/Video (pixel size), stopping at the first Cluster.
+    """
+    info = {"kind": "video", "width": None, "height": None, "duration": None}
+    timecode_scale = 1000000
+    duration = None
+    containers = {EBML_SEGMENT, EBML_INFO, EBML_TRACKS, EBML_TRACK_ENTRY, EBML_VIDEO}
+    f.seek(0)
+    end = file_size
+    try:
+        while f.tell() < end:
+            element_id = read_ebml_vint(f, keep_marker=True)
+            size = read_ebml_vint(f)
+            if element_id == EBML_CLUSTER:
+                break
+            if element_id in containers:
+                continue  # descend: children follow immediately
+            if size is None:
+                break
+            if element_id not in (0x2AD7B1, 0x4489, 0xB0, 0xBA):
+                f.seek(size, os.SEEK_CUR)
+                continue
+            data = f.read(size)
+            if element_id == 0x2AD7B1:  # TimecodeScale
+                timecode_scale = int.from_bytes(data, 'big')
+            elif element_id == 0x4489:  # Duration
+                duration = struct.unpack('>f' if size == 4 else '>d', data)[0]
+            elif element_id == 0xB0 and info['width'] is None:  # PixelWidth
+                info['width'] = int.from_bytes(data, 'big')
+            elif element_id == 0xBA and info['height'] is None:  # PixelHeight
+                info['height'] = int.from_bytes(data, 'big')
+    except (EOFError, ValueError, struct.error):
+        pass
+    if duration is not None:
+        info['duration'] = round(duration * timecode_scale / 1e9, 3)
+    return info
+
+def probe_media(file_path):
+    """
+    Identifies a file from its magic bytes and returns its intrinsic metadata
+    ({"kind", "width", "height"[, "duration"]}) or None for unknown formats.
+    Only headers and container atoms are read, never the pixel/sample data.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            head = f.read(16)
+            if head.startswith(b'\xff\xd8'):
+                return probe_jpeg(f)
+            if head.startswith(b'\x89PNG\r\n\x1a\n'):
+                return probe_png(f)
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return probe_gif(f)
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                return probe_webp(f)
+            if head[4:8] == b'ftyp':
+                return probe_mp4(f, size)
+            if head.startswith(b'\x1a\x45\xdf\xa3'):
+                return probe_webm(f, size)
+    except (OSError, struct.error, IndexError):
+        return None
+    return None
+
+def get_media_info(filename):
+    """
+    Returns the catalogue entry of an uploaded file, probing it again only when
+    its size or modification time changed. Missing files are dropped from the catalogue.
+    """
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        upload_catalogue.pop(filename, None)
+        return None
+    entry = upload_catalogue.get(filename)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        record_cache_lookup('media_catalogue', True)
+        return entry
+    record_cache_lookup('media_catalogue', False)
+    entry = probe_media(file_path) or {"kind": None, "width": None, "height": None}
+    if entry['kind'] == 'image':
+        entry['placeholder'] = image_placeholder(filename)
+    entry['size'] = stat.st_size
+    entry['mtime'] = stat.st_mtime_ns
+    upload_catalogue[filename] = entry
+    return entry
+
+def media_info_for_path(path):
+    """
+    Catalogue lookup for a "/static/uploads/<file>" path as stored on destinations,
+    culture items and homepage media.
+    """
+    prefix = '/static/uploads/'
+    if not path or not path.startswith(prefix):
+        return None
+    return get_media_info(path[len(prefix):])
 
-    sidebar_html = ''.join([
-        f'''
-        <a href="{url}" 
-           class="{"active" if active_page == label else ""}">
-           <i class="fa fa-{icon_for_label(label)} me-2"></i>{label}
-        </a>
-        '''
-        for (label, url) in sidebar_items
-    ])
+def size_attrs(path):
+    """
+    Returns ' width="…" height="…"' for an uploaded image/video when known, so the
+    browser can reserve the box before the file arrives.
+    """
+    info = media_info_for_path(path)
+    if info and info.get('width') and info.get('height'):
+        return f' width="{info["width"]}" height="{info["height"]}"'
+    return ''
 
-    # Generate flash messages
-    flash_messages = ''.join([
-        f'''
-        <div class="alert alert-{category} alert-dismissible fade show" role="alert">
-            {message}
-            <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+def image_placeholder(filename):
+    """
+    The placeholder of an uploaded image. It is computed once and saved with
+    the upload's other derivatives ("<filename>.lqip", empty when the image has
+    none), where every worker finds it, also after a restart.
+    """
+    source = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    target = os.path.join(derivatives_folder(), filename + '.lqip')
+    try:
+        if os.path.getmtime(target) >= os.path.getmtime(source):
+            with open(target, encoding='ascii') as f:
+                return f.read() or None
+    except OSError:
+        pass
+    placeholder = compute_placeholder(source)
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(derivatives_folder(), exist_ok=True)
+        with open(tmp, 'w', encoding='ascii') as f:
+            f.write(placeholder or '')
+        os.replace(tmp, target)
+    except OSError:
+        app.logger.warning("Could not save the placeholder of %s", filename)
+    return placeholder
+
+def compute_placeholder(file_path):
+    """
+    Builds a low-quality image placeholder: the picture shrunk to 16px, blurred
+    and re-encoded as a data URI of a few hundred bytes. JPEGs are decoded at
+    reduced scale (draft mode), so even large photos cost only a few milliseconds.
+    Returns None without Pillow, or for images with transparency.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(file_path) as im:
+            im.draft('RGB', (64, 64))
+            if im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info:
+                return None
+            im = ImageOps.exif_transpose(im).convert('RGB')
+            im.thumbnail((16, 16))
+            im = im.filter(ImageFilter.GaussianBlur(1))
+            buffer = io.BytesIO()
+            im.save(buffer, 'JPEG', quality=50, optimize=True)
+    except (OSError, ValueError):
+        return None
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def image_attrs(path, lazy=True):
+    """
+    Extra <img> attributes for an uploaded image: intrinsic size, async decoding,
+    native lazy-loading for below-the-fold images and the blurred placeholder
+    painted as background until the real pixels arrive.
+    """
+    attrs = size_attrs(path) + ' decoding="async"'
+    if lazy:
+        attrs += ' loading="lazy"'
+    info = media_info_for_path(path)
+    if info and info.get('placeholder'):
+        attrs += f' style="background: url({info["placeholder"]}) center / cover no-repeat;"'
+    return attrs
+
+def format_duration(seconds):
+    """
+    Formats a duration in seconds as m:ss (or h:mm:ss).
+    """
+    if seconds is None:
+        return ''
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+def uploaded_file_preview(filename):
+    """
+    Card header for the dashboard file list: the image itself with its intrinsic
+    size, or for videos a lightweight summary (size, duration) instead of a player.
+    """
+    info = get_media_info(filename) or {}
+    if filename.rsplit('.', 1)[-1].lower() not in VIDEO_EXTENSIONS:
+        return (
+            f'<img src="/static/uploads/{filename}" class="card-img-top" alt="{filename}"'
+            f'{image_attrs("/static/uploads/" + filename)}>'
+        )
+    details = ' · '.join(filter(None, [
+        f'{info["width"]}×{info["height"]}' if info.get('width') else '',
+        format_duration(info.get('duration'))
+    ]))
+    return f"""
+    <a href="/media/{filename}" target="_blank"
+       class="card-img-top d-flex flex-column align-items-center justify-content-center bg-dark text-white text-decoration-none">
+        <i class="fa fa-film fa-2x mb-2"></i>
+        <small>{details or 'Vidéo'}</small>
+    </a>
+    """
+
+# Suffixes of the files generated from an upload: "<upload><suffix>"
+DERIVATIVE_SUFFIXES = ('.lqip', '.thumb.jpg')
+
+def derivatives_folder():
+    """
+    Where files generated from uploads (placeholders, thumbnails, posters...)
+    go, named "<upload><suffix>" (DERIVATIVE_SUFFIXES).
+    """
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'derived')
+
+def thumbnail_path(filename):
+    return os.path.join(derivatives_folder(), filename + '.thumb.jpg')
+
+def can_thumbnail(filename):
+    """
+    Tells whether a thumbnail can be generated here: images need Pillow,
+    videos need an ffmpeg binary (FFMPEG_BINARY) to grab a poster frame.
+    """
+    if filename.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+        return bool(app.config.get('FFMPEG_BINARY'))
+    return Image is not None
+
+def ensure_thumbnail(filename):
+    """
+    Returns the path of a small JPEG preview of an upload, generating it on first
+    use (and again when the upload changes). Videos get their poster frame taken
+    one second in, or at the start of very short clips. Returns None on failure.
+    """
+    source = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    target = thumbnail_path(filename)
+    try:
+        source_mtime = os.path.getmtime(source)
+    except OSError:
+        return None
+    if os.path.exists(target) and os.path.getmtime(target) >= source_mtime:
+        record_cache_lookup('thumbnails', True)
+        return target
+    record_cache_lookup('thumbnails', False)
+    if not can_thumbnail(filename):
+        return None
+
+    os.makedirs(derivatives_folder(), exist_ok=True)
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    max_width, max_height = app.config['THUMBNAIL_SIZE']
+    try:
+        if filename.rsplit('.', 1)[-1].lower() in VIDEO_EXTENSIONS:
+            info = get_media_info(filename) or {}
+            seek = 1 if (info.get('duration') or 0) > 2 else 0
+            subprocess.run(
+                [
+                    app.config['FFMPEG_BINARY'], '-loglevel', 'error', '-y',
+                    '-ss', str(seek), '-i', source, '-frames:v', '1',
+                    '-vf', f'scale={max_width}:-2', '-f', 'image2', '-c:v', 'mjpeg', tmp
+                ],
+                check=True,
+                timeout=30,
+                stdin=subprocess.DEVNULL
+            )
+        else:
+            with Image.open(source) as im:
+                im.draft('RGB', (max_width, max_height))
+                im = ImageOps.exif_transpose(im).convert('RGB')
+                im.thumbnail((max_width, max_height))
+                im.save(tmp, 'JPEG', quality=75, optimize=True)
+        os.replace(tmp, target)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        app.logger.warning("Thumbnail generation failed for %s", filename)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    return target
+
+@timed('files')
+def list_uploads(kind=None, query='', date_from=None, date_to=None):
+    """
+    Lists uploads as dicts {"name", "kind", "size", "mtime"}, newest first, filtered
+    by kind ('image' / 'video'), a case-insensitive name fragment and an mtime range.
+    Only directory entries are read here; media headers are probed per page later.
+    """
+    query = query.lower()
+    uploads = []
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            if not entry.is_file() or '.' not in entry.name:
+                continue
+            file_kind = (
+                'video'
+                if entry.name.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
+                else 'image'
+            )
+            if kind and file_kind != kind:
+                continue
+            if query and query not in entry.name.lower():
+                continue
+            stat = entry.stat()
+            if date_from and stat.st_mtime < date_from.timestamp():
+                continue
+            if date_to and stat.st_mtime >= date_to.timestamp():
+                continue
+            uploads.append({
+                "name": entry.name,
+                "kind": file_kind,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            })
+    uploads.sort(key=lambda u: u['mtime'], reverse=True)
+    return uploads
+
+def media_preview(filename, css_class='card-img-top'):
+    """
+    Lightweight preview for admin listings: the generated thumbnail when possible,
+    otherwise the lazy-loaded original image or the video summary card.
+    """
+    if can_thumbnail(filename):
+        return (
+            f'<img src="/media/thumbs/{filename}" class="{css_class}" alt="{filename}" '
+            f'loading="lazy" decoding="async">'
+        )
+    return uploaded_file_preview(filename)
+
+def media_card(upload):
+    """
+    Dashboard card for one entry of list_uploads(): preview, name, details,
+    how many items use it and the delete button.
+    """
+    name = upload['name']
+    info = get_media_info(name) or {}
+    details = ' · '.join(filter(None, [
+        f'{info["width"]}×{info["height"]}' if info.get('width') else '',
+        format_duration(info.get('duration')),
+        f"{upload['size'] / 1024:.0f} Ko",
+        datetime.fromtimestamp(upload['mtime']).strftime("%Y-%m-%d")
+    ]))
+    return f"""
+    <div class="col-md-3 mb-4">
+        <div class="card dashboard-card h-100">
+            {media_preview(name)}
+            <div class="card-body text-center">
+                <p class="card-text text-break mb-1">
+                    <a href="/static/uploads/{name}" target="_blank">{name}</a>
+                </p>
+                <p class="small text-muted mb-1">{details}</p>
+                <p class="small text-muted">
+                    {f'Utilisé par {len(media_references[name])} élément(s)'
+                     if name in media_references else 'Non utilisé'}
+                </p>
+                <a href="/manage/delete_uploaded_image/{name}"
+                   class="btn btn-danger btn-sm">
+                   <i class="fa fa-trash me-2"></i> Supprimer
+                </a>
+            </div>
         </div>
-        '''
-        for category, message in get_flashed_messages(with_categories=True)
-    ])
+    </div>
+    """
 
-    # Additional styles (Bootstrap & FontAwesome are loaded from a CDN)
-    style = f"""
-    <!-- Google Fonts -->
-    <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;600&family=Roboto&display=swap" rel="stylesheet">
-    <!-- Bootstrap CSS -->
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <!-- Font Awesome -->
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <!-- CKEditor (loaded in <body>) -->
-    <style>
-        body {{
-            font-family: 'Roboto', sans-serif;
-            background-color: #f0f2f5;
-        }}
-        h1, h2, h3, h4, h5, h6 {{
-            font-family: 'Montserrat', sans-serif;
-        }}
-        .navbar {{
-            background-color: {site_settings['color_primary']} !important;
-        }}
-        .navbar-brand {{
-            font-size: 1.5rem;
-            font-weight: bold;
-        }}
-        .sidebar {{
-            height: 100vh;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 250px;
-            background-color: {site_settings['color_secondary']};
-            padding-top: 70px;
-            transition: transform 0.3s ease-in-out;
-            z-index: 1000;
-        }}
-        .sidebar.collapsed {{
-            transform: translateX(-250px);
-        }}
-        .sidebar a {{
-            padding: 15px 20px;
-            display: block;
-            color: white;
-            text-decoration: none;
-            transition: background 0.3s;
-        }}
-        .sidebar a:hover {{
-            background-color: rgba(255, 255, 255, 0.1);
+def media_picker(field_name, current=None, allow_empty=False):
+    """
+    Searchable image picker for admin forms. The selected path is posted in a
+    hidden input named `field_name`; results come from /manage/media/search.
+    With `allow_empty`, the value "None" means "no image" (as the old <select> did).
+    """
+    current_name = upload_name(current) if current else None
+    empty_button = f"""
+        <button type="button" class="btn btn-outline-secondary btn-sm"
+                onclick="pickMedia('{field_name}', 'None', '')">Aucune image</button>
+    """ if allow_empty else ''
+    return f"""
+    <div class="media-picker border rounded p-2">
+        <input type="hidden" name="{field_name}" id="{field_name}"
+               value="{current or ('None' if allow_empty else '')}">
+        <div class="d-flex align-items-center gap-2 mb-2">
+            <img id="{field_name}_preview" alt="" width="80" height="60" style="object-fit: cover;"
+                 class="{'' if current_name else 'd-none'}"
+                 src="{f'/media/thumbs/{current_name}' if current_name and can_thumbnail(current_name) else (current or '')}">
+            <span id="{field_name}_label">{current_name or 'Aucune image sélectionnée'}</span>
+            {empty_button}
+        </div>
+        <input type="search" class="form-control form-control-sm mb-2"
+               placeholder="Rechercher une image..."
+               oninput="searchMedia('{field_name}', this.value)">
+        <div class="row g-2" id="{field_name}_results"></div>
+    </div>
+    <script>
+        var mediaSearchTimer = null;
+        function pickMedia(field, path, thumb) {{
+            document.getElementById(field).value = path;
+            var preview = document.getElementById(field + '_preview');
+            preview.src = thumb || path;
+            preview.classList.toggle('d-none', !thumb);
+            document.getElementById(field + '_label').textContent =
+                path === 'None' ? 'Aucune image' : path.split('/').pop();
         }}
-        .content {{
-            margin-left: 250px;
-            padding: 20px;
-            transition: margin-left 0.3s ease-in-out;
+        function searchMedia(field, query) {{
+            clearTimeout(mediaSearchTimer);
+            mediaSearchTimer = setTimeout(function() {{
+                fetch('/manage/media/search?type=image&q=' + encodeURIComponent(query))
+                    .then(response => response.json())
+                    .then(data => {{
+                        var results = document.getElementById(field + '_results');
+                        results.innerHTML = '';
+                        data.items.forEach(function(item) {{
+                            var col = document.createElement('div');
+                            col.className = 'col-3 col-md-2';
+                            var img = document.createElement('img');
+                            img.src = item.thumb || item.url;
+                            img.alt = item.name;
+                            img.title = item.name;
+                            img.loading = 'lazy';
+                            img.className = 'img-thumbnail';
+                            img.style.cursor = 'pointer';
+                            img.onclick = function() {{ pickMedia(field, item.url, img.src); }};
+                            col.appendChild(img);
+                            results.appendChild(col);
+                        }});
+                    }})
+                    .catch(error => {{
+                        console.error('Erreur:', error);
+                    }});
+            }}, 250);
+        }}
+        document.addEventListener('DOMContentLoaded', function() {{
+            searchMedia('{field_name}', '');
+        }});
+    </script>
+    """
+
+
+###########################################################
+#  3c. Media References (what uses each upload)
+###########################################################
+
+# Matches uploads linked from custom page HTML, either directly or through /media/
+UPLOAD_URL_RE = re.compile(r'/(?:static/uploads|media)/([^"\'\s<>?#)]+)')
+
+def upload_name(path):
+    """
+    Returns the upload filename behind a "/static/uploads/<file>" or "/media/<file>"
+    path, or None for anything else (external URL, empty value).
+    """
+    if not path:
+        return None
+    match = UPLOAD_URL_RE.search(path)
+    return unquote(match.group(1)) if match else None
+
+def set_media_references(collection, item_id, filenames):
+    """
+    Records that the item `item_id` of `collection` uses exactly `filenames`,
+    replacing whatever it referenced before. Call with an empty list on delete.
+    """
+    owner = (collection, item_id)
+    new_files = {f for f in filenames if f}
+    with media_refs_lock:
+        for filename in media_owner_files.pop(owner, set()) - new_files:
+            owners = media_references.get(filename)
+            if owners:
+                owners.discard(owner)
+                if not owners:
+                    del media_references[filename]
+        for filename in new_files:
+            media_references.setdefault(filename, set()).add(owner)
+        if new_files:
+            media_owner_files[owner] = new_files
+
+def index_destination(dest):
+    set_media_references('destinations', dest['id'], [upload_name(dest['image'])])
+
+def index_culture_item(item):
+    set_media_references('culture', item['id'], [upload_name(item['image'])])
+
+def index_homepage_media(media):
+    set_media_references('homepage_media', media['id'], [upload_name(media['path'])])
+
+def index_custom_page(page):
+    set_media_references(
+        'custom_pages',
+        page['id'],
+        [unquote(name) for name in UPLOAD_URL_RE.findall(page['content'])]
+    )
+
+def rebuild_media_references():
+    """
+    Rebuilds the whole reference index from the content collections.
+    """
+    with media_refs_lock:
+        media_references.clear()
+        media_owner_files.clear()
+    for dest in destinations:
+        index_destination(dest)
+    for item in culture:
+        index_culture_item(item)
+    for media in homepage_media:
+        index_homepage_media(media)
+    for page in custom_pages:
+        index_custom_page(page)
+
+def media_usages(filename):
+    """
+    Human-readable list of what references an upload, e.g. ["Destination: Agadez"].
+    An empty list means the file is safe to delete.
+    """
+    with media_refs_lock:
+        owners = sorted(media_references.get(filename, ()))
+    labels = {
+        'destinations': ('Destination', destinations, 'nom'),
+        'culture': ('Culture', culture, 'nom'),
+        'homepage_media': ('Accueil', homepage_media, 'title'),
+        'custom_pages': ('Page', custom_pages, 'title'),
+    }
+    usages = []
+    for collection, item_id in owners:
+        label, items, field = labels[collection]
+        item = next((i for i in items if i['id'] == item_id), None)
+        usages.append(f"{label}: {(item or {}).get(field) or item_id}")
+    return usages
+
+def delete_upload(filename, defer_derivatives=False):
+    """
+    Removes an upload together with its derivatives (catalogue entry and the
+    generated files "<filename><suffix>" in derivatives_folder()). With
+    `defer_derivatives` the generated files are left to a background job.
+    Raises FileNotFoundError if the upload itself does not exist.
+    """
+    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    upload_catalogue.pop(filename, None)
+    if defer_derivatives:
+        enqueue_job('remove_derivatives', filename)
+    else:
+        remove_derivatives(filename)
+
+def remove_derivatives(filename):
+    """
+    Deletes the generated files ("<filename><suffix>") of an upload that was
+    removed. Exact names only: the derivatives of "a.jpg.png" are not those of "a.jpg".
+    """
+    for suffix in DERIVATIVE_SUFFIXES:
+        try:
+            os.remove(os.path.join(derivatives_folder(), filename + suffix))
+        except FileNotFoundError:
+            pass
+
+def sweep_orphaned_media(grace_seconds=None):
+    """
+    Deletes uploads that nothing references and that are older than the grace
+    period (freshly uploaded files are usually linked a few minutes later).
+    Returns the list of removed filenames.
+    """
+    if grace_seconds is None:
+        grace_seconds = app.config['MEDIA_ORPHAN_GRACE']
+    cutoff = time.time() - grace_seconds
+    removed = []
+    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if not os.path.isfile(file_path):
+            continue
+        with media_refs_lock:
+            referenced = filename in media_references
+        try:
+            if referenced or os.path.getmtime(file_path) > cutoff:
+                continue
+            delete_upload(filename)
+        except FileNotFoundError:
+            continue
+        removed.append(filename)
+    if removed:
+        activity_logs.append({
+            "user": "Système",
+            "action": f"Nettoyage des médias orphelins: {len(removed)} fichier(s)",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+    return removed
+
+###########################################################
+#  3d. Mail Outbox (persist first, deliver in background)
+###########################################################
+
+# Outbox statuses: pending -> sending -> sent, or back to pending with a delay
+# after a failure, and dead once MAIL_MAX_ATTEMPTS is reached.
+OUTBOX_STATUS_LABELS = {
+    'pending': ('En attente', 'secondary'),
+    'sending': ('En cours', 'info'),
+    'sent': ('Envoyé', 'success'),
+    'dead': ('Échec définitif', 'danger'),
+}
+
+# Set whenever a message is enqueued so the worker does not wait for its next poll
+outbox_wakeup = threading.Event()
+
+def outbox_connect():
+    conn = sqlite3.connect(app.config['MAIL_OUTBOX_PATH'], timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_outbox():
+    """
+    Creates the outbox table. WAL mode lets the request threads enqueue while
+    the worker is delivering.
+    """
+    with closing(outbox_connect()) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                subject TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                body TEXT NOT NULL,
+                sender TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                context TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL,
+                batch_id TEXT
+            )
+        """)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if 'batch_id' not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN batch_id TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_batch ON outbox (batch_id, status)"
+        )
+
+def enqueue_mail(subject, recipients, body, sender=None, context=None):
+    """
+    Stores an email in the outbox and wakes the delivery worker. Returns the
+    outbox id immediately; SMTP latency or failures never reach the caller.
+    `context` is free-form (e.g. the contact message answered) and shown in the dashboard.
+    """
+    mail_id = str(uuid.uuid4())
+    now = time.time()
+    with closing(outbox_connect()) as conn, conn:
+        conn.execute(
+            "INSERT INTO outbox (id, subject, recipients, body, sender, next_attempt_at, "
+            "context, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (mail_id, subject, json.dumps(recipients), body, sender, now,
+             json.dumps(context or {}), now)
+        )
+    outbox_wakeup.set()
+    return mail_id
+
+def enqueue_mail_batch(mails, batch_id=None):
+    """
+    Stores many emails in one transaction, all tagged with `batch_id` so their
+    delivery can be followed with outbox_batch_progress(). `mails` is a list of
+    dicts with the enqueue_mail() arguments. Returns the batch id.
+    """
+    batch_id = batch_id or str(uuid.uuid4())
+    now = time.time()
+    with closing(outbox_connect()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO outbox (id, subject, recipients, body, sender, next_attempt_at, "
+            "context, created_at, batch_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (str(uuid.uuid4()), m['subject'], json.dumps(m['recipients']), m['body'],
+                 m.get('sender'), now, json.dumps(m.get('context') or {}), now, batch_id)
+                for m in mails
+            ]
+        )
+    outbox_wakeup.set()
+    return batch_id
+
+@timed('db')
+def outbox_batch_progress(batch_id):
+    """
+    Delivery counts for a batch: {"total": n, "pending": .., "sending": .., "sent": .., "dead": ..}.
+    """
+    with closing(outbox_connect()) as conn:
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM outbox WHERE batch_id = ? GROUP BY status",
+            (batch_id,)
+        ).fetchall())
+    progress = {status: counts.get(status, 0) for status in OUTBOX_STATUS_LABELS}
+    progress['total'] = sum(counts.values())
+    return progress
+
+def claim_outbox_batch(limit):
+    """
+    Atomically takes up to `limit` due messages. Claimed rows get a lease
+    (MAIL_OUTBOX_LEASE) so another worker, or this one after a crash, picks
+    them up again only if delivery never completed.
+    """
+    now = time.time()
+    with closing(outbox_connect()) as conn:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status IN ('pending', 'sending') "
+                "AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?",
+                [(now + app.config['MAIL_OUTBOX_LEASE'], row['id']) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return rows
+
+def outbox_retry_delay(attempts):
+    """
+    Exponential backoff with ±20% jitter, capped at MAIL_RETRY_MAX_DELAY.
+    """
+    delay = min(
+        app.config['MAIL_RETRY_BASE_DELAY'] * 2 ** (attempts - 1),
+        app.config['MAIL_RETRY_MAX_DELAY']
+    )
+    return delay * random.uniform(0.8, 1.2)
+
+def deliver_outbox_message(row):
+    """
+    Sends one claimed outbox row through Flask-Mail and records the outcome.
+    Returns True on success.
+    """
+    try:
+        with app.app_context():
+            mail.send(Message(
+                subject=row['subject'],
+                recipients=json.loads(row['recipients']),
+                body=row['body'],
+                sender=row['sender'] or app.config['MAIL_DEFAULT_SENDER']
+            ))
+    except Exception as e:
+        attempts = row['attempts'] + 1
+        dead = attempts >= app.config['MAIL_MAX_ATTEMPTS']
+        with closing(outbox_connect()) as conn, conn:
+            conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, "
+                "last_error = ? WHERE id = ?",
+                ('dead' if dead else 'pending', attempts,
+                 time.time() + outbox_retry_delay(attempts), str(e)[:500], row['id'])
+            )
+        app.logger.warning("Mail %s failed (attempt %d): %s", row['id'], attempts, e)
+        return False
+    with closing(outbox_connect()) as conn, conn:
+        conn.execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = ?, "
+            "last_error = NULL WHERE id = ?",
+            (time.time(), row['id'])
+        )
+    return True
+
+def process_outbox():
+    """
+    Delivers every message that is due right now. Returns (sent, failed).
+    The worker thread calls this in a loop; tests can call it directly.
+    """
+    sent = failed = 0
+    while True:
+        rows = claim_outbox_batch(app.config['MAIL_OUTBOX_BATCH_SIZE'])
+        if not rows:
+            return sent, failed
+        for row in rows:
+            if deliver_outbox_message(row):
+                sent += 1
+            else:
+                failed += 1
+
+def start_mail_worker():
+    """
+    Starts the background delivery thread.
+    """
+    def run():
+        while True:
+            outbox_wakeup.wait(app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+            outbox_wakeup.clear()
+            try:
+                process_outbox()
+            except Exception:
+                app.logger.exception("Mail outbox processing failed")
+
+    thread = threading.Thread(target=run, name='mail-outbox', daemon=True)
+    thread.start()
+    return thread
+
+@timed('db')
+def outbox_summary(limit=20):
+    """
+    Counts per status and the most recent outbox entries, for the dashboard.
+    """
+    with closing(outbox_connect()) as conn:
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+        ).fetchall())
+        recent = conn.execute(
+            "SELECT * FROM outbox ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return counts, recent
+
+
+
+###########################################################
+#  3e. Contact Messages (store, rate limiting, write-behind)
+###########################################################
+
+def messages_connect():
+    conn = sqlite3.connect(app.config['MESSAGES_DB_PATH'], timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_message_store():
+    """
+    Creates the messages table. The (lu, received_at) index serves the unread
+    view, and the counters kept up to date by triggers give the badge and the
+    page count without counting rows.
+    """
+    with closing(messages_connect()) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY,
+                nom TEXT NOT NULL,
+                email TEXT NOT NULL,
+                message TEXT NOT NULL,
+                lu INTEGER NOT NULL DEFAULT 0,
+                received_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_by_state ON messages (lu, received_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_by_date ON messages (received_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS message_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.execute(
+            "INSERT OR IGNORE INTO message_counters (name, value) "
+            "SELECT 'total', COUNT(*) FROM messages"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO message_counters (name, value) "
+            "SELECT 'unread', COUNT(*) FROM messages WHERE lu = 0"
+        )
+        conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS messages_counted_insert AFTER INSERT ON messages BEGIN
+                UPDATE message_counters SET value = value + 1 WHERE name = 'total';
+                UPDATE message_counters SET value = value + 1 WHERE name = 'unread' AND NEW.lu = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_counted_delete AFTER DELETE ON messages BEGIN
+                UPDATE message_counters SET value = value - 1 WHERE name = 'total';
+                UPDATE message_counters SET value = value - 1 WHERE name = 'unread' AND OLD.lu = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_counted_update AFTER UPDATE OF lu ON messages
+            WHEN NEW.lu != OLD.lu BEGIN
+                UPDATE message_counters SET value = value + (CASE WHEN NEW.lu = 0 THEN 1 ELSE -1 END)
+                WHERE name = 'unread';
+            END;
+        """)
+
+@timed('db')
+def inbox_counts():
+    """
+    {"total": n, "unread": n}, read from the maintained counters.
+    """
+    with closing(messages_connect()) as conn:
+        return dict(conn.execute("SELECT name, value FROM message_counters").fetchall())
+
+def store_messages(batch):
+    with closing(messages_connect()) as conn, conn:
+        conn.executemany(
+            "INSERT INTO messages (id, nom, email, message, lu, received_at) "
+            "VALUES (:id, :nom, :email, :message, :lu, :received_at)",
+            batch
+        )
+
+@timed('db')
+def get_message(message_id):
+    with closing(messages_connect()) as conn:
+        return conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+
+@timed('db')
+def get_messages(message_ids):
+    """
+    The messages matching `message_ids`, in the given order (unknown ids are skipped).
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return []
+    with closing(messages_connect()) as conn:
+        rows = conn.execute(
+            f"SELECT * FROM messages WHERE id IN ({','.join('?' * len(message_ids))})",
+            message_ids
+        ).fetchall()
+    by_id = {row['id']: row for row in rows}
+    return [by_id[message_id] for message_id in message_ids if message_id in by_id]
+
+@timed('db')
+def search_messages(query='', status='', page=1, per_page=25):
+    """
+    One page of the inbox, newest first, optionally restricted to read/unread
+    messages and to those whose name, email or body contains `query`.
+    Returns (rows, total).
+    """
+    where, params = [], []
+    if status in ('read', 'unread'):
+        where.append("lu = ?")
+        params.append(1 if status == 'read' else 0)
+    if query:
+        pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(nom LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\' OR message LIKE ? ESCAPE '\\')")
+        params.extend([pattern] * 3)
+    clause = f"WHERE {' AND '.join(where)}" if where else ''
+
+    with closing(messages_connect()) as conn:
+        if query:
+            total = conn.execute(f"SELECT COUNT(*) FROM messages {clause}", params).fetchone()[0]
+        else:
+            counts = dict(conn.execute("SELECT name, value FROM message_counters").fetchall())
+            total = {
+                'read': counts['total'] - counts['unread'],
+                'unread': counts['unread']
+            }.get(status, counts['total'])
+        rows = conn.execute(
+            f"SELECT * FROM messages {clause} ORDER BY received_at DESC LIMIT ? OFFSET ?",
+            params + [per_page, (page - 1) * per_page]
+        ).fetchall()
+    return rows, total
+
+def mark_messages(message_ids, lu=True):
+    message_ids = list(dict.fromkeys(message_ids))
+    with closing(messages_connect()) as conn, conn:
+        # One statement per 500 ids, under SQLite's bound-parameter limit
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            conn.execute(
+                f"UPDATE messages SET lu = ? WHERE id IN ({','.join('?' * len(chunk))})",
+                [int(lu), *chunk]
+            )
+
+def toggle_message_read(message_id):
+    """
+    Flips the read state of a message and returns it, or None if it does not exist.
+    """
+    with closing(messages_connect()) as conn, conn:
+        conn.execute("UPDATE messages SET lu = 1 - lu WHERE id = ?", (message_id,))
+        return conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+
+def delete_message(message_id):
+    """
+    Deletes a message and returns it, or None if it does not exist.
+    """
+    with closing(messages_connect()) as conn, conn:
+        msg = conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+        if msg:
+            conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+    return msg
+
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets: every key starts with `burst` tokens and regains
+    one every `refill` seconds. allow() takes a token and returns
+    (allowed, retry_after_seconds).
+    """
+    def __init__(self, burst, refill, max_keys=10000):
+        self.burst = burst
+        self.refill = refill
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, tokens, updated_at, now):
+        tokens = min(self.burst, tokens + (now - updated_at) / self.refill)
+        if tokens >= 1:
+            return tokens - 1, True, 0
+        return tokens, False, (1 - tokens) * self.refill
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (self.burst, now))
+            tokens, allowed, retry_after = self.take(tokens, updated_at, now)
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+        return allowed, retry_after
+
+    def prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket at all
+        full_after = self.burst * self.refill
+        for key, (tokens, updated_at) in list(self.buckets.items()):
+            if now - updated_at >= full_after:
+                del self.buckets[key]
+
+
+class SQLiteTokenBucketLimiter(TokenBucketLimiter):
+    """
+    Same buckets stored in an SQLite file, shared by every worker process.
+    """
+    def __init__(self, path, burst, refill):
+        super().__init__(burst, refill)
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        return conn
+
+    def allow(self, key):
+        # Wall clock: monotonic clocks are not comparable between processes
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated_at = row if row else (self.burst, now)
+                tokens, allowed, retry_after = self.take(tokens, updated_at, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key, tokens, now)
+                )
+                if random.random() < 0.01:
+                    conn.execute(
+                        "DELETE FROM rate_buckets WHERE updated_at < ?",
+                        (now - self.burst * self.refill,)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after
+
+
+def create_contact_limiter():
+    if app.config['CONTACT_RATE_BACKEND']:
+        return SQLiteTokenBucketLimiter(
+            app.config['CONTACT_RATE_BACKEND'],
+            app.config['CONTACT_RATE_BURST'],
+            app.config['CONTACT_RATE_REFILL']
+        )
+    return TokenBucketLimiter(app.config['CONTACT_RATE_BURST'], app.config['CONTACT_RATE_REFILL'])
+
+# Created by create_app(): the limiter, and the queue of accepted messages
+# waiting to be stored (bounded so a flood cannot grow memory)
+contact_limiter = None
+contact_queue = None
+
+def request_ip():
+    """
+    The client IP of the current request. Behind TRUSTED_PROXIES proxies,
+    ProxyFix (installed by create_app) has already replaced it by the
+    forwarded one.
+    """
+    return request.remote_addr or 'unknown'
+
+def contact_form_token():
+    """
+    Signed timestamp put in the contact form, so that displaying the form does
+    not need a session.
+    """
+    return URLSafeTimedSerializer(app.secret_key, salt='contact-form').dumps(time.time())
+
+def contact_form_rendered_at(token):
+    """
+    When the form carrying `token` was displayed, or None if the token is
+    missing, forged or older than CONTACT_FORM_MAX_AGE.
+    """
+    try:
+        return float(URLSafeTimedSerializer(app.secret_key, salt='contact-form').loads(
+            token or '', max_age=app.config['CONTACT_FORM_MAX_AGE']
+        ))
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+def looks_automated(form, rendered_at):
+    """
+    Cheap bot checks: the honeypot field must stay empty, and the form must have
+    been displayed (signed timestamp in the form) a few seconds before.
+    """
+    if form.get(app.config['CONTACT_HONEYPOT_FIELD']):
+        return True
+    if rendered_at is None:
+        return True
+    return time.time() - rendered_at < app.config['CONTACT_MIN_FILL_TIME']
+
+def flush_contact_queue(limit=None):
+    """
+    Moves queued messages into the inbox, one batch at a time, with a single
+    activity log entry per sender kind. Returns the number of messages stored.
+    """
+    if contact_queue is None:
+        return 0
+    limit = limit or app.config['CONTACT_FLUSH_BATCH']
+    batch = []
+    while len(batch) < limit:
+        try:
+            batch.append(contact_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not batch:
+        return 0
+
+    try:
+        store_messages([msg for msg, user in batch])
+    except sqlite3.Error:
+        # Back in the queue for the next flush: these senders were told their
+        # message was sent. Only what no longer fits (the queue filled up in
+        # the meantime) is lost.
+        lost = 0
+        for item in batch:
+            try:
+                contact_queue.put_nowait(item)
+            except queue.Full:
+                lost += 1
+        app.logger.exception(
+            "Storing %d contact messages failed (%d put back in the queue, %d lost)",
+            len(batch), len(batch) - lost, lost
+        )
+        return 0
+    senders = {}
+    for msg, user in batch:
+        senders[user] = senders.get(user, 0) + 1
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for user, count in senders.items():
+        if count == 1:
+            action = "Envoyé un message via le formulaire de contact"
+        else:
+            action = f"Envoyé {count} messages via le formulaire de contact"
+        activity_logs.append({"user": user, "action": action, "timestamp": timestamp})
+    return len(batch)
+
+def start_contact_writer():
+    """
+    Starts the thread that stores queued contact messages in the background.
+    """
+    def run():
+        while True:
+            time.sleep(app.config['CONTACT_FLUSH_INTERVAL'])
+            try:
+                drain_contact_queue()
+            except Exception:
+                app.logger.exception("Contact message flush failed")
+
+    thread = threading.Thread(target=run, name='contact-writer', daemon=True)
+    thread.start()
+    return thread
+
+def drain_contact_queue():
+    while flush_contact_queue():
+        pass
+
+atexit.register(drain_contact_queue)
+
+
+###########################################################
+#  3f. Authentication (hashing pool, login throttling)
+###########################################################
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the hashing pool is saturated or too slow to answer.
+    """
+
+
+# The process pools (this one, the job queues') start their workers from the
+# fork server. It preloads this module, not __main__: under `python wsgi.py`
+# that would build a whole app in it, inherited by every worker.
+multiprocessing.set_forkserver_preload(['main'])
+
+
+class PasswordHasher:
+    """
+    Runs Werkzeug's password functions in a process pool of `size` workers,
+    with at most `queue_limit` more jobs waiting. The pool is created on first
+    use, in the process that uses it (a forked server worker gets its own).
+    """
+    def __init__(self, size, queue_limit, timeout):
+        self.size = size
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.pool = None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.pool = None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+
+    def run(self, func, *args):
+        if not self.size:
+            return func(*args)
+
+        with self.lock:
+            if self.in_flight >= self.size + self.queue_limit:
+                raise PasswordHasherBusy()
+            if self.pool is None:
+                # Not 'fork': this process already runs threads (server, mail,
+                # jobs...), and a lock one of them holds would stay held forever
+                # in the child. Workers are forked from the single-threaded fork
+                # server instead; they only need werkzeug.security.
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context('forkserver')
+                )
+            pool = self.pool
+            self.in_flight += 1
+
+        try:
+            future = pool.submit(func, *args)
+        except (BrokenProcessPool, RuntimeError):
+            self.discard(pool)
+            with self.lock:
+                self.in_flight -= 1
+            raise PasswordHasherBusy()
+        # Counted until the job really finishes, even if we stop waiting for it
+        future.add_done_callback(self.release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            self.discard(pool)
+            raise PasswordHasherBusy()
+
+    def discard(self, pool):
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Created by create_app()
+password_hasher = None
+
+def hash_password(password):
+    """
+    generate_password_hash() in the pool. Raises PasswordHasherBusy.
+    """
+    return password_hasher.run(generate_password_hash, password)
+
+def verify_password(pwhash, password):
+    """
+    check_password_hash() in the pool. Raises PasswordHasherBusy.
+    """
+    return password_hasher.run(check_password_hash, pwhash, password)
+
+
+class FailureLog:
+    """
+    Recent failure timestamps per key, keeping at most `keep` of them and
+    forgetting keys untouched for `ttl` seconds.
+    """
+    def __init__(self, keep, ttl, max_keys=10000):
+        self.keep = keep
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def recent(self, key, since):
+        with self.lock:
+            return [t for t in self.failures.get(key, ()) if t > since]
+
+    def push(self, key, now):
+        # Call with self.lock held
+        self.failures.setdefault(key, collections.deque(maxlen=self.keep)).append(now)
+        if len(self.failures) > self.max_keys:
+            for stale in [k for k, d in self.failures.items() if d[-1] < now - self.ttl]:
+                del self.failures[stale]
+
+    def reserve(self, keys, horizon, decide):
+        """
+        In one locked step: passes {key: failures of the last `horizon` seconds}
+        to decide(failures, now), which returns a wait in seconds, and when the
+        wait is 0 records `now` under every key. Returns (wait, now, failures),
+        the failures including the new entry.
+        """
+        now = time.time()
+        with self.lock:
+            failures = {key: [t for t in self.failures.get(key, ()) if t > now - horizon] for key in keys}
+            wait = decide(failures, now)
+            if not wait:
+                for key in keys:
+                    self.push(key, now)
+                    failures[key].append(now)
+        return wait, now, failures
+
+    def remove(self, key, at):
+        """
+        Forgets the entry recorded at `at` under `key`.
+        """
+        with self.lock:
+            entries = self.failures.get(key)
+            if entries and at in entries:
+                entries.remove(at)
+
+    def clear(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+
+class SQLiteFailureLog(FailureLog):
+    """
+    Same log stored in an SQLite file, shared by every worker process.
+    """
+    def __init__(self, path, keep, ttl):
+        super().__init__(keep, ttl)
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS login_failures (
+                    key TEXT NOT NULL,
+                    failed_at REAL NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS login_failures_by_key ON login_failures (key, failed_at)"
+            )
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def recent(self, key, since):
+        with closing(self.connect()) as conn:
+            rows = conn.execute(
+                "SELECT failed_at FROM login_failures WHERE key = ? AND failed_at > ? "
+                "ORDER BY failed_at DESC LIMIT ?",
+                (key, since, self.keep)
+            ).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def reserve(self, keys, horizon, decide):
+        # BEGIN IMMEDIATE: the check and the insert are one step for every worker
+        now = time.time()
+        with closing(self.connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                failures = {}
+                for key in keys:
+                    rows = conn.execute(
+                        "SELECT failed_at FROM login_failures WHERE key = ? AND failed_at > ? "
+                        "ORDER BY failed_at DESC LIMIT ?",
+                        (key, now - horizon, self.keep)
+                    ).fetchall()
+                    failures[key] = [row[0] for row in reversed(rows)]
+                wait = decide(failures, now)
+                if not wait:
+                    conn.executemany(
+                        "INSERT INTO login_failures (key, failed_at) VALUES (?, ?)",
+                        [(key, now) for key in keys]
+                    )
+                    for key in keys:
+                        failures[key].append(now)
+                if random.random() < 0.01:
+                    conn.execute("DELETE FROM login_failures WHERE failed_at < ?", (now - self.ttl,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait, now, failures
+
+    def remove(self, key, at):
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM login_failures WHERE rowid IN "
+                "(SELECT rowid FROM login_failures WHERE key = ? AND failed_at = ? LIMIT 1)",
+                (key, at)
+            )
+
+    def clear(self, key):
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM login_failures WHERE key = ?", (key,))
+
+
+class LoginThrottle:
+    """
+    Decides whether a login attempt may proceed, from the failures recorded for
+    its username and its client IP. Checked before any password hashing.
+    """
+    def __init__(self, log, window, delay_base, lockout, limits):
+        self.log = log
+        self.window = window
+        self.delay_base = delay_base
+        self.lockout = lockout
+        self.limits = limits   # {"user": 5, "ip": 20}
+
+    def keys(self, username, ip):
+        return {'user': f"user:{username.lower()}", 'ip': f"ip:{ip}"}
+
+    def wait_time(self, failures, limit, now):
+        if not failures:
+            return 0
+        if len(failures) >= limit:
+            until = failures[-1] + self.lockout
+        elif len(failures) >= 3:
+            until = failures[-1] + self.delay_base * 2 ** (len(failures) - 3)
+        else:
+            return 0
+        return max(0, until - now)
+
+    def begin_attempt(self, username, ip):
+        """
+        Returns (wait, attempt): the seconds before this username/IP may try
+        again (0: go ahead) and, when it may, the attempt to pass to
+        record_success() or record_failure(). The attempt is counted as a
+        failure in the same locked step as the check, so concurrent attempts
+        cannot all get under the limit; a success takes it back.
+        """
+        keys = self.keys(username, ip)
+
+        def decide(failures, now):
+            waits = [0]
+            for kind, key in keys.items():
+                recent = failures[key]
+                if len(recent) < self.limits[kind]:
+                    recent = [t for t in recent if t > now - self.window]
+                waits.append(self.wait_time(recent, self.limits[kind], now))
+            return max(waits)
+
+        # A lockout outlives the window it was earned in
+        wait, now, failures = self.log.reserve(list(keys.values()), max(self.window, self.lockout), decide)
+        if wait:
+            return wait, None
+        counts = {kind: len([t for t in failures[key] if t > now - self.window]) for kind, key in keys.items()}
+        return 0, {'keys': keys, 'at': now, 'counts': counts}
+
+    def record_failure(self, attempt):
+        """
+        Returns True when this failed attempt triggered a lockout.
+        """
+        return any(attempt['counts'][kind] == limit for kind, limit in self.limits.items())
+
+    def record_success(self, attempt):
+        self.log.clear(attempt['keys']['user'])
+        self.log.remove(attempt['keys']['ip'], attempt['at'])
+
+
+def create_login_throttle():
+    limits = {
+        'user': app.config['LOGIN_MAX_FAILURES_PER_USER'],
+        'ip': app.config['LOGIN_MAX_FAILURES_PER_IP']
+    }
+    keep = max(limits.values())
+    ttl = max(app.config['LOGIN_FAILURE_WINDOW'], app.config['LOGIN_LOCKOUT'])
+    if app.config['LOGIN_THROTTLE_BACKEND']:
+        log = SQLiteFailureLog(app.config['LOGIN_THROTTLE_BACKEND'], keep, ttl)
+    else:
+        log = FailureLog(keep, ttl)
+    return LoginThrottle(
+        log,
+        app.config['LOGIN_FAILURE_WINDOW'],
+        app.config['LOGIN_DELAY_BASE'],
+        app.config['LOGIN_LOCKOUT'],
+        limits
+    )
+
+# Created by create_app()
+login_throttle = None
+
+def tokens_match(given, expected):
+    """
+    Constant-time comparison of a token sent by the client with the expected
+    one. Compares bytes: compare_digest() rejects non-ASCII strings.
+    """
+    return secrets.compare_digest(given.encode('utf-8'), expected.encode('utf-8'))
+
+def format_wait(seconds):
+    seconds = int(seconds) + 1
+    if seconds < 60:
+        return f"{seconds} seconde(s)"
+    return f"{(seconds + 59) // 60} minute(s)"
+
+
+###########################################################
+#  3g. Sessions (server-side store)
+###########################################################
+
+class SessionStore(ABC):
+    """
+    Where server-side sessions live. A shared cache (Redis, memcached...) only
+    needs these four methods to be used instead; data is an already serialized
+    string and expires_at a Unix timestamp.
+    """
+    @abstractmethod
+    def load(self, sid):
+        """Returns (data, expires_at) stored for `sid`, or None if missing or expired."""
+
+    @abstractmethod
+    def save(self, sid, data, expires_at):
+        """Stores `data` for `sid` until `expires_at`."""
+
+    @abstractmethod
+    def delete(self, sid):
+        """Forgets `sid`."""
+
+    @abstractmethod
+    def sweep(self):
+        """Removes expired sessions and returns how many were removed."""
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    sid TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at)")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def load(self, sid):
+        with closing(self.connect()) as conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?",
+                (sid, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save(self, sid, data, expires_at):
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+                (sid, data, expires_at)
+            )
+
+    def delete(self, sid):
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self):
+        with closing(self.connect()) as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class FileSessionStore(SessionStore):
+    """
+    One file per session, named after its id; the expiry is the file's mtime.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        try:
+            expires_at = os.path.getmtime(self.path(sid))
+            if expires_at <= time.time():
+                return None
+            with open(self.path(sid), encoding='utf-8') as f:
+                return f.read(), expires_at
+        except OSError:
+            return None
+
+    def save(self, sid, data, expires_at):
+        tmp = f"{self.path(sid)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.utime(tmp, (expires_at, expires_at))
+        os.replace(tmp, self.path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self.path(sid))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        removed = 0
+        now = time.time()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    # Leftover temporary files are swept as well, an hour later
+                    if entry.stat().st_mtime <= (now - 3600 if entry.name.endswith('.tmp') else now):
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        """
+        Moves the session to a fresh id (on login, against session fixation).
+        """
+        if self.sid and not self.previous_sid:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+def sessionless_request(request):
+    """
+    Health checks, metric scrapes and media downloads never use the session:
+    they get a null one instead of a session store read.
+    """
+    path = request.path
+    if path.startswith('/media/') or path in ('/healthz', '/readyz'):
+        return True
+    # An admin opening /metrics in a browser has no token, only the session
+    return path == '/metrics' and 'Authorization' in request.headers
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps the session data in a SessionStore; the cookie only holds a random id.
+    Sessions expire after `idle_timeout` seconds without a request.
+    """
+    serializer = TaggedJSONSerializer()
+    sid_re = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+    def __init__(self, store, idle_timeout, refresh_after):
+        self.store = store
+        self.idle_timeout = idle_timeout
+        self.refresh_after = refresh_after
+
+    def open_session(self, app, request):
+        if sessionless_request(request):
+            return self.make_null_session(app)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and self.sid_re.match(sid):
+            stored = self.store.load(sid)
+            if stored is not None:
+                data, expires_at = stored
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid, expires_at)
+                except ValueError:
+                    pass
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+            if not session.new or session.previous_sid:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        stale = session.expires_at is None or session.expires_at - now < self.idle_timeout - self.refresh_after
+        if not (session.modified or session.sid is None or stale):
+            return
+
+        # A session that was only read is still extended, at most every refresh_after seconds
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + self.idle_timeout
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), session.expires_at)
+        response.vary.add('Cookie')
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+
+def create_session_store():
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'sqlite':
+        return SQLiteSessionStore(app.config['SESSION_SQLITE_PATH'])
+    if backend == 'file':
+        return FileSessionStore(app.config['SESSION_FILE_DIR'])
+    return None
+
+def start_session_sweeper(store):
+    """
+    Starts the thread that deletes expired sessions every SESSION_SWEEP_INTERVAL seconds.
+    """
+    def run():
+        while True:
+            time.sleep(app.config['SESSION_SWEEP_INTERVAL'])
+            try:
+                store.sweep()
+            except Exception:
+                app.logger.exception("Session sweep failed")
+
+    thread = threading.Thread(target=run, name='session-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+def regenerate_session():
+    """
+    Gives the current session a new id (no-op with cookie sessions).
+    """
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+# Created by create_app() (None with SESSION_BACKEND=cookie)
+session_store = None
+
+
+###########################################################
+#  3h. Content Snapshots (copy-on-write)
+###########################################################
+
+# The content collections (users, destinations, culture, homepage_media,
+# custom_pages, reply_templates, site_settings) are snapshots: a published list
+# or dict is never modified. Writers take content_lock, build the changed item
+# and hand it to commit_content_change() (section 3i), which rebinds the module
+# global to the next version; readers pick it up with a plain lookup and no lock.
+content_lock = threading.RLock()
+
+def with_item_replaced(items, item_id, **changes):
+    """
+    Returns (new_items, new_item): a copy of `items` where the item `item_id` is
+    replaced by an updated copy. new_item is None if there is no such item.
+    """
+    new_item = None
+    new_items = []
+    for item in items:
+        if item['id'] == item_id:
+            item = new_item = {**item, **changes}
+        new_items.append(item)
+    return new_items, new_item
+
+def with_item_removed(items, item_id):
+    """
+    Returns (new_items, removed_item); removed_item is None if there is no such item.
+    """
+    removed = next((item for item in items if item['id'] == item_id), None)
+    if removed is None:
+        return items, None
+    return [item for item in items if item['id'] != item_id], removed
+
+
+###########################################################
+#  3i. Content Changes (journal followed by every worker)
+###########################################################
+
+# Every content change is written to a SQLite journal as (collection, item_id,
+# version, item) and applied from there, in version order, by every process:
+# right away by the one that made it, within CONTENT_POLL_INTERVAL by the others
+# (their follower thread watches PRAGMA data_version, which moves when another
+# connection commits). Workers thus converge on the same snapshots, and a new or
+# restarted process replays the journal on top of the seed data. Only the latest
+# change of each item is kept. Settings (site_settings, profiler_settings) are
+# a single dict, replaced whole; their item id is 'site' and 'profiler'.
+CONTENT_COLLECTIONS = (
+    'users', 'destinations', 'culture', 'homepage_media',
+    'custom_pages', 'reply_templates', 'site_settings', 'profiler_settings'
+)
+
+# Version of the last change applied by this process, overall and per collection
+content_version = 0
+content_versions = {}
+# callback(collection, item_id, version, item) run, under content_lock, after
+# each change is applied (item is None for a delete). Keep them quick.
+content_subscribers = []
+
+def content_journal_connect():
+    conn = sqlite3.connect(app.config['CONTENT_JOURNAL_PATH'], timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_content_journal():
+    """
+    Creates the journal. Writing an item again replaces its row, which gets a
+    new, higher version (AUTOINCREMENT never reuses one).
+    """
+    with closing(content_journal_connect()) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS content_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                item TEXT,
+                changed_at REAL NOT NULL
+            )
+        """)
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS content_changes_item ON content_changes (collection, item_id)"
+        )
+
+def subscribe_content_changes(callback):
+    """
+    Registers a cache, index... to be told about every applied change. Usable as a decorator.
+    """
+    content_subscribers.append(callback)
+    return callback
+
+def apply_content_change(collection, item_id, item):
+    """
+    Publishes the next snapshot of `collection` with `item` added, replaced
+    or (None) removed. The caller holds content_lock.
+    """
+    current = globals()[collection]
+    if isinstance(current, dict):
+        new = item
+    elif item is None:
+        new, _ = with_item_removed(current, item_id)
+    else:
+        new, replaced = with_item_replaced(current, item_id, **item)
+        if replaced is None:
+            new = current + [item]
+    globals()[collection] = new
+
+def apply_content_changes():
+    """
+    Applies the journal entries this process has not applied yet, in order,
+    and notifies the subscribers. Returns how many were applied.
+    """
+    global content_version
+    with content_lock:
+        with closing(content_journal_connect()) as conn:
+            rows = conn.execute(
+                "SELECT version, collection, item_id, item FROM content_changes "
+                "WHERE version > ? ORDER BY version",
+                (content_version,)
+            ).fetchall()
+        for row in rows:
+            content_version = row['version']
+            if row['collection'] not in CONTENT_COLLECTIONS:
+                continue
+            item = json.loads(row['item']) if row['item'] is not None else None
+            apply_content_change(row['collection'], row['item_id'], item)
+            content_versions[row['collection']] = row['version']
+            for callback in content_subscribers:
+                try:
+                    callback(row['collection'], row['item_id'], row['version'], item)
+                except Exception:
+                    app.logger.exception("Content subscriber %r failed", callback)
+    return len(rows)
+
+def commit_content_change(collection, item_id, item):
+    """
+    Records that the item `item_id` of `collection` is now `item` (None: deleted)
+    and applies it, along with any earlier change from other workers. Call with
+    content_lock held when the change depends on the current snapshot.
+    Returns the version of the change.
+    """
+    with content_lock:
+        with closing(content_journal_connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO content_changes (collection, item_id, item, changed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (collection, item_id, None if item is None else json.dumps(item), time.time())
+            )
+            version = cursor.lastrowid
+        apply_content_changes()
+    return version
+
+def start_content_follower():
+    """
+    Starts the thread that applies the changes made by other processes.
+    """
+    shortest = app.config['CONTENT_POLL_MIN_INTERVAL']
+    longest = app.config['CONTENT_POLL_INTERVAL']
+
+    def run():
+        conn = content_journal_connect()
+        seen = None
+        interval = shortest
+        while True:
+            # Edits come in bursts: poll fast right after one, slowly when idle
+            interval = min(interval * 2, longest)
+            try:
+                data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != seen:
+                    seen = data_version
+                    interval = shortest
+                    apply_content_changes()
+            except Exception:
+                app.logger.exception("Applying content changes failed")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='content-follower', daemon=True)
+    thread.start()
+    return thread
+
+# The media reference index follows the collections that point at uploads
+MEDIA_INDEXERS = {
+    'destinations': index_destination,
+    'culture': index_culture_item,
+    'homepage_media': index_homepage_media,
+    'custom_pages': index_custom_page,
+}
+
+@subscribe_content_changes
+def reindex_media_references(collection, item_id, version, item):
+    if collection not in MEDIA_INDEXERS:
+        return
+    if item is None:
+        set_media_references(collection, item_id, [])
+    else:
+        MEDIA_INDEXERS[collection](item)
+
+
+###########################################################
+#  3j. Background Jobs (persistent queues, recurring tasks)
+###########################################################
+
+# Slow side effects run as jobs: a request stores a row in the jobs table
+# (shared by the workers, so pending work survives a restart) and returns.
+# Each process runs, for every queue of JOB_QUEUES, a few threads that claim
+# due jobs by priority; queues with 'processes' hand the call to a small
+# forked pool, for CPU-bound work. A claimed job holds a lease (JOB_LEASE),
+# renewed while it runs: if its worker dies, the lease lapses and another one
+# picks the job up again. Failures are retried with backoff until the job's
+# max_attempts, then the job is dead.
+JOB_STATUS_LABELS = {
+    'pending': ('En attente', 'secondary'),
+    'running': ('En cours', 'info'),
+    'done': ('Terminée', 'success'),
+    'dead': ('Échec définitif', 'danger'),
+}
+
+# name -> {"func", "queue", "max_attempts"}
+job_functions = {}
+# queue name -> JobRunner, for this process
+job_runners = {}
+
+def register_job(func, queue='default', max_attempts=None):
+    """
+    Makes `func` runnable as a job under its own name. Its arguments must be
+    JSON-serializable; it runs inside an app context.
+    """
+    job_functions[func.__name__] = {
+        "func": func,
+        "queue": queue,
+        "max_attempts": max_attempts or app.config['JOB_MAX_ATTEMPTS'],
+    }
+    return func
+
+def jobs_connect():
+    conn = sqlite3.connect(app.config['JOBS_DB_PATH'], timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_job_store():
+    with closing(jobs_connect()) as conn, conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                queue TEXT NOT NULL,
+                name TEXT NOT NULL,
+                args TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                run_at REAL NOT NULL,
+                lease_until REAL,
+                enqueued_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                last_error TEXT
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (queue, status, priority, run_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished_at)"
+        )
+        # Next run of the recurring jobs that run once for all the workers
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_schedule (
+                name TEXT PRIMARY KEY,
+                next_run REAL NOT NULL
+            )
+        """)
+
+def enqueue_job(name, *args, priority=0, delay=0):
+    """
+    Stores a job for the registered function `name` and wakes this process's
+    runner for its queue. Higher priorities run first. Returns the job id.
+    """
+    spec = job_functions[name]
+    now = time.time()
+    with closing(jobs_connect()) as conn, conn:
+        job_id = conn.execute(
+            "INSERT INTO jobs (queue, name, args, priority, max_attempts, run_at, enqueued_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (spec['queue'], name, json.dumps(args), priority, spec['max_attempts'], now + delay, now)
+        ).lastrowid
+    runner = job_runners.get(spec['queue'])
+    if runner is not None:
+        runner.wakeup.set()
+    return job_id
+
+def claim_job(queue_name):
+    """
+    Atomically takes the most urgent due job of a queue (or one whose lease
+    expired), or returns None. The row's lease_until is the caller's lease.
+    """
+    now = time.time()
+    with closing(jobs_connect()) as conn:
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE queue = ? AND ("
+                "(status = 'pending' AND run_at <= ?) OR (status = 'running' AND lease_until <= ?)"
+                ") ORDER BY priority DESC, run_at, id LIMIT 1",
+                (queue_name, now, now)
+            ).fetchone()
+            if row is not None:
+                row = dict(row, lease_until=now + app.config['JOB_LEASE'])
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                    "started_at = ?, lease_until = ? WHERE id = ?",
+                    (now, row['lease_until'], row['id'])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return row
+
+def job_retry_delay(attempts):
+    """
+    Exponential backoff with ±20% jitter, capped at one hour.
+    """
+    delay = min(app.config['JOB_RETRY_BASE_DELAY'] * 2 ** (attempts - 1), 3600)
+    return delay * random.uniform(0.8, 1.2)
+
+def renew_job_lease(row):
+    """
+    Extends the lease of a claimed job. Returns False if it was lost (taken
+    over after it lapsed).
+    """
+    lease_until = time.time() + app.config['JOB_LEASE']
+    with closing(jobs_connect()) as conn, conn:
+        renewed = conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND lease_until = ?",
+            (lease_until, row['id'], row['lease_until'])
+        ).rowcount
+    if renewed:
+        row['lease_until'] = lease_until
+    return bool(renewed)
+
+@contextmanager
+def job_lease_kept(row):
+    """
+    Renews the lease of a claimed job every third of JOB_LEASE while the block runs.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(app.config['JOB_LEASE'] / 3):
+            try:
+                if not renew_job_lease(row):
+                    app.logger.warning("Job %s #%s lost its lease", row['name'], row['id'])
+                    return
+            except sqlite3.Error:
+                app.logger.exception("Renewing the lease of job #%s failed", row['id'])
+
+    thread = threading.Thread(target=run, name=f"job-lease-{row['id']}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def finish_job(row, error=None):
+    """
+    Records the outcome of a job, unless its lease was lost: the runner that
+    took it over owns the row now.
+    """
+    attempts = row['attempts'] + 1
+    now = time.time()
+    with closing(jobs_connect()) as conn, conn:
+        if error is None:
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, last_error = NULL "
+                "WHERE id = ? AND lease_until = ?",
+                (now, row['id'], row['lease_until'])
+            ).rowcount
+        elif attempts >= row['max_attempts']:
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'dead', finished_at = ?, last_error = ? "
+                "WHERE id = ? AND lease_until = ?",
+                (now, error[:500], row['id'], row['lease_until'])
+            ).rowcount
+        else:
+            updated = conn.execute(
+                "UPDATE jobs SET status = 'pending', run_at = ?, last_error = ? "
+                "WHERE id = ? AND lease_until = ?",
+                (now + job_retry_delay(attempts), error[:500], row['id'], row['lease_until'])
+            ).rowcount
+    if not updated:
+        app.logger.warning("Job %s #%s finished after losing its lease", row['name'], row['id'])
+
+def run_job_function(name, args):
+    """
+    Runs a registered job.
+    """
+    with app.app_context():
+        return job_functions[name]['func'](*args)
+
+def run_pooled_job(name, args):
+    """
+    Entry point in the process pools. No flusher thread runs in a pool worker,
+    so its metrics (cache lookups...) are written after each job.
+    """
+    try:
+        return run_job_function(name, args)
+    finally:
+        metrics.flush()
+
+def job_pool_config():
+    """
+    The settings of this app that a pool worker can receive: the workers
+    import this module afresh, without what create_app() was given.
+    """
+    config = {}
+    for key, value in app.config.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        config[key] = value
+    return config
+
+def init_job_pool_worker(config):
+    app.config.update(config)
+
+
+class JobRunner:
+    """
+    Runs the jobs of one queue in this process: `threads` threads claim and
+    run them, either directly or, with `processes`, in a pool of that size
+    (created on first use, like PasswordHasher's).
+    """
+    def __init__(self, name, threads=1, processes=0):
+        self.name = name
+        self.threads = threads
+        self.processes = processes
+        self.pool = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        threads = []
+        for i in range(self.threads):
+            thread = threading.Thread(target=self.run, name=f'jobs-{self.name}-{i}', daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def run(self):
+        while True:
+            self.wakeup.wait(app.config['JOB_POLL_INTERVAL'])
+            self.wakeup.clear()
+            try:
+                while self.run_next():
+                    pass
+            except Exception:
+                app.logger.exception("Job queue %s failed", self.name)
+
+    def run_next(self):
+        """
+        Claims and runs one job. Returns False when none is due.
+        """
+        row = claim_job(self.name)
+        if row is None:
+            return False
+        try:
+            if row['name'] not in job_functions:
+                raise LookupError(f"unknown job {row['name']}")
+            args = json.loads(row['args'])
+            with job_lease_kept(row):
+                if self.processes:
+                    self.submit(row['name'], args)
+                else:
+                    run_job_function(row['name'], args)
+        except Exception as e:
+            app.logger.warning("Job %s #%s failed: %s", row['name'], row['id'], e)
+            finish_job(row, f"{type(e).__name__}: {e}")
+        else:
+            finish_job(row)
+        return True
+
+    def submit(self, name, args):
+        with self.lock:
+            if self.pool is None:
+                # forkserver, not fork, for the same reason as PasswordHasher
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=init_job_pool_worker,
+                    initargs=(job_pool_config(),)
+                )
+            pool = self.pool
+        try:
+            return pool.submit(run_pooled_job, name, args).result(timeout=app.config['JOB_TIMEOUT'])
+        except FutureTimeoutError:
+            # The worker would go on running the job, which is about to be
+            # retried: kill the pool (no public API for that before 3.14)
+            processes = list((pool._processes or {}).values())
+            self.discard(pool)
+            for process in processes:
+                process.kill()
+            raise
+        except BrokenProcessPool:
+            self.discard(pool)
+            raise
+
+    def discard(self, pool):
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def start_job_runners():
+    """
+    Starts this process's runners for every queue of JOB_QUEUES.
+    """
+    threads = []
+    for name, options in app.config['JOB_QUEUES'].items():
+        runner = job_runners[name] = JobRunner(name, options.get('threads', 1), options.get('processes', 0))
+        atexit.register(runner.shutdown)
+        threads.extend(runner.start())
+    return threads
+
+@timed('db')
+def job_queue_stats():
+    """
+    Per queue: jobs due, scheduled later, running, dead, done in the last hour,
+    the age of the oldest due job, and the average wait (run_at to start) and
+    run time of the jobs finished in the last hour.
+    """
+    now = time.time()
+    empty = {"due": 0, "scheduled": 0, "running": 0, "dead": 0, "done": 0,
+             "oldest_due": None, "avg_wait": None, "avg_run": None}
+    stats = {name: dict(empty) for name in app.config['JOB_QUEUES']}
+    with closing(jobs_connect()) as conn:
+        rows = conn.execute(
+            "SELECT queue, "
+            "SUM(status = 'pending' AND run_at <= :now) AS due, "
+            "SUM(status = 'pending' AND run_at > :now) AS scheduled, "
+            "SUM(status = 'running') AS running, "
+            "SUM(status = 'dead') AS dead, "
+            "MIN(CASE WHEN status = 'pending' AND run_at <= :now THEN run_at END) AS oldest_run_at "
+            "FROM jobs GROUP BY queue",
+            {"now": now}
+        ).fetchall()
+        recent = conn.execute(
+            "SELECT queue, COUNT(*) AS done, AVG(started_at - run_at) AS avg_wait, "
+            "AVG(finished_at - started_at) AS avg_run FROM jobs "
+            "WHERE status = 'done' AND finished_at >= ? GROUP BY queue",
+            (now - 3600,)
+        ).fetchall()
+    for row in rows:
+        entry = stats.setdefault(row['queue'], dict(empty))
+        entry.update(due=row['due'], scheduled=row['scheduled'], running=row['running'], dead=row['dead'])
+        entry['oldest_due'] = now - row['oldest_run_at'] if row['oldest_run_at'] else None
+    for row in recent:
+        stats.setdefault(row['queue'], dict(empty)).update(
+            done=row['done'], avg_wait=row['avg_wait'], avg_run=row['avg_run']
+        )
+    return stats
+
+@timed('db')
+def recent_failed_jobs(limit=20):
+    with closing(jobs_connect()) as conn:
+        return conn.execute(
+            "SELECT * FROM jobs WHERE last_error IS NOT NULL AND status IN ('pending', 'dead') "
+            "ORDER BY COALESCE(finished_at, run_at) DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+
+def retry_job(job_id):
+    """
+    Puts a dead job back in its queue. Returns False if there is no such dead job.
+    """
+    with closing(jobs_connect()) as conn, conn:
+        row = conn.execute("SELECT queue FROM jobs WHERE id = ? AND status = 'dead'", (job_id,)).fetchone()
+        if row is None:
+            return False
+        conn.execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, run_at = ?, finished_at = NULL "
+            "WHERE id = ?",
+            (time.time(), job_id)
+        )
+    runner = job_runners.get(row['queue'])
+    if runner is not None:
+        runner.wakeup.set()
+    return True
+
+# JOBS
+# ------------------------------------------------------------------------------
+def prepare_upload(filename):
+    """
+    Builds the placeholder and the thumbnail of a new upload, so that neither
+    the public pages nor the media library have to on their first view.
+    """
+    get_media_info(filename)
+    if can_thumbnail(filename):
+        ensure_thumbnail(filename)
+
+def warm_thumbnails():
+    """
+    Generates the thumbnails missing or older than their upload.
+    """
+    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
+        if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename)) and can_thumbnail(filename):
+            ensure_thumbnail(filename)
+
+def prune_jobs():
+    """
+    Forgets the jobs finished more than JOB_RETENTION seconds ago.
+    """
+    with closing(jobs_connect()) as conn, conn:
+        return conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'dead') AND finished_at < ?",
+            (time.time() - app.config['JOB_RETENTION'],)
+        ).rowcount
+
+register_job(prepare_upload, queue='media')
+register_job(remove_derivatives, queue='media')
+register_job(warm_thumbnails, queue='media')
+register_job(sweep_orphaned_media, queue='maintenance', max_attempts=1)
+register_job(prune_jobs, queue='maintenance', max_attempts=1)
+
+# RECURRING JOBS
+# ------------------------------------------------------------------------------
+def rotate_activity_log():
+    """
+    Keeps the ACTIVITY_LOG_LIMIT most recent activity log entries.
+    """
+    excess = len(activity_logs) - app.config['ACTIVITY_LOG_LIMIT']
+    if excess > 0:
+        del activity_logs[:excess]
+
+def warm_media_catalogue():
+    """
+    Probes every upload, so pages do not pay for it on their first render.
+    """
+    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
+        if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+            get_media_info(filename)
+
+# (job or function, interval: seconds or config key, shared). Shared ones are
+# registered jobs, enqueued once for all workers through job_schedule; the
+# others work on this process's memory and run in every process's scheduler
+# thread. A None interval disables the entry.
+RECURRING_JOBS = [
+    (rotate_activity_log, 300, False),
+    (warm_media_catalogue, 'CACHE_WARMUP_INTERVAL', False),
+    (warm_thumbnails, 'CACHE_WARMUP_INTERVAL', True),
+    (sweep_orphaned_media, 'MEDIA_SWEEP_INTERVAL', True),
+    (prune_jobs, 3600, True),
+]
+
+def recurring_jobs():
+    """
+    The enabled RECURRING_JOBS as (function, interval in seconds, shared).
+    """
+    entries = []
+    for func, interval, shared in RECURRING_JOBS:
+        if isinstance(interval, str):
+            interval = app.config.get(interval)
+        if interval:
+            entries.append((func, interval, shared))
+    return entries
+
+def claim_recurring_run(name, interval):
+    """
+    Tells whether this process should enqueue the shared job `name` now, and
+    if so moves its next run `interval` seconds ahead for everybody.
+    """
+    now = time.time()
+    with closing(jobs_connect()) as conn, conn:
+        conn.execute("INSERT OR IGNORE INTO job_schedule (name, next_run) VALUES (?, ?)", (name, now + interval))
+        return conn.execute(
+            "UPDATE job_schedule SET next_run = ? WHERE name = ? AND next_run <= ?",
+            (now + interval, name, now)
+        ).rowcount == 1
+
+@timed('db')
+def job_schedule():
+    with closing(jobs_connect()) as conn:
+        return dict(conn.execute("SELECT name, next_run FROM job_schedule").fetchall())
+
+def start_job_scheduler():
+    """
+    Starts the thread that fires the recurring jobs.
+    """
+    def run():
+        next_local_run = {}
+        while True:
+            time.sleep(1)
+            now = time.time()
+            for func, interval, shared in recurring_jobs():
+                try:
+                    if shared:
+                        if claim_recurring_run(func.__name__, interval):
+                            enqueue_job(func.__name__)
+                    elif now >= next_local_run.get(func.__name__, now):
+                        next_local_run[func.__name__] = now + interval
+                        with app.app_context():
+                            func()
+                except Exception:
+                    app.logger.exception("Recurring job %s failed", func.__name__)
+
+    thread = threading.Thread(target=run, name='job-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+
+###########################################################
+#  3k. Metrics (Prometheus text format)
+###########################################################
+
+# Histogram buckets (upper bounds) per metric
+METRIC_BUCKETS = {
+    'http_request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'http_response_size_bytes': (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+}
+METRIC_HELP = {
+    'http_requests_total': ('counter', "Requests handled, by endpoint, method and status."),
+    'http_request_duration_seconds': ('histogram', "Time spent handling a request, by endpoint."),
+    'http_response_size_bytes': ('histogram', "Response body size, by endpoint."),
+    'http_requests_in_flight': ('gauge', "Requests being handled right now."),
+    'cache_requests_total': ('counter', "Cache lookups, by cache and result (hit or miss)."),
+    'cache_hit_ratio': ('gauge', "Share of cache lookups that were hits."),
+    'jobs_waiting': ('gauge', "Background jobs due and not started, by queue."),
+    'jobs_dead': ('gauge', "Background jobs that failed for good, by queue."),
+}
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and gauges of this process. Every process writes a
+    snapshot to METRICS_DIR/<pid>.json (flush()); collect() adds up the
+    snapshots of all of them, so a scrape answered by any worker covers the
+    whole server. When a process is gone its counters are folded into
+    archive.json, its gauges dropped.
+    """
+    def __init__(self):
+        self.reset()
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.gauges = {}      # (name, labels) -> value
+        self.dirty = False
+        self.flushed = False
+
+    def inc(self, name, labels=(), amount=1):
+        with self.lock:
+            self.counters[name, labels] = self.counters.get((name, labels), 0) + amount
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        buckets = METRIC_BUCKETS[name]
+        with self.lock:
+            entry = self.histograms.get((name, labels))
+            if entry is None:
+                entry = self.histograms[name, labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+            self.dirty = True
+
+    def add_to_gauge(self, name, labels, amount):
+        with self.lock:
+            self.gauges[name, labels] = self.gauges.get((name, labels), 0) + amount
+            self.dirty = True
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, labels, list(entry)] for (name, labels), entry in self.histograms.items()],
+                "gauges": [[name, labels, value] for (name, labels), value in self.gauges.items()],
+            }
+
+    # FILES
+    # --------------------------------------------------------------------------
+    def path(self, name):
+        return os.path.join(app.config['METRICS_DIR'], name)
+
+    @contextmanager
+    def directory_lock(self):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+        with open(self.path('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def flush(self):
+        """
+        Writes this process's snapshot if anything changed since the last one.
+        """
+        if not self.dirty and self.flushed:
+            return
+        own = self.path(f"{os.getpid()}.json")
+        if not self.flushed:
+            # A file with our pid is from an earlier process that had it
+            with self.directory_lock():
+                if os.path.exists(own):
+                    self.archive(own)
+            self.flushed = True
+        self.dirty = False
+        tmp = f"{own}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, own)
+
+    def archive(self, path):
+        """
+        Folds the counters and histograms of a finished process into
+        archive.json and removes its file. Call with directory_lock held.
+        """
+        totals = {"counters": {}, "histograms": {}, "gauges": {}}
+        for snapshot_path in (self.path('archive.json'), path):
+            merge_metrics(totals, read_metrics_file(snapshot_path), gauges=False)
+        tmp = self.path(f"archive.json.{uuid.uuid4().hex}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(metrics_snapshot(totals), f)
+        os.replace(tmp, self.path('archive.json'))
+        os.remove(path)
+
+    def collect(self):
+        """
+        Totals of all the processes: {"counters": {(name, labels): value},
+        "histograms": {...: [buckets..., sum, count]}, "gauges": {...}}.
+        """
+        own_pid = os.getpid()
+        totals = {"counters": {}, "histograms": {}, "gauges": {}}
+        merge_metrics(totals, self.snapshot(), gauges=True)
+        with self.directory_lock():
+            for filename in sorted(os.listdir(app.config['METRICS_DIR'])):
+                pid = filename[:-len('.json')]
+                if not filename.endswith('.json') or not pid.isdigit() or int(pid) == own_pid:
+                    continue
+                if process_alive(int(pid)):
+                    merge_metrics(totals, read_metrics_file(self.path(filename)), gauges=True)
+                else:
+                    self.archive(self.path(filename))
+            merge_metrics(totals, read_metrics_file(self.path('archive.json')), gauges=False)
+        return totals
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def read_metrics_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def merge_metrics(totals, snapshot, gauges):
+    """
+    Adds a snapshot (lists, as written to disk) into totals (dicts).
+    """
+    for name, labels, value in snapshot.get('counters', ()):
+        key = (name, tuple(map(tuple, labels)))
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+    for name, labels, entry in snapshot.get('histograms', ()):
+        key = (name, tuple(map(tuple, labels)))
+        current = totals['histograms'].get(key)
+        totals['histograms'][key] = entry if current is None else [a + b for a, b in zip(current, entry)]
+    if gauges:
+        for name, labels, value in snapshot.get('gauges', ()):
+            key = (name, tuple(map(tuple, labels)))
+            totals['gauges'][key] = totals['gauges'].get(key, 0) + value
+
+def metrics_snapshot(totals):
+    """
+    The inverse of merge_metrics(): totals back to the on-disk lists.
+    """
+    return {
+        kind: [[name, labels, value] for (name, labels), value in totals[kind].items()]
+        for kind in ('counters', 'histograms', 'gauges')
+    }
+
+metrics = MetricsRegistry()
+
+def record_cache_lookup(cache, hit):
+    metrics.inc('cache_requests_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+def start_metrics_flusher():
+    """
+    Starts the thread that writes this process's metrics every METRICS_FLUSH_INTERVAL.
+    """
+    def run():
+        while True:
+            time.sleep(app.config['METRICS_FLUSH_INTERVAL'])
+            try:
+                metrics.flush()
+            except OSError:
+                app.logger.exception("Writing metrics failed")
+
+    atexit.register(metrics.flush)
+    thread = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+    thread.start()
+    return thread
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def render_metrics(totals):
+    """
+    Prometheus text exposition format (version 0.0.4) for collect() totals.
+    """
+    series = collections.defaultdict(list)
+    for kind in ('counters', 'gauges'):
+        for (name, labels), value in sorted(totals[kind].items()):
+            series[name].append(f"{name}{format_metric_labels(labels)} {value}")
+    # Series sorted by labels; within one, the buckets in bound order, then
+    # _sum and _count
+    for (name, labels), entry in sorted(totals['histograms'].items()):
+        cumulative = 0
+        for bound, count in zip(METRIC_BUCKETS[name], entry):
+            cumulative += count
+            series[name].append(f"{name}_bucket{format_metric_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+        series[name].append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {entry[-1]}")
+        series[name].append(f"{name}_sum{format_metric_labels(labels)} {entry[-2]}")
+        series[name].append(f"{name}_count{format_metric_labels(labels)} {entry[-1]}")
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(series[name])
+    return '\n'.join(lines) + '\n'
+
+
+###########################################################
+#  3l. Profiling (cProfile on sampled or flagged requests)
+###########################################################
+
+# A request is profiled when an admin (or a client with PROFILE_TOKEN) asks for
+# it with an "X-Profile" header or "?_profile=1", or when it falls in the
+# sample (profiler_settings["sample_rate"]). Each profile is saved in
+# PROFILE_DIR as <id>.prof (pstats: snakeviz, `python -m pstats`), <id>.json
+# (request, duration, top functions) and, by a background job,
+# <id>.collapsed (folded stacks for flamegraph.pl or speedscope).
+PROFILE_ID_RE = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+# cProfile allows one active profiler per process: concurrent requests that
+# should be profiled are skipped while another one is. From Python 3.12 on it
+# hooks sys.monitoring, which covers every thread: with threaded workers
+# (gthread, ASGI executor) a profile also holds the calls of the requests and
+# background threads running meanwhile. Profile on a sync worker when exact
+# figures matter.
+profile_lock = threading.Lock()
+
+def profile_path(profile_id, extension):
+    return os.path.join(app.config['PROFILE_DIR'], f"{profile_id}.{extension}")
+
+def profile_reason():
+    """
+    'requested', 'sampled' or None for the current request.
+    """
+    flag = request.headers.get('X-Profile') or request.args.get('_profile')
+    if flag:
+        token = app.config.get('PROFILE_TOKEN')
+        if session.get('role') == 'admin' or (token and tokens_match(flag, token)):
+            return 'requested'
+    rate = profiler_settings.get('sample_rate') or 0
+    if rate and random.random() < rate:
+        return 'sampled'
+    return None
+
+def function_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ':')  # built-in
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ':')
+
+def save_profile(profiler, reason, duration, status):
+    """
+    Writes the .prof and .json files of a finished request profile and queues
+    the flame graph export. Returns the profile id.
+    """
+    profile_id = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(4)}"
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    profiler.dump_stats(profile_path(profile_id, 'prof'))
+    stats = pstats.Stats(profiler).stats
+    # The functions that spent the most time themselves (tottime)
+    top = sorted(stats.items(), key=lambda entry: entry[1][2], reverse=True)[:10]
+    meta = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.full_path.rstrip('?'),
+        "endpoint": request.url_rule.endpoint if request.url_rule else None,
+        "status": status,
+        "duration": duration,
+        "reason": reason,
+        "created_at": time.time(),
+        "top": [[function_label(func), entry[2]] for func, entry in top],
+    }
+    with open(profile_path(profile_id, 'json'), 'w') as f:
+        json.dump(meta, f)
+    enqueue_job('export_profile', profile_id)
+    return profile_id
+
+def collapsed_stacks(stats, min_seconds=1e-6, max_depth=64):
+    """
+    Folded stacks ("a;b;c <microseconds>" lines) rebuilt from the pstats call
+    graph. cProfile only records caller/callee pairs, so the time of a
+    function called from several places is split between them pro rata.
+    """
+    callees = collections.defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    folded = collections.Counter()
+
+    def walk(func, path, seconds):
+        total = stats[func][3]
+        share = seconds / total if total else 0
+        path = path + (function_label(func),)
+        folded[';'.join(path)] += stats[func][2] * share
+        if len(path) >= max_depth:
+            return
+        for callee, callee_seconds in callees[func].items():
+            callee_seconds *= share
+            if callee_seconds >= min_seconds and function_label(callee) not in path:
+                walk(callee, path, callee_seconds)
+
+    for func, entry in stats.items():
+        if not entry[4]:
+            walk(func, (), entry[3])
+    return [
+        f"{stack} {round(seconds * 1e6)}"
+        for stack, seconds in sorted(folded.items())
+        if round(seconds * 1e6) > 0
+    ]
+
+def export_profile(profile_id):
+    """
+    Job: writes the folded stacks of a saved profile, then prunes old profiles.
+    """
+    if not os.path.exists(profile_path(profile_id, 'prof')):
+        return  # already pruned
+    stats = pstats.Stats(profile_path(profile_id, 'prof')).stats
+    tmp = profile_path(profile_id, f"collapsed.{uuid.uuid4().hex}.tmp")
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(collapsed_stacks(stats)) + '\n')
+    os.replace(tmp, profile_path(profile_id, 'collapsed'))
+    prune_profiles()
+
+def list_profiles():
+    """
+    Metadata of the saved profiles, slowest first.
+    """
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.json') and PROFILE_ID_RE.match(filename[:-len('.json')]):
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(profiles, key=lambda meta: meta['duration'], reverse=True)
+
+def delete_profile(profile_id):
+    for extension in ('json', 'prof', 'collapsed'):
+        try:
+            os.remove(profile_path(profile_id, extension))
+        except FileNotFoundError:
+            pass
+
+def prune_profiles():
+    """
+    Ring buffer: keeps the PROFILE_KEEP slowest sampled profiles and the
+    PROFILE_KEEP most recent requested ones.
+    """
+    keep = app.config['PROFILE_KEEP']
+    profiles = list_profiles()
+    sampled = [meta for meta in profiles if meta['reason'] == 'sampled']
+    requested = sorted(
+        (meta for meta in profiles if meta['reason'] != 'sampled'),
+        key=lambda meta: meta['created_at'], reverse=True
+    )
+    for meta in sampled[keep:] + requested[keep:]:
+        delete_profile(meta['id'])
+
+register_job(export_profile, queue='maintenance', max_attempts=1)
+
+
+###########################################################
+#  3m. Memory Accounting
+###########################################################
+
+# In-process state worth accounting for (module globals, looked up by name
+# since the content collections are rebound on every change)
+MEMORY_COLLECTIONS = (
+    'users', 'destinations', 'culture', 'infos_pratiques', 'homepage_media',
+    'custom_pages', 'reply_templates', 'site_settings', 'activity_logs',
+    'upload_catalogue', 'media_references', 'media_owner_files', 'startup_timings',
+)
+
+# Sizes when the process started (set by create_app())
+memory_baseline = {}
+# Collections currently over budget, so the warning is logged once
+memory_over_budget = set()
+# Result of the last allocation trace of this process
+memory_trace = {}
+memory_trace_lock = threading.Lock()
+
+def deep_sizeof(obj):
+    """
+    Approximate memory held by `obj` and everything it contains (dicts,
+    lists, tuples, sets). Objects shared with other collections, such as
+    interned strings, are counted in each of them.
+    """
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(obj)
+    return size
+
+def current_rss():
+    """
+    Resident memory of this process in bytes (Linux), or None.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def collection_sizes():
+    """
+    {name: (items, bytes)} for MEMORY_COLLECTIONS.
+    """
+    sizes = {}
+    for name in MEMORY_COLLECTIONS:
+        value = globals()[name]
+        sizes[name] = (len(value), deep_sizeof(value))
+    return sizes
+
+def record_memory_baseline():
+    memory_baseline.update(time=time.time(), rss=current_rss(), sizes=collection_sizes())
+
+def memory_report(object_types=15):
+    """
+    Sizes, item counts and growth since start per collection, process RSS,
+    the most common object types and the last allocation trace.
+    """
+    now = time.time()
+    # Growth rates are meaningless over the first minute
+    hours = (now - memory_baseline.get('time', now)) / 3600
+    start_sizes = memory_baseline.get('sizes', {})
+    budgets = app.config['MEMORY_BUDGETS']
+    collections_report = []
+    for name, (items, size) in collection_sizes().items():
+        start_items, start_size = start_sizes.get(name, (0, 0))
+        budget = budgets.get(name)
+        collections_report.append({
+            "name": name,
+            "items": items,
+            "bytes": size,
+            "items_at_start": start_items,
+            "bytes_at_start": start_size,
+            "growth_per_hour": (size - start_size) / hours if hours >= 1 / 60 else None,
+            "budget": budget[0] if budget else None,
+            "action": budget[1] if budget else None,
+        })
+    collections_report.sort(key=lambda entry: entry['bytes'], reverse=True)
+    type_counts = collections.Counter(type(obj).__name__ for obj in gc.get_objects())
+    return {
+        "pid": os.getpid(),
+        "uptime": now - memory_baseline.get('time', now),
+        "rss": current_rss(),
+        "rss_at_start": memory_baseline.get('rss'),
+        "collections": collections_report,
+        "object_types": type_counts.most_common(object_types),
+        "tracemalloc": dict(memory_trace),
+    }
+
+def evict_activity_logs(budget):
+    while activity_logs and deep_sizeof(activity_logs) > budget:
+        del activity_logs[:max(len(activity_logs) // 2, 1)]
+
+def evict_upload_catalogue(budget):
+    # A cache: entries are probed again on their next use
+    upload_catalogue.clear()
+
+MEMORY_EVICTORS = {
+    'activity_logs': evict_activity_logs,
+    'upload_catalogue': evict_upload_catalogue,
+}
+
+def check_memory_budgets():
+    """
+    Recurring job: warns about (and for 'evict' budgets, trims) the
+    collections of this process that exceed their MEMORY_BUDGETS entry.
+    """
+    for name, (budget, action) in app.config['MEMORY_BUDGETS'].items():
+        size = deep_sizeof(globals()[name])
+        if size <= budget:
+            memory_over_budget.discard(name)
+            continue
+        if action == 'evict' and name in MEMORY_EVICTORS:
+            MEMORY_EVICTORS[name](budget)
+            app.logger.warning(
+                "%s used %d bytes (budget %d): trimmed to %d", name, size, budget, deep_sizeof(globals()[name])
+            )
+            activity_logs.append({
+                "user": "Système",
+                "action": f"Mémoire: {name} réduit ({size // 1024} Ko, budget {budget // 1024} Ko)",
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+        elif name not in memory_over_budget:
+            memory_over_budget.add(name)
+            app.logger.warning("%s uses %d bytes, over its budget of %d", name, size, budget)
+
+RECURRING_JOBS.append((check_memory_budgets, 'MEMORY_CHECK_INTERVAL', False))
+
+def start_allocation_trace(seconds, frames=10, top=20):
+    """
+    Traces this process's allocations with tracemalloc for `seconds` (it slows
+    everything down meanwhile), then keeps the `top` allocation sites still
+    holding memory in memory_trace. Returns False if a trace is already running.
+    """
+    with memory_trace_lock:
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(frames)
+        memory_trace.clear()
+        memory_trace.update(pid=os.getpid(), started=time.time(), seconds=seconds, running=True)
+
+    def finish():
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        tracemalloc.stop()
+        with memory_trace_lock:
+            memory_trace.update(running=False, top=[
+                {
+                    "where": str(stat.traceback[0]),
+                    "traceback": stat.traceback.format(limit=frames),
+                    "bytes": stat.size,
+                    "blocks": stat.count,
+                }
+                for stat in snapshot.statistics('traceback')[:top]
+            ])
+
+    timer = threading.Timer(seconds, finish)
+    timer.daemon = True
+    timer.start()
+    return True
+
+def format_bytes(size):
+    if size is None:
+        return '–'
+    for unit in ('o', 'Ko', 'Mo'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'o' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} Go"
+
+
+###########################################################
+#  4. Global HTML Template Rendering
+###########################################################
+
+@timed('layout')
+def render_page(title, content, active_page=None):
+    """
+    Renders a full-page HTML layout with a sidebar, navbar, footer, and given content.
+    `title` is for the <title> tag, while `content` is inserted as the main body.
+    `active_page` highlights the corresponding link in the nav.
+    """
+    # Generate sidebar items
+    sidebar_items = [
+        ('Accueil', '/'),
+        ('Destinations', '/destinations'),
+        ('Culture', '/culture'),
+        ('Infos Pratiques', '/infos-pratiques'),
+        ('Contact', '/contact'),
+    ]
+
+    # Extend items if user is logged in
+    if session.get('logged_in'):
+        sidebar_items.extend([
+            ('Gestion', '/manage'),
+            ('Déconnexion', '/logout')
+        ])
+    else:
+        sidebar_items.extend([
+            ('Connexion', '/login'),
+            ('Inscription', '/register')
+        ])
+
+    # Generate the HTML for the sidebar links
+    def icon_for_label(label):
+        """
+        A small helper to add relevant icons depending on the label.
+        """
+        if label == "Accueil":
+            return "home"
+        elif label == "Destinations":
+            return "map"
+        elif label == "Culture":
+            return "culture"  # (not a real FA icon, you can pick another if you want)
+        elif label == "Infos Pratiques":
+            return "info-circle"
+        elif label == "Contact":
+            return "envelope"
+        elif label == "Gestion":
+            return "cogs"
+        elif label == "Connexion":
+            return "sign-in-alt"
+        elif label == "Inscription":
+            return "user-plus"
+        elif label == "Déconnexion":
+            return "sign-out-alt"
+        return "file"
+
+    sidebar_html = ''.join([
+        f'''
+        <a href="{url}" 
+           class="{"active" if active_page == label else ""}">
+           <i class="fa fa-{icon_for_label(label)} me-2"></i>{label}
+        </a>
+        '''
+        for (label, url) in sidebar_items
+    ])
+
+    # Inbox shortcut with the unread counter, for administrators
+    inbox_link = ''
+    if session.get('role') == 'admin':
+        unread = inbox_counts().get('unread', 0)
+        inbox_link = f'''
+        <li class="nav-item">
+            <a class="nav-link" href="/manage/inbox" title="Messages non lus">
+                <i class="fa fa-envelope"></i>
+                <span class="badge rounded-pill {"bg-danger" if unread else "bg-secondary"}">{unread}</span>
+            </a>
+        </li>
+        '''
+
+    # Generate flash messages
+    flash_messages = ''.join([
+        f'''
+        <div class="alert alert-{category} alert-dismissible fade show" role="alert">
+            {message}
+            <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
+        </div>
+        '''
+        for category, message in get_flashed_messages(with_categories=True)
+    ])
+
+    # Additional styles (Bootstrap & FontAwesome are loaded from a CDN)
+    style = f"""
+    <!-- Google Fonts -->
+    <link href="https://fonts.googleapis.com/css2?family=Montserrat:wght@400;600&family=Roboto&display=swap" rel="stylesheet">
+    <!-- Bootstrap CSS -->
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+    <!-- Font Awesome -->
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+    <!-- CKEditor (loaded in <body>) -->
+    <style>
+        body {{
+            font-family: 'Roboto', sans-serif;
+            background-color: #f0f2f5;
+        }}
+        h1, h2, h3, h4, h5, h6 {{
+            font-family: 'Montserrat', sans-serif;
+        }}
+        .navbar {{
+            background-color: {site_settings['color_primary']} !important;
+        }}
+        .navbar-brand {{
+            font-size: 1.5rem;
+            font-weight: bold;
+        }}
+        .sidebar {{
+            height: 100vh;
+            position: fixed;
+            top: 0;
+            left: 0;
+            width: 250px;
+            background-color: {site_settings['color_secondary']};
+            padding-top: 70px;
+            transition: transform 0.3s ease-in-out;
+            z-index: 1000;
+        }}
+        .sidebar.collapsed {{
+            transform: translateX(-250px);
+        }}
+        .sidebar a {{
+            padding: 15px 20px;
+            display: block;
+            color: white;
+            text-decoration: none;
+            transition: background 0.3s;
+        }}
+        .sidebar a:hover {{
+            background-color: rgba(255, 255, 255, 0.1);
+        }}
+        .content {{
+            margin-left: 250px;
+            padding: 20px;
+            transition: margin-left 0.3s ease-in-out;
         }}
         .content.collapsed {{
             margin-left: 0;
@@ -454,6 +4167,7 @@ def render_page(title, content, active_page=None):
                         f'<li class="nav-item"><a class="nav-link {"active" if active_page == label else ""}" href="{url}">{label}</a></li>'
                         for label, url in sidebar_items
                     ])}
+                    {inbox_link}
                 </ul>
             </div>
         </div>
@@ -609,13 +4323,23 @@ def register():
             return redirect(url_for('register'))
 
         # Create a new user with role 'user'
-        hashed_password = generate_password_hash(password)
-        users.append({
-            "id": str(uuid.uuid4()),
-            "username": username,
-            "password": hashed_password,
-            "role": "user"
-        })
+        try:
+            hashed_password = hash_password(password)
+        except PasswordHasherBusy:
+            flash('Le service est momentanément surchargé. Veuillez réessayer dans quelques instants.', 'danger')
+            return redirect(url_for('register'))
+        with content_lock:
+            # Checked again: the name may have been taken while hashing
+            if any(user['username'] == username for user in users):
+                flash('Ce nom d\'utilisateur est déjà pris.', 'danger')
+                return redirect(url_for('register'))
+            user_id = str(uuid.uuid4())
+            commit_content_change('users', user_id, {
+                "id": user_id,
+                "username": username,
+                "password": hashed_password,
+                "role": "user"
+            })
         flash('Inscription réussie! Vous pouvez maintenant vous connecter.', 'success')
         # Log activity
         activity_logs.append({
@@ -667,11 +4391,24 @@ def register():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        username = request.form.get('username').strip()
-        password = request.form.get('password').strip()
+        username = request.form.get('username', '').strip()
+        password = request.form.get('password', '').strip()
+
+        client_ip = request_ip()
+        wait, attempt = login_throttle.begin_attempt(username, client_ip)
+        if wait:
+            flash(f'Trop de tentatives de connexion. Réessayez dans {format_wait(wait)}.', 'danger')
+            return redirect(url_for('login'))
 
         user = next((u for u in users if u['username'] == username), None)
-        if user and check_password_hash(user['password'], password):
+        try:
+            authenticated = bool(user) and verify_password(user['password'], password)
+        except PasswordHasherBusy:
+            flash('Le service de connexion est momentanément surchargé. Veuillez réessayer dans quelques instants.', 'danger')
+            return redirect(url_for('login'))
+        if authenticated:
+            login_throttle.record_success(attempt)
+            regenerate_session()
             session['logged_in'] = True
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -690,6 +4427,12 @@ def login():
                 return redirect(url_for('index'))
         else:
             flash('Nom d\'utilisateur ou mot de passe incorrect.', 'danger')
+            if login_throttle.record_failure(attempt):
+                activity_logs.append({
+                    "user": username or "Invité",
+                    "action": f"Connexion bloquée temporairement après trop d'échecs (IP {client_ip})",
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
 
     return render_page(
         "Connexion",
@@ -734,6 +4477,7 @@ def logout():
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         })
     session.clear()
+    regenerate_session()
     flash('Vous êtes déconnecté.', 'success')
     return redirect(url_for('index'))
 
@@ -741,8 +4485,9 @@ def logout():
 # ------------------------------------------------------------------------------
 @app.route('/')
 def index():
-    sorted_dest = sorted(destinations, key=lambda x: x['order'])
-    featured_destinations = sorted_dest[:3]
+    with server_timing('data'):
+        sorted_dest = sorted(destinations, key=lambda x: x['order'])
+        featured_destinations = sorted_dest[:3]
 
     # Build the carousel if there's media
     if homepage_media:
@@ -760,11 +4505,12 @@ def index():
             f'''
             <div class="carousel-item {"active" if i == 0 else ""}">
                 {
-                    '<img src="' + media['path'] + '" class="d-block w-100" alt="' + media.get('title', '') + '">'
+                    '<img src="' + media['path'] + '" class="d-block w-100" alt="' + media.get('title', '') + '"'
+                    + image_attrs(media['path'], lazy=i > 0) + '>'
                     if media['type'] == 'image'
                     else
-                    f'<video class="d-block w-100" controls>'
-                    f'<source src="{media["path"]}" type="video/{media["path"].rsplit(".", 1)[1].lower()}">'
+                    f'<video class="d-block w-100" controls preload="metadata"{size_attrs(media["path"])}>'
+                    f'<source src="{media_url(media["path"])}" type="video/{media["path"].rsplit(".", 1)[1].lower()}">'
                     f'Votre navigateur ne supporte pas les vidéos HTML5.</video>'
                 }
                 {
@@ -814,7 +4560,7 @@ def index():
                 f'''
                 <div class="col-md-4 mb-4">
                     <div class="card h-100 dashboard-card">
-                        <img src="{dest['image']}" class="card-img-top" 
+                        <img src="{dest['image']}" class="card-img-top"{image_attrs(dest['image'], lazy=bool(homepage_media))}
                              alt="Vue panoramique de {dest['nom']}">
                         <div class="card-body d-flex flex-column">
                             <h5 class="card-title">{dest['nom']}</h5>
@@ -841,15 +4587,16 @@ def liste_destinations():
     page = int(request.args.get('page', 1))
     per_page = 6
 
-    if search_query:
-        filtered = [
-            d for d in destinations
-            if (search_query in d['nom'].lower() or search_query in d['description'].lower())
-        ]
-    else:
-        filtered = destinations
+    with server_timing('data'):
+        if search_query:
+            filtered = [
+                d for d in destinations
+                if (search_query in d['nom'].lower() or search_query in d['description'].lower())
+            ]
+        else:
+            filtered = destinations
+        sorted_dest = sorted(filtered, key=lambda x: x['order'])
 
-    sorted_dest = sorted(filtered, key=lambda x: x['order'])
     total = len(sorted_dest)
     pages = (total + per_page - 1) // per_page
     paginated = sorted_dest[(page - 1)*per_page : page*per_page]
@@ -906,7 +4653,7 @@ def liste_destinations():
                 f'''
                 <div class="col-md-4 mb-4">
                     <div class="card dashboard-card">
-                        <img src="{dest['image']}" class="card-img-top"
+                        <img src="{dest['image']}" class="card-img-top"{image_attrs(dest['image'], lazy=i >= 3)}
                              alt="Vue panoramique de {dest['nom']}">
                         <div class="card-body d-flex flex-column">
                             <h5 class="card-title">{dest['nom']}</h5>
@@ -915,7 +4662,7 @@ def liste_destinations():
                     </div>
                 </div>
                 '''
-                for dest in paginated
+                for i, dest in enumerate(paginated)
             ])}
         </div>
         {pagination}
@@ -931,15 +4678,16 @@ def culture_niger():
     page = int(request.args.get('page', 1))
     per_page = 6
 
-    if search_query:
-        filtered = [
-            c for c in culture
-            if (search_query in c['nom'].lower() or search_query in c['description'].lower())
-        ]
-    else:
-        filtered = culture
+    with server_timing('data'):
+        if search_query:
+            filtered = [
+                c for c in culture
+                if (search_query in c['nom'].lower() or search_query in c['description'].lower())
+            ]
+        else:
+            filtered = culture
+        sorted_cult = sorted(filtered, key=lambda x: x['nom'])
 
-    sorted_cult = sorted(filtered, key=lambda x: x['nom'])
     total = len(sorted_cult)
     pages = (total + per_page - 1) // per_page
     paginated = sorted_cult[(page - 1)*per_page : page*per_page]
@@ -996,7 +4744,8 @@ def culture_niger():
                 <div class="col-md-4 mb-4">
                     <div class="card dashboard-card">
                         {
-                            '<img src="' + item['image'] + '" class="card-img-top" alt="' + item['nom'] + '">'
+                            '<img src="' + item['image'] + '" class="card-img-top" alt="' + item['nom'] + '"'
+                            + image_attrs(item['image'], lazy=i >= 3) + '>'
                             if item['image']
                             else ''
                         }
@@ -1007,7 +4756,7 @@ def culture_niger():
                     </div>
                 </div>
                 '''
-                for item in paginated
+                for i, item in enumerate(paginated)
             ])}
         </div>
         {pagination}
@@ -1057,35 +4806,44 @@ def informations_pratiques_route():
 @app.route('/contact', methods=['GET', 'POST'])
 def contact():
     if request.method == 'POST':
-        nom = request.form.get('nom').strip()
-        email = request.form.get('email').strip()
-        msg_text = request.form.get('message').strip()
+        allowed, retry_after = contact_limiter.allow(request_ip())
+        if not allowed:
+            return Response(
+                'Trop de messages envoyés. Veuillez réessayer plus tard.',
+                status=429,
+                mimetype='text/plain',
+                headers={'Retry-After': str(int(retry_after) + 1)}
+            )
+
+        # Bots get the normal confirmation, but their message is dropped
+        if looks_automated(request.form, contact_form_rendered_at(request.form.get('form_token'))):
+            flash('Votre message a bien été envoyé !', 'success')
+            return redirect(url_for('contact'))
+
+        nom = request.form.get('nom', '').strip()
+        email = request.form.get('email', '').strip()
+        msg_text = request.form.get('message', '').strip()
 
         if not nom or not email or not msg_text:
             flash('Veuillez remplir tous les champs du formulaire.', 'danger')
             return redirect(url_for('contact'))
 
-        messages.append({
+        max_length = app.config['CONTACT_MAX_LENGTH']
+        msg = {
             "id": str(uuid.uuid4()),
-            "nom": nom,
-            "email": email,
-            "message": msg_text,
-            "lu": False
-        })
+            "nom": nom[:200],
+            "email": email[:200],
+            "message": msg_text[:max_length],
+            "lu": 0,
+            "received_at": time.time()
+        }
+        try:
+            contact_queue.put_nowait((msg, session.get('username') or "Invité"))
+        except queue.Full:
+            flash('Le service est momentanément surchargé. Veuillez réessayer plus tard.', 'danger')
+            return redirect(url_for('contact'))
 
-        flash('Votre message a bien été envoyé !', 'success')
-        if session.get('username'):
-            activity_logs.append({
-                "user": session['username'],
-                "action": f"Envoyé un message via le formulaire de contact",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-        else:
-            activity_logs.append({
-                "user": "Invité",
-                "action": f"Envoyé un message via le formulaire de contact",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+        flash('Votre message a bien été envoyé !', 'success')
         return redirect(url_for('contact'))
 
     content = f"""
@@ -1096,6 +4854,7 @@ def contact():
                 <div class="card shadow">
                     <div class="card-body">
                         <form method="POST">
+                            <input type="hidden" name="form_token" value="{contact_form_token()}">
                             <div class="mb-3">
                                 <label for="nom" class="form-label">Nom :</label>
                                 <input type="text" class="form-control" name="nom" id="nom" required>
@@ -1106,7 +4865,13 @@ def contact():
                             </div>
                             <div class="mb-3">
                                 <label for="message" class="form-label">Message :</label>
-                                <textarea class="form-control" name="message" id="message" rows="5" required></textarea>
+                                <textarea class="form-control" name="message" id="message" rows="5"
+                                          maxlength="{app.config['CONTACT_MAX_LENGTH']}" required></textarea>
+                            </div>
+                            <div style="position: absolute; left: -10000px;" aria-hidden="true">
+                                <label for="{app.config['CONTACT_HONEYPOT_FIELD']}">Ne pas remplir :</label>
+                                <input type="text" name="{app.config['CONTACT_HONEYPOT_FIELD']}"
+                                       id="{app.config['CONTACT_HONEYPOT_FIELD']}" tabindex="-1" autocomplete="off">
                             </div>
                             <button type="submit" class="btn btn-custom">
                                 <i class="fa fa-paper-plane me-2"></i> Envoyer
@@ -1120,6 +4885,104 @@ def contact():
     """
     return render_page("Contact", content, active_page='Contact')
 
+# MEDIA THUMBNAILS
+# ------------------------------------------------------------------------------
+@app.route('/media/thumbs/<string:filename>')
+def media_thumbnail(filename):
+    filename = secure_filename(filename)
+    thumb = ensure_thumbnail(filename) if filename else None
+    if not thumb:
+        raise NotFound()
+    return send_file(
+        os.path.abspath(thumb),
+        mimetype='image/jpeg',
+        max_age=app.config['MEDIA_MAX_AGE']
+    )
+
+# MEDIA (BYTE RANGES)
+# ------------------------------------------------------------------------------
+@app.route('/media/<string:filename>')
+def media_file(filename):
+    """
+    Serves an uploaded file with Range / If-Range support so videos can be
+    seeked and played on mobile browsers. Behind a proxy (MEDIA_OFFLOAD) the
+    transfer is delegated with X-Accel-Redirect or X-Sendfile; otherwise full
+    and open-ended ranges go through `wsgi.file_wrapper`, which gunicorn turns
+    into an os.sendfile() zero-copy transfer.
+    """
+    filename = secure_filename(filename)
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not filename or not os.path.isfile(file_path):
+        raise NotFound()
+
+    stat = os.stat(file_path)
+    size = stat.st_size
+    etag = f"{stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in VIDEO_EXTENSIONS:
+        mimetype = f'video/{extension}'
+    else:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': f"public, max-age={app.config['MEDIA_MAX_AGE']}"
+    }
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    # The proxy re-reads the file and applies the Range header itself.
+    offload = app.config.get('MEDIA_OFFLOAD')
+    if offload == 'x-accel':
+        headers['X-Accel-Redirect'] = app.config['MEDIA_ACCEL_PREFIX'] + filename
+        return Response(headers=headers, mimetype=mimetype)
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(file_path)
+        return Response(headers=headers, mimetype=mimetype)
+
+    # A stale If-Range validator means the client must get the whole file.
+    byte_range = request.range
+    if_range = request.if_range
+    if byte_range is not None and (if_range.etag or if_range.date):
+        if if_range.etag and if_range.etag != etag:
+            byte_range = None
+        elif if_range.date and if_range.date != last_modified:
+            byte_range = None
+
+    status = 200
+    start, stop = 0, size
+    if byte_range is not None and byte_range.units == 'bytes':
+        span = byte_range.range_for_length(size) if len(byte_range.ranges) == 1 else None
+        if span is None:
+            # Multipart/byteranges is not supported, nor are unsatisfiable ranges.
+            return Response(
+                status=416,
+                headers={'Content-Range': f'bytes */{size}', 'Accept-Ranges': 'bytes'}
+            )
+        start, stop = span
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    length = stop - start
+    headers['Content-Length'] = str(length)
+    file = open(file_path, 'rb')
+    if stop == size:
+        file.seek(start)
+        body = wrap_file(request.environ, file, app.config['MEDIA_CHUNK_SIZE'])
+    else:
+        body = iter_file_range(file, start, length, app.config['MEDIA_CHUNK_SIZE'])
+    return Response(
+        body,
+        status=status,
+        headers=headers,
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+
 ###########################################################
 #  6. Admin / Manage Routes
 ###########################################################
@@ -1132,10 +4995,7 @@ def manage():
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    uploaded_files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-    ]
+    recent_uploads = list_uploads()
     content_admin = ""
 
     # Handle uploading new files
@@ -1148,18 +5008,20 @@ def manage():
             elif file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
                 file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                enqueue_job('prepare_upload', filename)  # placeholder and thumbnail, off the request
 
                 if media_type == 'homepage':
-                    homepage_media.append({
+                    media = {
                         "id": str(uuid.uuid4()),
                         "type": (
                             'video'
-                            if filename.rsplit('.', 1)[1].lower() in {'mp4', 'webm', 'ogg'}
+                            if filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
                             else 'image'
                         ),
                         "path": f"/static/uploads/{filename}",
                         "title": request.form.get('title', '')
-                    })
+                    }
+                    commit_content_change('homepage_media', media['id'], media)
                     flash(
                         f'Fichier {filename} uploadé et ajouté à la page d\'accueil avec succès !',
                         'success'
@@ -1183,11 +5045,15 @@ def manage():
                 flash('Type de fichier non autorisé.', 'danger')
         elif 'setting_title' in request.form:
             # Update site settings
-            site_settings['title'] = request.form.get('setting_title').strip()
-            site_settings['description'] = request.form.get('setting_description').strip()
-            site_settings['color_primary'] = request.form.get('setting_color_primary').strip()
-            site_settings['color_secondary'] = request.form.get('setting_color_secondary').strip()
-            site_settings['footer_text'] = request.form.get('setting_footer_text').strip()
+            with content_lock:
+                commit_content_change('site_settings', 'site', {
+                    **site_settings,
+                    'title': request.form.get('setting_title').strip(),
+                    'description': request.form.get('setting_description').strip(),
+                    'color_primary': request.form.get('setting_color_primary').strip(),
+                    'color_secondary': request.form.get('setting_color_secondary').strip(),
+                    'footer_text': request.form.get('setting_footer_text').strip()
+                })
             flash('Paramètres du site mis à jour avec succès!', 'success')
             activity_logs.append({
                 "user": session['username'],
@@ -1204,11 +5070,12 @@ def manage():
             <div class="col-md-4 mb-4">
                 <div class="card dashboard-card">
                     {
-                        '<img src="' + media['path'] + '" class="d-block w-100" alt="' + media.get('title', '') + '">'
+                        '<img src="' + media['path'] + '" class="d-block w-100" alt="' + media.get('title', '') + '"'
+                        + image_attrs(media['path']) + '>'
                         if media['type'] == 'image'
                         else
-                        f'<video class="d-block w-100" controls>'
-                        f'<source src="{media["path"]}" type="video/{media["path"].rsplit(".", 1)[1].lower()}">'
+                        f'<video class="d-block w-100" controls preload="metadata"{size_attrs(media["path"])}>'
+                        f'<source src="{media_url(media["path"])}" type="video/{media["path"].rsplit(".", 1)[1].lower()}">'
                         f'Votre navigateur ne supporte pas les vidéos HTML5.</video>'
                     }
                     <div class="card-body text-center">
@@ -1264,31 +5131,17 @@ def manage():
     <section class="admin-section mb-5">
         <h2 class="mb-4">Gestion des Médias pour les Pages Personnalisées</h2>
         <p>Les fichiers uploadés ici peuvent être utilisés dans les pages personnalisées.</p>
+        <div class="mb-3">
+            <a href="/manage/media" class="btn btn-primary">
+                <i class="fa fa-photo-video me-2"></i> Ouvrir la médiathèque ({len(recent_uploads)} fichiers)
+            </a>
+        </div>
+        <h3 class="mb-3">Derniers fichiers uploadés</h3>
         <div class="row">
             {''.join([
-                f'''
-                <div class="col-md-4 mb-4">
-                    <div class="card dashboard-card">
-                        {
-                            '<img src="/static/uploads/{file}" class="card-img-top" alt="{file}">'
-                            if file.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
-                            else
-                            f'<video class="card-img-top" controls>'
-                            f'<source src="/static/uploads/{file}" type="video/{file.rsplit(".", 1)[1].lower()}">'
-                            f'</video>'
-                        }
-                        <div class="card-body text-center">
-                            <p class="card-text">{file}</p>
-                            <a href="/manage/delete_uploaded_image/{file}" 
-                               class="btn btn-danger btn-sm">
-                               <i class="fa fa-trash me-2"></i> Supprimer
-                            </a>
-                        </div>
-                    </div>
-                </div>
-                '''
-                for file in uploaded_files
-            ]) if uploaded_files else '<p>Aucun fichier uploadé.</p>'}
+                media_card(upload)
+                for upload in recent_uploads[:6]
+            ]) if recent_uploads else '<p>Aucun fichier uploadé.</p>'}
         </div>
     </section>
     """
@@ -1532,17 +5385,55 @@ def manage():
     """
 
     # MANAGE CONTACT MESSAGES
+    counts = inbox_counts()
+    latest_unread, _ = search_messages(status='unread', per_page=5)
     content_admin += f"""
     <section class="admin-section mb-5">
         <h2 class="mb-4">Boîte de Réception des Messages</h2>
+        <p>
+            <span class="badge bg-danger me-2">Non lus : {counts['unread']}</span>
+            <span class="badge bg-secondary me-2">Total : {counts['total']}</span>
+        </p>
+        <ul class="list-group mb-3">
+            {''.join([
+                f'''
+                <li class="list-group-item d-flex justify-content-between align-items-center">
+                    <span><strong>{msg['nom']}</strong> &lt;{msg['email']}&gt; — {msg['message'][:80]}</span>
+                    <a href="/manage/reply_message/{msg['id']}" class="btn btn-sm btn-primary">
+                        <i class="fa fa-reply me-1"></i> Répondre
+                    </a>
+                </li>
+                '''
+                for msg in latest_unread
+            ]) if latest_unread else '<li class="list-group-item">Aucun message non lu.</li>'}
+        </ul>
+        <a href="/manage/inbox" class="btn btn-primary">
+            <i class="fa fa-inbox me-2"></i> Ouvrir la boîte de réception
+        </a>
+    </section>
+    """
+
+    # OUTGOING MAIL
+    outbox_counts, outbox_recent = outbox_summary()
+    content_admin += f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Boîte d'Envoi</h2>
+        <p>
+            {' '.join([
+                f'<span class="badge bg-{badge} me-2">{label} : {outbox_counts.get(status, 0)}</span>'
+                for status, (label, badge) in OUTBOX_STATUS_LABELS.items()
+            ])}
+        </p>
         <div class="table-responsive">
             <table class='table table-striped table-hover'>
                 <thead class="table-warning">
                     <tr>
-                        <th>Nom</th>
-                        <th>Email</th>
-                        <th>Message</th>
-                        <th>Lu</th>
+                        <th>Destinataire</th>
+                        <th>Sujet</th>
+                        <th>Statut</th>
+                        <th>Tentatives</th>
+                        <th>Dernière erreur</th>
+                        <th>Créé le</th>
                         <th>Actions</th>
                     </tr>
                 </thead>
@@ -1550,34 +5441,50 @@ def manage():
                     {''.join([
                         f"""
                         <tr>
-                            <td>{msg['nom']}</td>
-                            <td>{msg['email']}</td>
-                            <td>{msg['message']}</td>
-                            <td>{'Oui' if msg['lu'] else 'Non'}</td>
+                            <td>{', '.join(json.loads(row['recipients']))}</td>
+                            <td>{row['subject']}</td>
+                            <td><span class="badge bg-{OUTBOX_STATUS_LABELS[row['status']][1]}">
+                                {OUTBOX_STATUS_LABELS[row['status']][0]}</span></td>
+                            <td>{row['attempts']}</td>
+                            <td class="small">{row['last_error'] or ''}</td>
+                            <td>{datetime.fromtimestamp(row['created_at']).strftime("%Y-%m-%d %H:%M:%S")}</td>
                             <td>
-                                <a href="/manage/reply_message/{msg['id']}"
-                                   class='btn btn-sm btn-primary'>
-                                   <i class='fa fa-reply me-1'></i> Répondre
-                                </a>
-                                <a href="/manage/mark_message/{msg['id']}"
-                                   class='btn btn-sm btn-info'>
-                                   <i class='fa fa-eye me-1'></i> Marquer comme {'Non Lu' if msg['lu'] else 'Lu'}
-                                </a>
-                                <a href="/manage/delete_message/{msg['id']}"
-                                   class='btn btn-sm btn-danger btn-delete'>
-                                   <i class='fa fa-trash me-1'></i> Supprimer
-                                </a>
+                                {f'''<a href="/manage/outbox/retry/{row['id']}" class='btn btn-sm btn-warning'>
+                                     <i class='fa fa-redo me-1'></i> Réessayer</a>'''
+                                 if row['status'] in ('dead', 'pending') else ''}
                             </td>
                         </tr>
                         """
-                        for msg in messages
-                    ]) if messages else '<tr><td colspan="5" class="text-center">Aucun message reçu.</td></tr>'}
+                        for row in outbox_recent
+                    ]) if outbox_recent else '<tr><td colspan="7" class="text-center">Aucun email envoyé.</td></tr>'}
                 </tbody>
             </table>
         </div>
     </section>
     """
 
+    # BACKGROUND JOBS
+    job_stats = job_queue_stats()
+    content_admin += f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Tâches de Fond</h2>
+        <p>
+            <span class="badge bg-secondary me-2">En attente : {sum(s['due'] for s in job_stats.values())}</span>
+            <span class="badge bg-info me-2">En cours : {sum(s['running'] for s in job_stats.values())}</span>
+            <span class="badge bg-danger me-2">Échecs définitifs : {sum(s['dead'] for s in job_stats.values())}</span>
+        </p>
+        <a href="/manage/jobs" class="btn btn-primary">
+            <i class="fa fa-tasks me-2"></i> Voir les files de tâches
+        </a>
+        <a href="/manage/profiling" class="btn btn-secondary">
+            <i class="fa fa-stopwatch me-2"></i> Profilage des requêtes
+        </a>
+        <a href="/manage/memory" class="btn btn-secondary">
+            <i class="fa fa-memory me-2"></i> Mémoire
+        </a>
+    </section>
+    """
+
     # SITE STATISTICS
     content_admin += f"""
     <section class="admin-section mb-5">
@@ -1709,11 +5616,6 @@ def manage_add_destination():
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    uploaded_files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-    ]
-
     if request.method == 'POST':
         nom = request.form.get('nom').strip()
         description = request.form.get('description').strip()
@@ -1730,13 +5632,14 @@ def manage_add_destination():
             flash('L\'ordre doit être un nombre entier.', 'danger')
             return redirect(url_for('manage_add_destination'))
 
-        destinations.append({
+        dest = {
             "id": str(uuid.uuid4()),
             "nom": nom,
             "description": description,
             "image": image,
             "order": order_int
-        })
+        }
+        commit_content_change('destinations', dest['id'], dest)
         flash('La destination a été ajoutée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -1763,13 +5666,7 @@ def manage_add_destination():
             </div>
             <div class="col-12">
                 <label for="image" class="form-label">Image :</label>
-                <select class="form-select" name="image" id="image" required>
-                    <option value="" disabled selected>Sélectionnez une image</option>
-                    {''.join([
-                        f'<option value="/static/uploads/{file}">{file}</option>'
-                        for file in uploaded_files
-                    ])}
-                </select>
+                {media_picker('image')}
             </div>
             <div class="col-12">
                 <button type="submit" class="btn btn-primary">
@@ -1793,11 +5690,6 @@ def manage_edit_destination(destination_id):
         flash('Destination non trouvée.', 'danger')
         return redirect(url_for('manage'))
 
-    uploaded_files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-    ]
-
     if request.method == 'POST':
         nom = request.form.get('nom').strip()
         description = request.form.get('description').strip()
@@ -1814,10 +5706,16 @@ def manage_edit_destination(destination_id):
             flash('L\'ordre doit être un nombre entier.', 'danger')
             return redirect(url_for('manage_edit_destination', destination_id=destination_id))
 
-        destination['nom'] = nom
-        destination['description'] = description
-        destination['image'] = image
-        destination['order'] = order_int
+        with content_lock:
+            _, destination = with_item_replaced(
+                destinations, destination_id,
+                nom=nom, description=description, image=image, order=order_int
+            )
+            if destination:
+                commit_content_change('destinations', destination_id, destination)
+        if not destination:
+            flash('Destination non trouvée.', 'danger')
+            return redirect(url_for('manage'))
         flash('La destination a été mise à jour avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -1847,15 +5745,7 @@ def manage_edit_destination(destination_id):
             </div>
             <div class="col-12">
                 <label for="image" class="form-label">Image :</label>
-                <select class="form-select" name="image" id="image" required>
-                    <option value="" disabled>Sélectionnez une image</option>
-                    {''.join([
-                        f'<option value="/static/uploads/{file}" '
-                        f'{"selected" if f"/static/uploads/{file}" == destination["image"] else ""}>'
-                        f'{file}</option>'
-                        for file in uploaded_files
-                    ])}
-                </select>
+                {media_picker('image', destination['image'])}
             </div>
             <div class="col-12">
                 <button type="submit" class="btn btn-warning">
@@ -1874,10 +5764,11 @@ def manage_delete_destination(destination_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global destinations
-    dest = next((d for d in destinations if d['id'] == destination_id), None)
+    with content_lock:
+        _, dest = with_item_removed(destinations, destination_id)
+        if dest:
+            commit_content_change('destinations', destination_id, None)
     if dest:
-        destinations = [d for d in destinations if d['id'] != destination_id]
         flash('La destination a été supprimée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -1899,11 +5790,6 @@ def manage_add_culture():
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    uploaded_files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-    ]
-
     if request.method == 'POST':
         nom = request.form.get('nom').strip()
         description = request.form.get('description').strip()
@@ -1913,12 +5799,13 @@ def manage_add_culture():
             flash('Veuillez remplir tous les champs.', 'danger')
             return redirect(url_for('manage_add_culture'))
 
-        culture.append({
+        item = {
             "id": str(uuid.uuid4()),
             "nom": nom,
             "description": description,
             "image": image if image != 'None' else None
-        })
+        }
+        commit_content_change('culture', item['id'], item)
         flash('L\'entrée culturelle a été ajoutée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -1937,13 +5824,7 @@ def manage_add_culture():
             </div>
             <div class="col-md-6">
                 <label for="image" class="form-label">Image :</label>
-                <select class="form-select" name="image" id="image">
-                    <option value="None" selected>Aucune image</option>
-                    {''.join([
-                        f'<option value="/static/uploads/{file}">{file}</option>'
-                        for file in uploaded_files
-                    ])}
-                </select>
+                {media_picker('image', allow_empty=True)}
             </div>
             <div class="col-12">
                 <label for="description" class="form-label">Description :</label>
@@ -1972,11 +5853,6 @@ def manage_edit_culture(culture_id):
         flash('Entrée culturelle non trouvée.', 'danger')
         return redirect(url_for('manage'))
 
-    uploaded_files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-    ]
-
     if request.method == 'POST':
         nom = request.form.get('nom').strip()
         description = request.form.get('description').strip()
@@ -1986,9 +5862,16 @@ def manage_edit_culture(culture_id):
             flash('Veuillez remplir tous les champs.', 'danger')
             return redirect(url_for('manage_edit_culture', culture_id=culture_id))
 
-        item['nom'] = nom
-        item['description'] = description
-        item['image'] = image if image != 'None' else None
+        with content_lock:
+            _, item = with_item_replaced(
+                culture, culture_id,
+                nom=nom, description=description, image=image if image != 'None' else None
+            )
+            if item:
+                commit_content_change('culture', culture_id, item)
+        if not item:
+            flash('Entrée culturelle non trouvée.', 'danger')
+            return redirect(url_for('manage'))
         flash('L\'entrée culturelle a été mise à jour avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2008,14 +5891,7 @@ def manage_edit_culture(culture_id):
             </div>
             <div class="col-md-6">
                 <label for="image" class="form-label">Image :</label>
-                <select class="form-select" name="image" id="image">
-                    <option value="None" {"selected" if not item['image'] else ""}>Aucune image</option>
-                    {''.join([
-                        f'<option value="/static/uploads/{file}" '
-                        f'{"selected" if f"/static/uploads/{file}" == item["image"] else ""}>{file}</option>'
-                        for file in uploaded_files
-                    ])}
-                </select>
+                {media_picker('image', item['image'], allow_empty=True)}
             </div>
             <div class="col-12">
                 <label for="description" class="form-label">Description :</label>
@@ -2039,10 +5915,11 @@ def manage_delete_culture(culture_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global culture
-    item = next((c for c in culture if c['id'] == culture_id), None)
+    with content_lock:
+        _, item = with_item_removed(culture, culture_id)
+        if item:
+            commit_content_change('culture', culture_id, None)
     if item:
-        culture = [c for c in culture if c['id'] != culture_id]
         flash('L\'entrée culturelle a été supprimée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2064,14 +5941,19 @@ def manage_delete_uploaded_image(filename):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    # Safe delete: refuse while a destination, culture item, homepage slide or
+    # custom page still points at the file.
+    usages = media_usages(filename)
+    if usages:
+        flash(
+            f'L\'image {filename} est encore utilisée ({", ".join(usages)}) '
+            f'et n\'a pas été supprimée.',
+            'danger'
+        )
+        return redirect(url_for('manage'))
+
     try:
-        os.remove(file_path)
-        global homepage_media
-        homepage_media = [
-            m for m in homepage_media
-            if m['path'] != f"/static/uploads/{filename}"
-        ]
+        delete_upload(filename, defer_derivatives=True)
         flash(f'L\'image {filename} a été supprimée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2089,10 +5971,11 @@ def manage_delete_homepage_media(media_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global homepage_media
-    md = next((m for m in homepage_media if m['id'] == media_id), None)
+    with content_lock:
+        _, md = with_item_removed(homepage_media, media_id)
+        if md:
+            commit_content_change('homepage_media', media_id, None)
     if md:
-        homepage_media = [m for m in homepage_media if m['id'] != media_id]
         flash('Le média a été supprimé de la page d\'accueil avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2103,6 +5986,152 @@ def manage_delete_homepage_media(media_id):
         flash('Média non trouvé.', 'danger')
     return redirect(url_for('manage'))
 
+def parse_library_filters(args):
+    """
+    Reads the media library filters (type, q, from, to) from the query string.
+    Dates are YYYY-MM-DD; "to" is inclusive. Invalid values are ignored.
+    """
+    kind = args.get('type', '')
+    if kind not in ('image', 'video'):
+        kind = ''
+    query = args.get('q', '').strip()
+    date_from = date_to = None
+    try:
+        if args.get('from'):
+            date_from = datetime.strptime(args['from'], "%Y-%m-%d")
+        if args.get('to'):
+            date_to = datetime.strptime(args['to'], "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        pass
+    return kind, query, date_from, date_to
+
+@app.route('/manage/media', methods=['GET'])
+@login_required
+def manage_media_library():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    kind, query, date_from, date_to = parse_library_filters(request.args)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['MEDIA_LIBRARY_PER_PAGE']
+
+    uploads = list_uploads(kind, query, date_from, date_to)
+    total = len(uploads)
+    pages = (total + per_page - 1) // per_page
+    paginated = uploads[(page - 1)*per_page : page*per_page]
+
+    filters = {
+        k: v for k, v in (
+            ('type', kind), ('q', query),
+            ('from', request.args.get('from', '')), ('to', request.args.get('to', ''))
+        ) if v
+    }
+
+    # Generate pagination
+    if pages > 1:
+        pagination_buttons = ''.join([
+            f'''
+            <li class="page-item {"active" if i == page else ""}">
+                <a class="page-link" href="?{urlencode({**filters, 'page': i})}">{i}</a>
+            </li>
+            '''
+            for i in range(1, pages + 1)
+        ])
+        pagination = f"""
+        <nav aria-label="Page navigation">
+            <ul class="pagination justify-content-center flex-wrap">
+                <li class="page-item {'disabled' if page <= 1 else ''}">
+                    <a class="page-link" href="?{urlencode({**filters, 'page': page - 1})}"
+                       tabindex="-1">Précédent</a>
+                </li>
+                {pagination_buttons}
+                <li class="page-item {'disabled' if page >= pages else ''}">
+                    <a class="page-link" href="?{urlencode({**filters, 'page': page + 1})}">Suivant</a>
+                </li>
+            </ul>
+        </nav>
+        """
+    else:
+        pagination = ''
+
+    content = f"""
+    <section class="admin-section">
+        <h2 class="mb-4">Médiathèque</h2>
+        <form method="get" class="row g-3 mb-4">
+            <div class="col-md-4">
+                <input type="search" class="form-control" name="q" value="{query}"
+                       placeholder="Rechercher un fichier...">
+            </div>
+            <div class="col-md-2">
+                <select class="form-select" name="type">
+                    <option value="" {"selected" if not kind else ""}>Tous les types</option>
+                    <option value="image" {"selected" if kind == 'image' else ""}>Images</option>
+                    <option value="video" {"selected" if kind == 'video' else ""}>Vidéos</option>
+                </select>
+            </div>
+            <div class="col-md-2">
+                <input type="date" class="form-control" name="from" value="{filters.get('from', '')}"
+                       title="Uploadé depuis le">
+            </div>
+            <div class="col-md-2">
+                <input type="date" class="form-control" name="to" value="{filters.get('to', '')}"
+                       title="Uploadé jusqu'au">
+            </div>
+            <div class="col-md-2">
+                <button type="submit" class="btn btn-custom w-100">
+                    <i class="fa fa-filter me-2"></i> Filtrer
+                </button>
+            </div>
+        </form>
+        <p class="text-muted">{total} fichier(s)</p>
+        <div class="row">
+            {''.join([media_card(upload) for upload in paginated])
+             if paginated else '<p>Aucun fichier ne correspond à ces critères.</p>'}
+        </div>
+        {pagination}
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour à la gestion
+        </a>
+    </section>
+    """
+    return render_page("Médiathèque", content, active_page='Gestion')
+
+@app.route('/manage/media/search', methods=['GET'])
+@login_required
+def manage_media_search():
+    """
+    JSON catalogue query used by the image pickers of the admin forms.
+    """
+    if session.get('role') != 'admin':
+        return jsonify({'error': 'forbidden'}), 403
+
+    kind, query, date_from, date_to = parse_library_filters(request.args)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 24, type=int), 1), 100)
+
+    uploads = list_uploads(kind, query, date_from, date_to)
+    items = []
+    for upload in uploads[(page - 1)*per_page : page*per_page]:
+        info = get_media_info(upload['name']) or {}
+        items.append({
+            "name": upload['name'],
+            "kind": upload['kind'],
+            "url": f"/static/uploads/{upload['name']}",
+            "thumb": f"/media/thumbs/{upload['name']}" if can_thumbnail(upload['name']) else None,
+            "width": info.get('width'),
+            "height": info.get('height'),
+            "duration": info.get('duration'),
+            "size": upload['size'],
+            "uploaded_at": datetime.fromtimestamp(upload['mtime']).strftime("%Y-%m-%d %H:%M:%S")
+        })
+    return jsonify({
+        "items": items,
+        "page": page,
+        "pages": (len(uploads) + per_page - 1) // per_page,
+        "total": len(uploads)
+    })
+
 ###########################################################
 #  10. Manage: Custom Pages
 ###########################################################
@@ -2136,14 +6165,15 @@ def manage_add_page():
             )
             return redirect(url_for('manage_add_page'))
 
-        custom_pages.append({
+        page = {
             "id": str(uuid.uuid4()),
             "title": title,
             "url": url_slug,
             "content": content_txt,
             "meta_title": meta_title,
             "meta_description": meta_description
-        })
+        }
+        commit_content_change('custom_pages', page['id'], page)
         flash('La page a été ajoutée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2242,11 +6272,17 @@ def manage_edit_page(page_id):
             )
             return redirect(url_for('manage_edit_page', page_id=page_id))
 
-        page['title'] = title
-        page['url'] = url_slug
-        page['content'] = content_txt
-        page['meta_title'] = meta_title
-        page['meta_description'] = meta_description
+        with content_lock:
+            _, page = with_item_replaced(
+                custom_pages, page_id,
+                title=title, url=url_slug, content=content_txt,
+                meta_title=meta_title, meta_description=meta_description
+            )
+            if page:
+                commit_content_change('custom_pages', page_id, page)
+        if not page:
+            flash('Page non trouvée.', 'danger')
+            return redirect(url_for('manage'))
         flash('La page a été mise à jour avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2328,10 +6364,11 @@ def manage_delete_page(page_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global custom_pages
-    pg = next((p for p in custom_pages if p['id'] == page_id), None)
+    with content_lock:
+        _, pg = with_item_removed(custom_pages, page_id)
+        if pg:
+            commit_content_change('custom_pages', page_id, None)
     if pg:
-        custom_pages = [p for p in custom_pages if p['id'] != page_id]
         flash('La page a été supprimée avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2371,13 +6408,22 @@ def manage_add_user():
             flash('Ce nom d\'utilisateur est déjà pris.', 'danger')
             return redirect(url_for('manage_add_user'))
 
-        hashed_password = generate_password_hash(password)
-        users.append({
-            "id": str(uuid.uuid4()),
-            "username": username,
-            "password": hashed_password,
-            "role": role
-        })
+        try:
+            hashed_password = hash_password(password)
+        except PasswordHasherBusy:
+            flash('Le service est momentanément surchargé. Veuillez réessayer dans quelques instants.', 'danger')
+            return redirect(url_for('manage_add_user'))
+        with content_lock:
+            if any(u['username'] == username for u in users):
+                flash('Ce nom d\'utilisateur est déjà pris.', 'danger')
+                return redirect(url_for('manage_add_user'))
+            user_id = str(uuid.uuid4())
+            commit_content_change('users', user_id, {
+                "id": user_id,
+                "username": username,
+                "password": hashed_password,
+                "role": role
+            })
         flash('Utilisateur ajouté avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2451,10 +6497,20 @@ def manage_edit_user(user_id):
             flash('Ce nom d\'utilisateur est déjà pris.', 'danger')
             return redirect(url_for('manage_edit_user', user_id=user_id))
 
-        user['username'] = username
-        user['role'] = role
+        changes = {'username': username, 'role': role}
         if password:
-            user['password'] = generate_password_hash(password)
+            try:
+                changes['password'] = hash_password(password)
+            except PasswordHasherBusy:
+                flash('Le service est momentanément surchargé. Veuillez réessayer dans quelques instants.', 'danger')
+                return redirect(url_for('manage_edit_user', user_id=user_id))
+        with content_lock:
+            _, user = with_item_replaced(users, user_id, **changes)
+            if user:
+                commit_content_change('users', user_id, user)
+        if not user:
+            flash('Utilisateur non trouvé.', 'danger')
+            return redirect(url_for('manage'))
         flash('Utilisateur mis à jour avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2510,10 +6566,11 @@ def manage_delete_user(user_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global users
-    usr = next((u for u in users if u['id'] == user_id), None)
+    with content_lock:
+        usr = next((u for u in users if u['id'] == user_id), None)
+        if usr and usr['role'] != 'admin':
+            commit_content_change('users', user_id, None)
     if usr and usr['role'] != 'admin':
-        users = [u for u in users if u['id'] != user_id]
         flash('L\'utilisateur a été supprimé avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2528,6 +6585,133 @@ def manage_delete_user(user_id):
 #  12. Manage: Contact Messages
 ###########################################################
 
+@app.route('/manage/inbox', methods=['GET'])
+@login_required
+def manage_inbox():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    query = request.args.get('q', '').strip()
+    status = request.args.get('status', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['INBOX_PER_PAGE']
+
+    rows, total = search_messages(query, status, page, per_page)
+    pages = (total + per_page - 1) // per_page
+    filters = {k: v for k, v in (('q', query), ('status', status)) if v}
+
+    # Generate pagination (a window around the current page; inboxes can be long)
+    if pages > 1:
+        window = range(max(1, page - 3), min(pages, page + 3) + 1)
+        pagination_buttons = ''.join([
+            f'''
+            <li class="page-item {"active" if i == page else ""}">
+                <a class="page-link" href="?{urlencode({**filters, 'page': i})}">{i}</a>
+            </li>
+            '''
+            for i in window
+        ])
+        pagination = f"""
+        <nav aria-label="Page navigation">
+            <ul class="pagination justify-content-center flex-wrap">
+                <li class="page-item {'disabled' if page <= 1 else ''}">
+                    <a class="page-link" href="?{urlencode({**filters, 'page': page - 1})}"
+                       tabindex="-1">Précédent</a>
+                </li>
+                {pagination_buttons}
+                <li class="page-item {'disabled' if page >= pages else ''}">
+                    <a class="page-link" href="?{urlencode({**filters, 'page': page + 1})}">Suivant</a>
+                </li>
+            </ul>
+        </nav>
+        <p class="text-center text-muted">Page {page} sur {pages}</p>
+        """
+    else:
+        pagination = ''
+
+    content = f"""
+    <section class="admin-section">
+        <h2 class="mb-4">Boîte de Réception des Messages</h2>
+        <form method="get" class="row g-3 mb-4">
+            <div class="col-md-6">
+                <input type="search" class="form-control" name="q" value="{query}"
+                       placeholder="Rechercher par nom, email ou contenu...">
+            </div>
+            <div class="col-md-3">
+                <select class="form-select" name="status">
+                    <option value="" {"selected" if not status else ""}>Tous les messages</option>
+                    <option value="unread" {"selected" if status == 'unread' else ""}>Non lus</option>
+                    <option value="read" {"selected" if status == 'read' else ""}>Lus</option>
+                </select>
+            </div>
+            <div class="col-md-3">
+                <button type="submit" class="btn btn-custom w-100">
+                    <i class="fa fa-filter me-2"></i> Filtrer
+                </button>
+            </div>
+        </form>
+        <p class="text-muted">{total} message(s)</p>
+        <form method="post" action="/manage/bulk_reply">
+        <div class="mb-3">
+            <button type="submit" class="btn btn-primary">
+                <i class="fa fa-reply-all me-2"></i> Répondre à la sélection
+            </button>
+        </div>
+        <div class="table-responsive">
+            <table class='table table-striped table-hover'>
+                <thead class="table-warning">
+                    <tr>
+                        <th><input type="checkbox" class="form-check-input" title="Tout sélectionner"
+                                   onclick="document.querySelectorAll('input[name=message_ids]').forEach(c => c.checked = this.checked)"></th>
+                        <th>Date</th>
+                        <th>Nom</th>
+                        <th>Email</th>
+                        <th>Message</th>
+                        <th>Lu</th>
+                        <th>Actions</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {''.join([
+                        f"""
+                        <tr class="{'' if msg['lu'] else 'fw-bold'}">
+                            <td><input type="checkbox" class="form-check-input" name="message_ids" value="{msg['id']}"></td>
+                            <td>{datetime.fromtimestamp(msg['received_at']).strftime("%Y-%m-%d %H:%M")}</td>
+                            <td>{msg['nom']}</td>
+                            <td>{msg['email']}</td>
+                            <td>{msg['message'][:200]}{'…' if len(msg['message']) > 200 else ''}</td>
+                            <td>{'Oui' if msg['lu'] else 'Non'}</td>
+                            <td>
+                                <a href="/manage/reply_message/{msg['id']}"
+                                   class='btn btn-sm btn-primary'>
+                                   <i class='fa fa-reply me-1'></i> Répondre
+                                </a>
+                                <a href="/manage/mark_message/{msg['id']}"
+                                   class='btn btn-sm btn-info'>
+                                   <i class='fa fa-eye me-1'></i> Marquer comme {'Non Lu' if msg['lu'] else 'Lu'}
+                                </a>
+                                <a href="/manage/delete_message/{msg['id']}"
+                                   class='btn btn-sm btn-danger btn-delete'>
+                                   <i class='fa fa-trash me-1'></i> Supprimer
+                                </a>
+                            </td>
+                        </tr>
+                        """
+                        for msg in rows
+                    ]) if rows else '<tr><td colspan="7" class="text-center">Aucun message.</td></tr>'}
+                </tbody>
+            </table>
+        </div>
+        </form>
+        {pagination}
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour à la gestion
+        </a>
+    </section>
+    """
+    return render_page("Boîte de Réception", content, active_page='Gestion')
+
 @app.route('/manage/delete_message/<string:message_id>', methods=['GET'])
 @login_required
 def manage_delete_message(message_id):
@@ -2535,10 +6719,8 @@ def manage_delete_message(message_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    global messages
-    msg = next((m for m in messages if m['id'] == message_id), None)
+    msg = delete_message(message_id)
     if msg:
-        messages = [m for m in messages if m['id'] != message_id]
         flash('Le message a été supprimé avec succès!', 'success')
         activity_logs.append({
             "user": session['username'],
@@ -2547,27 +6729,227 @@ def manage_delete_message(message_id):
         })
     else:
         flash('Message non trouvé.', 'danger')
+    return redirect(url_for('manage_inbox'))
+
+@app.route('/manage/mark_message/<string:message_id>', methods=['GET'])
+@login_required
+def manage_mark_message(message_id):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    msg = toggle_message_read(message_id)
+    if msg:
+        flash(f"Le message a été marqué comme {'lu' if msg['lu'] else 'non lu'}.", 'success')
+        activity_logs.append({
+            "user": session['username'],
+            "action": f"Marqué message de: {msg['nom']} comme {'lu' if msg['lu'] else 'non lu'}",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+    else:
+        flash('Message non trouvé.', 'danger')
+    return redirect(url_for('manage_inbox'))
+
+@app.route('/manage/outbox/retry/<string:mail_id>', methods=['GET'])
+@login_required
+def manage_retry_mail(mail_id):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    with closing(outbox_connect()) as conn, conn:
+        updated = conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? "
+            "WHERE id = ? AND status IN ('dead', 'pending')",
+            (time.time(), mail_id)
+        ).rowcount
+    if updated:
+        outbox_wakeup.set()
+        flash('L\'email a été remis en file d\'envoi.', 'success')
+    else:
+        flash('Email non trouvé ou déjà envoyé.', 'danger')
     return redirect(url_for('manage'))
 
-@app.route('/manage/mark_message/<string:message_id>', methods=['GET'])
+class TemplateVariables(dict):
+    """
+    Leaves unknown {placeholders} untouched instead of raising KeyError.
+    """
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+def render_reply_template(text, msg):
+    return text.format_map(TemplateVariables(
+        nom=msg['nom'],
+        email=msg['email'],
+        message=msg['message']
+    ))
+
+@app.route('/manage/bulk_reply', methods=['POST'])
+@login_required
+def manage_bulk_reply():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    selected = get_messages(request.form.getlist('message_ids'))
+    if not selected:
+        flash('Veuillez sélectionner au moins un message.', 'danger')
+        return redirect(url_for('manage_inbox'))
+
+    subject = request.form.get('subject', '').strip()
+    body = request.form.get('body', '').strip()
+
+    # Second step: the template has been filled in, enqueue every reply at once
+    if request.form.get('action') == 'send':
+        if not subject or not body:
+            flash('Le sujet et le message ne peuvent pas être vides.', 'danger')
+        else:
+            try:
+                mails = [
+                    {
+                        "subject": render_reply_template(subject, msg),
+                        "recipients": [msg['email']],
+                        "body": render_reply_template(body, msg),
+                        "context": {"message_id": msg['id'], "nom": msg['nom']}
+                    }
+                    for msg in selected
+                ]
+            except (ValueError, IndexError, AttributeError) as e:
+                flash(f'Modèle invalide : {str(e)}', 'danger')
+            else:
+                batch_id = enqueue_mail_batch(mails)
+                mark_messages([msg['id'] for msg in selected])
+                if request.form.get('save_template'):
+                    template_id = str(uuid.uuid4())
+                    commit_content_change('reply_templates', template_id, {
+                        "id": template_id,
+                        "name": request.form.get('template_name', '').strip() or subject,
+                        "subject": subject,
+                        "body": body
+                    })
+                flash(f'{len(mails)} réponse(s) mise(s) en file d\'envoi.', 'success')
+                activity_logs.append({
+                    "user": session['username'],
+                    "action": f"Réponse groupée à {len(mails)} message(s)",
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+                return redirect(url_for('manage_bulk_reply_progress', batch_id=batch_id))
+
+    template = next(
+        (t for t in reply_templates if t['id'] == request.form.get('template_id')),
+        reply_templates[0] if reply_templates else {"subject": "", "body": ""}
+    )
+    subject = subject or template['subject']
+    body = body or template['body']
+
+    content = f"""
+    <section class="admin-section">
+        <h2 class="mb-4">Réponse groupée ({len(selected)} message(s))</h2>
+        <p>
+            Destinataires :
+            {', '.join(f"{msg['nom']} &lt;{msg['email']}&gt;" for msg in selected)}
+        </p>
+        <form method="post" class="row g-3">
+            {''.join(f'<input type="hidden" name="message_ids" value="{msg["id"]}">' for msg in selected)}
+            <div class="col-md-8">
+                <label for="template_id" class="form-label">Modèle :</label>
+                <select class="form-select" name="template_id" id="template_id">
+                    {''.join([
+                        f'<option value="{t["id"]}" {"selected" if t is template else ""}>{t["name"]}</option>'
+                        for t in reply_templates
+                    ])}
+                </select>
+            </div>
+            <div class="col-md-4 d-flex align-items-end">
+                <button type="submit" name="action" value="load" class="btn btn-secondary w-100"
+                        onclick="document.getElementById('subject').value = ''; document.getElementById('body').value = '';">
+                    <i class="fa fa-file-import me-2"></i> Charger le modèle
+                </button>
+            </div>
+            <div class="col-12">
+                <label for="subject" class="form-label">Sujet :</label>
+                <input type="text" class="form-control" name="subject" id="subject" value="{subject}">
+            </div>
+            <div class="col-12">
+                <label for="body" class="form-label">Message :</label>
+                <textarea class="form-control" name="body" id="body" rows="8">{body}</textarea>
+                <div class="form-text">
+                    Variables disponibles : <code>{{nom}}</code>, <code>{{email}}</code>, <code>{{message}}</code>.
+                </div>
+            </div>
+            <div class="col-md-6">
+                <div class="form-check">
+                    <input class="form-check-input" type="checkbox" name="save_template" id="save_template" value="1">
+                    <label class="form-check-label" for="save_template">Enregistrer comme modèle</label>
+                </div>
+            </div>
+            <div class="col-md-6">
+                <input type="text" class="form-control" name="template_name" placeholder="Nom du modèle">
+            </div>
+            <div class="col-12">
+                <button type="submit" name="action" value="send" class="btn btn-primary">
+                    <i class="fa fa-paper-plane me-2"></i> Envoyer {len(selected)} réponse(s)
+                </button>
+                <a href="/manage/inbox" class="btn btn-secondary">
+                    <i class="fa fa-times me-2"></i> Annuler
+                </a>
+            </div>
+        </form>
+    </section>
+    """
+    return render_page("Réponse groupée", content, active_page='Gestion')
+
+@app.route('/manage/bulk_reply/<string:batch_id>', methods=['GET'])
+@login_required
+def manage_bulk_reply_progress(batch_id):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    progress = outbox_batch_progress(batch_id)
+    if not progress['total']:
+        flash('Envoi groupé non trouvé.', 'danger')
+        return redirect(url_for('manage'))
+
+    content = f"""
+    <section class="admin-section">
+        <h2 class="mb-4">Suivi de l'envoi groupé</h2>
+        <div class="progress mb-3" style="height: 25px;">
+            <div id="batchSent" class="progress-bar bg-success" role="progressbar"></div>
+            <div id="batchDead" class="progress-bar bg-danger" role="progressbar"></div>
+        </div>
+        <p id="batchSummary"></p>
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour à la gestion
+        </a>
+    </section>
+    <script>
+        function showBatchProgress(data) {{
+            var done = data.sent + data.dead;
+            document.getElementById('batchSent').style.width = (100 * data.sent / data.total) + '%';
+            document.getElementById('batchDead').style.width = (100 * data.dead / data.total) + '%';
+            document.getElementById('batchSummary').textContent =
+                data.sent + ' envoyé(s), ' + data.dead + ' en échec, '
+                + (data.total - done) + ' en attente sur ' + data.total + '.';
+            if (done < data.total) {{
+                setTimeout(function() {{
+                    fetch('/manage/bulk_reply/{batch_id}/status')
+                        .then(response => response.json())
+                        .then(showBatchProgress);
+                }}, 2000);
+            }}
+        }}
+        showBatchProgress({json.dumps(progress)});
+    </script>
+    """
+    return render_page("Suivi de l'envoi groupé", content, active_page='Gestion')
+
+@app.route('/manage/bulk_reply/<string:batch_id>/status', methods=['GET'])
 @login_required
-def manage_mark_message(message_id):
+def manage_bulk_reply_status(batch_id):
     if session.get('role') != 'admin':
-        flash('Accès refusé. Administrateur requis.', 'danger')
-        return redirect(url_for('index'))
-
-    msg = next((m for m in messages if m['id'] == message_id), None)
-    if msg:
-        msg['lu'] = not msg['lu']
-        flash(f"Le message a été marqué comme {'lu' if msg['lu'] else 'non lu'}.", 'success')
-        activity_logs.append({
-            "user": session['username'],
-            "action": f"Marqué message de: {msg['nom']} comme {'lu' if msg['lu'] else 'non lu'}",
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
-    else:
-        flash('Message non trouvé.', 'danger')
-    return redirect(url_for('manage'))
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(outbox_batch_progress(batch_id))
 
 @app.route('/manage/reply_message/<string:message_id>', methods=['GET', 'POST'])
 @login_required
@@ -2576,10 +6958,10 @@ def manage_reply_message(message_id):
         flash('Accès refusé. Administrateur requis.', 'danger')
         return redirect(url_for('index'))
 
-    msg_obj = next((m for m in messages if m['id'] == message_id), None)
+    msg_obj = get_message(message_id)
     if not msg_obj:
         flash('Message non trouvé.', 'danger')
-        return redirect(url_for('manage'))
+        return redirect(url_for('manage_inbox'))
 
     if request.method == 'POST':
         reply_body = request.form.get('reply').strip()
@@ -2588,27 +6970,27 @@ def manage_reply_message(message_id):
             return redirect(url_for('manage_reply_message', message_id=message_id))
 
         try:
-            msg_email = Message(
+            enqueue_mail(
                 subject="Réponse à votre message",
                 recipients=[msg_obj['email']],
                 body=(
                     f"Bonjour {msg_obj['nom']},\n\n"
                     f"{reply_body}\n\n"
                     f"Cordialement,\nL'équipe de Tourisme Niger"
-                )
+                ),
+                context={"message_id": msg_obj['id'], "nom": msg_obj['nom']}
             )
-            mail.send(msg_email)
-            flash('Réponse envoyée avec succès!', 'success')
-            msg_obj['lu'] = True
-            activity_logs.append({
-                "user": session['username'],
-                "action": f"Répondu au message de: {msg_obj['nom']}",
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            return redirect(url_for('manage'))
-        except Exception as e:
-            flash(f'Erreur lors de l\'envoi de l\'email: {str(e)}', 'danger')
+        except sqlite3.Error as e:
+            flash(f'Erreur lors de l\'enregistrement de l\'email: {str(e)}', 'danger')
             return redirect(url_for('manage_reply_message', message_id=message_id))
+        flash('Réponse mise en file d\'envoi. Suivez sa livraison dans la boîte d\'envoi.', 'success')
+        mark_messages([msg_obj['id']])
+        activity_logs.append({
+            "user": session['username'],
+            "action": f"Répondu au message de: {msg_obj['nom']}",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        return redirect(url_for('manage_inbox'))
 
     content = f"""
     <section class="admin-section">
@@ -2637,13 +7019,404 @@ def manage_reply_message(message_id):
     """
     return render_page("Répondre au Message", content, active_page='Gestion')
 
+###########################################################
+#  12b. Manage: Background Jobs
+###########################################################
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '–'
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} ms"
+    if seconds < 120:
+        return f"{seconds:.1f} s"
+    return format_wait(seconds)
+
+@app.route('/manage/jobs', methods=['GET'])
+@login_required
+def manage_jobs():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    stats = job_queue_stats()
+    failed = recent_failed_jobs()
+    next_runs = job_schedule()
+    now = time.time()
+
+    content = f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Files de Tâches</h2>
+        <div class="table-responsive">
+            <table class='table table-striped table-hover'>
+                <thead class="table-warning">
+                    <tr>
+                        <th>File</th>
+                        <th>En attente</th>
+                        <th>Programmées</th>
+                        <th>En cours</th>
+                        <th>Plus ancienne en attente</th>
+                        <th>Terminées (1 h)</th>
+                        <th>Attente moyenne</th>
+                        <th>Durée moyenne</th>
+                        <th>Échecs définitifs</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {''.join([
+                        f"""
+                        <tr>
+                            <td><strong>{name}</strong></td>
+                            <td>{s['due']}</td>
+                            <td>{s['scheduled']}</td>
+                            <td>{s['running']}</td>
+                            <td>{format_seconds(s['oldest_due'])}</td>
+                            <td>{s['done']}</td>
+                            <td>{format_seconds(s['avg_wait'])}</td>
+                            <td>{format_seconds(s['avg_run'])}</td>
+                            <td>{s['dead']}</td>
+                        </tr>
+                        """
+                        for name, s in stats.items()
+                    ])}
+                </tbody>
+            </table>
+        </div>
+    </section>
+
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Tâches Récurrentes</h2>
+        <ul class="list-group">
+            {''.join([
+                f"""
+                <li class="list-group-item d-flex justify-content-between">
+                    <span><strong>{func.__name__}</strong> – toutes les {format_seconds(interval)}
+                        {'' if shared else '<span class="badge bg-secondary ms-2">chaque processus</span>'}</span>
+                    <span class="text-muted">
+                        {f"prochaine exécution dans {format_seconds(max(next_runs[func.__name__] - now, 0))}"
+                         if func.__name__ in next_runs else ''}
+                    </span>
+                </li>
+                """
+                for func, interval, shared in recurring_jobs()
+            ])}
+        </ul>
+    </section>
+
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Échecs Récents</h2>
+        <div class="table-responsive">
+            <table class='table table-striped table-hover'>
+                <thead class="table-warning">
+                    <tr>
+                        <th>Tâche</th>
+                        <th>File</th>
+                        <th>Statut</th>
+                        <th>Tentatives</th>
+                        <th>Dernière erreur</th>
+                        <th>Actions</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {''.join([
+                        f"""
+                        <tr>
+                            <td>{row['name']} #{row['id']}</td>
+                            <td>{row['queue']}</td>
+                            <td><span class="badge bg-{JOB_STATUS_LABELS[row['status']][1]}">
+                                {JOB_STATUS_LABELS[row['status']][0]}</span></td>
+                            <td>{row['attempts']} / {row['max_attempts']}</td>
+                            <td class="small">{row['last_error']}</td>
+                            <td>
+                                {f'''<form method="post" action="/manage/jobs/retry/{row['id']}">
+                                     <button class='btn btn-sm btn-warning'><i class='fa fa-redo me-1'></i> Relancer</button>
+                                   </form>''' if row['status'] == 'dead' else ''}
+                            </td>
+                        </tr>
+                        """
+                        for row in failed
+                    ]) if failed else '<tr><td colspan="6" class="text-center">Aucun échec.</td></tr>'}
+                </tbody>
+            </table>
+        </div>
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour au tableau de bord
+        </a>
+    </section>
+    """
+    return render_page("Tâches de Fond", content, active_page='Gestion')
+
+@app.route('/manage/jobs/retry/<int:job_id>', methods=['POST'])
+@login_required
+def manage_retry_job(job_id):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    if retry_job(job_id):
+        flash('La tâche a été remise en file.', 'success')
+    else:
+        flash('Tâche non trouvée ou déjà relancée.', 'danger')
+    return redirect(url_for('manage_jobs'))
+
+###########################################################
+#  12c. Manage: Profiling
+###########################################################
+
+@app.route('/manage/profiling', methods=['GET', 'POST'])
+@login_required
+def manage_profiling():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        if request.form.get('clear'):
+            for meta in list_profiles():
+                delete_profile(meta['id'])
+            flash('Les profils ont été supprimés.', 'success')
+            return redirect(url_for('manage_profiling'))
+        try:
+            rate = float(request.form.get('sample_rate', '0').replace(',', '.')) / 100
+        except ValueError:
+            rate = -1
+        if not 0 <= rate <= 1:
+            flash('Le taux doit être un pourcentage entre 0 et 100.', 'danger')
+            return redirect(url_for('manage_profiling'))
+        commit_content_change('profiler_settings', 'profiler', {**profiler_settings, 'sample_rate': rate})
+        flash('Taux d\'échantillonnage mis à jour.', 'success')
+        activity_logs.append({
+            "user": session['username'],
+            "action": f"Profilage: taux d'échantillonnage à {rate * 100:g} %",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
+        return redirect(url_for('manage_profiling'))
+
+    profiles = list_profiles()
+    content = f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Profilage des Requêtes</h2>
+        <form method="post" class="row g-3 align-items-end mb-3">
+            <div class="col-auto">
+                <label for="sample_rate" class="form-label">Requêtes profilées (%)</label>
+                <input type="number" class="form-control" id="sample_rate" name="sample_rate"
+                       min="0" max="100" step="0.01" value="{profiler_settings['sample_rate'] * 100:g}">
+            </div>
+            <div class="col-auto">
+                <button type="submit" class="btn btn-primary">
+                    <i class="fa fa-save me-2"></i> Enregistrer
+                </button>
+            </div>
+        </form>
+        <p class="text-muted">
+            Pour profiler une page précise, ajoutez <code>?_profile=1</code> à son adresse
+            ou envoyez l'en-tête <code>X-Profile: 1</code>. Les {app.config['PROFILE_KEEP']}
+            profils échantillonnés les plus lents sont conservés. Un profil mesure la requête
+            sous cProfile : sa durée est plus longue qu'en temps normal. Depuis Python 3.12,
+            cProfile enregistre aussi les appels des autres threads du processus (workers
+            gthread, ASGI) : le profil d'une requête peut alors contenir ceux des requêtes
+            traitées en même temps.
+        </p>
+        <div class="table-responsive">
+            <table class='table table-striped table-hover'>
+                <thead class="table-warning">
+                    <tr>
+                        <th>Durée</th>
+                        <th>Requête</th>
+                        <th>Statut</th>
+                        <th>Origine</th>
+                        <th>Date</th>
+                        <th>Fonction la plus coûteuse</th>
+                        <th>Fichiers</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {''.join([
+                        f"""
+                        <tr>
+                            <td><a href="/manage/profiling/{meta['id']}">{meta['duration'] * 1000:.1f} ms</a></td>
+                            <td>{escape(meta['method'])} {escape(meta['path'])}</td>
+                            <td>{meta['status']}</td>
+                            <td>{'Demandé' if meta['reason'] == 'requested' else 'Échantillon'}</td>
+                            <td>{datetime.fromtimestamp(meta['created_at']).strftime("%Y-%m-%d %H:%M:%S")}</td>
+                            <td class="small">{escape(meta['top'][0][0]) if meta['top'] else ''}</td>
+                            <td>
+                                <a href="/manage/profiling/{meta['id']}/download/prof" class="btn btn-sm btn-secondary">.prof</a>
+                                <a href="/manage/profiling/{meta['id']}/download/collapsed" class="btn btn-sm btn-secondary">.collapsed</a>
+                            </td>
+                        </tr>
+                        """
+                        for meta in profiles
+                    ]) if profiles else '<tr><td colspan="7" class="text-center">Aucun profil.</td></tr>'}
+                </tbody>
+            </table>
+        </div>
+        <form method="post" class="d-inline">
+            <input type="hidden" name="clear" value="1">
+            <button type="submit" class="btn btn-danger"><i class="fa fa-trash me-2"></i> Supprimer les profils</button>
+        </form>
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour au tableau de bord
+        </a>
+    </section>
+    """
+    return render_page("Profilage", content, active_page='Gestion')
+
+@app.route('/manage/profiling/<string:profile_id>', methods=['GET'])
+@login_required
+def manage_profile_detail(profile_id):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+    if not PROFILE_ID_RE.match(profile_id) or not os.path.exists(profile_path(profile_id, 'prof')):
+        raise NotFound()
+
+    output = io.StringIO()
+    stats = pstats.Stats(profile_path(profile_id, 'prof'), stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(40)
+    content = f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Profil {profile_id}</h2>
+        <pre class="small">{output.getvalue().replace('&', '&amp;').replace('<', '&lt;')}</pre>
+        <a href="/manage/profiling" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour aux profils
+        </a>
+    </section>
+    """
+    return render_page("Profil", content, active_page='Gestion')
+
+@app.route('/manage/profiling/<string:profile_id>/download/<any(prof, collapsed):kind>', methods=['GET'])
+@login_required
+def manage_download_profile(profile_id, kind):
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+    path = profile_path(profile_id, kind)
+    if not PROFILE_ID_RE.match(profile_id) or not os.path.exists(path):
+        raise NotFound()
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}.{kind}")
+
+###########################################################
+#  12d. Manage: Memory
+###########################################################
+
+@app.route('/manage/memory', methods=['GET', 'POST'])
+@login_required
+def manage_memory():
+    if session.get('role') != 'admin':
+        flash('Accès refusé. Administrateur requis.', 'danger')
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        seconds = request.form.get('seconds', type=int) or app.config['MEMORY_TRACE_SECONDS']
+        if start_allocation_trace(min(max(seconds, 1), 600)):
+            flash(f'Traçage des allocations lancé pour {seconds} s (processus {os.getpid()}).', 'success')
+        else:
+            flash('Un traçage est déjà en cours dans ce processus.', 'danger')
+        return redirect(url_for('manage_memory'))
+
+    report = memory_report()
+    trace = report['tracemalloc']
+    content = f"""
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Mémoire du Processus {report['pid']}</h2>
+        <p>
+            <span class="badge bg-primary me-2">RSS : {format_bytes(report['rss'])}</span>
+            <span class="badge bg-secondary me-2">Au démarrage : {format_bytes(report['rss_at_start'])}</span>
+            <span class="badge bg-info me-2">Démarré depuis : {format_seconds(report['uptime'])}</span>
+        </p>
+        <div class="table-responsive">
+            <table class='table table-striped table-hover'>
+                <thead class="table-warning">
+                    <tr>
+                        <th>Collection</th>
+                        <th>Éléments</th>
+                        <th>Taille</th>
+                        <th>Au démarrage</th>
+                        <th>Croissance / h</th>
+                        <th>Budget</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {''.join([
+                        f"""
+                        <tr class="{'table-danger' if entry['budget'] and entry['bytes'] > entry['budget'] else ''}">
+                            <td>{entry['name']}</td>
+                            <td>{entry['items']} <span class="text-muted">({entry['items_at_start']})</span></td>
+                            <td>{format_bytes(entry['bytes'])}</td>
+                            <td>{format_bytes(entry['bytes_at_start'])}</td>
+                            <td>{format_bytes(entry['growth_per_hour'])}</td>
+                            <td>{f"{format_bytes(entry['budget'])} ({entry['action']})" if entry['budget'] else '–'}</td>
+                        </tr>
+                        """
+                        for entry in report['collections']
+                    ])}
+                </tbody>
+            </table>
+        </div>
+        <h4 class="mt-4">Objets Python les plus nombreux</h4>
+        <p class="small">
+            {', '.join(f'{name} : {count}' for name, count in report['object_types'])}
+        </p>
+    </section>
+
+    <section class="admin-section mb-5">
+        <h2 class="mb-4">Allocations (tracemalloc)</h2>
+        <form method="post" class="row g-3 align-items-end mb-3">
+            <div class="col-auto">
+                <label for="seconds" class="form-label">Durée du traçage (s)</label>
+                <input type="number" class="form-control" id="seconds" name="seconds"
+                       min="1" max="600" value="{app.config['MEMORY_TRACE_SECONDS']}">
+            </div>
+            <div class="col-auto">
+                <button type="submit" class="btn btn-primary">
+                    <i class="fa fa-search me-2"></i> Tracer les allocations
+                </button>
+            </div>
+        </form>
+        <p class="text-muted">
+            Le traçage ralentit le processus qui traite la demande pendant sa durée ;
+            le résultat s'affiche ici une fois terminé (rechargez la page, même processus).
+        </p>
+        {'<p>Traçage en cours…</p>' if trace.get('running') else ''}
+        {''.join([
+            f"""
+            <details class="mb-2">
+                <summary>{format_bytes(stat['bytes'])} en {stat['blocks']} blocs – <code>{stat['where']}</code></summary>
+                <pre class="small">{chr(10).join(stat['traceback']).replace('&', '&amp;').replace('<', '&lt;')}</pre>
+            </details>
+            """
+            for stat in trace.get('top', [])
+        ])}
+        <a href="/manage" class="btn btn-secondary">
+            <i class="fa fa-arrow-left me-2"></i> Retour au tableau de bord
+        </a>
+    </section>
+    """
+    return render_page("Mémoire", content, active_page='Gestion')
+
+@app.route('/manage/memory.json', methods=['GET'])
+def manage_memory_json():
+    """
+    memory_report() as JSON, for an admin session or a client holding METRICS_TOKEN.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if not (
+        session.get('role') == 'admin'
+        or (token and tokens_match(authorization, f"Bearer {token}"))
+    ):
+        return jsonify({'error': 'Accès refusé.'}), 403
+    return jsonify(memory_report())
+
 ###########################################################
 #  13. Custom Pages Routes
 ###########################################################
 
 @app.route('/pages/<string:page_url>')
 def custom_page_route(page_url):
-    page = next((p for p in custom_pages if p['url'] == page_url), None)
+    with server_timing('data'):
+        page = next((p for p in custom_pages if p['url'] == page_url), None)
     if not page:
         raise NotFound()
 
@@ -2684,9 +7457,329 @@ def page_not_found(error):
     )
 
 ###########################################################
-#  15. Run the Application
+#  15. Application Factory and Startup
 ###########################################################
+
+MODULE_LOAD_TIME = time.perf_counter() - MODULE_LOAD_STARTED
+
+# (step, seconds) for every create_app() step, in order
+startup_timings = []
+startup_lock = threading.RLock()
+# Pid of the process whose background threads are running (threads do not survive a fork)
+background_workers_pid = None
+background_threads = []
+
+@contextmanager
+def timed_startup_step(name):
+    started = time.perf_counter()
+    yield
+    startup_timings.append((name, time.perf_counter() - started))
+
+def create_app(config=None):
+    """
+    Applies `config` (a mapping of settings) and initializes the subsystems:
+    secret key, folders, mail, stores, limiters, sessions, seed data and the
+    content journal.
+    Only the first call initializes; later calls return the same app.
+
+    Background threads (mail worker, contact writer, content follower,
+    sweepers) are not started here but by each process on its first request, so that
+    `gunicorn --preload 'main:create_app()'` forks its workers from a parent
+    that has done all of the above once.
+    """
+    global contact_limiter, contact_queue, password_hasher, login_throttle, session_store
+
+    with startup_lock:
+        if app.config.get('APP_INITIALIZED'):
+            return app
+        if config:
+            app.config.from_mapping(config)
+
+        with timed_startup_step('secret key'):
+            app.secret_key = app.config.get('SECRET_KEY') or load_secret_key()
+        if app.config['TRUSTED_PROXIES']:
+            hops = app.config['TRUSTED_PROXIES']
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+        with timed_startup_step('folders'):
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        with timed_startup_step('mail'):
+            mail.init_app(app)
+        with timed_startup_step('mail outbox'):
+            init_outbox()
+        with timed_startup_step('message store'):
+            init_message_store()
+        with timed_startup_step('contact limiter'):
+            contact_limiter = create_contact_limiter()
+            contact_queue = queue.Queue(maxsize=app.config['CONTACT_QUEUE_SIZE'])
+        with timed_startup_step('password hasher'):
+            password_hasher = PasswordHasher(
+                app.config['PASSWORD_POOL_SIZE'],
+                app.config['PASSWORD_QUEUE_LIMIT'],
+                app.config['PASSWORD_HASH_TIMEOUT']
+            )
+            atexit.register(password_hasher.shutdown)
+        with timed_startup_step('login throttle'):
+            login_throttle = create_login_throttle()
+        with timed_startup_step('sessions'):
+            session_store = create_session_store()
+            if session_store is not None:
+                app.session_interface = ServerSideSessionInterface(
+                    session_store,
+                    app.config['SESSION_IDLE_TIMEOUT'],
+                    app.config['SESSION_REFRESH_AFTER']
+                )
+                # Idle expiry is enforced server-side; a permanent cookie lasts as long
+                app.permanent_session_lifetime = timedelta(seconds=app.config['SESSION_IDLE_TIMEOUT'])
+        with timed_startup_step('seed users'):
+            for user in users:
+                if user['password'] is None:
+                    user['password'] = (
+                        app.config['SEED_ADMIN_PASSWORD_HASH']
+                        or generate_password_hash(app.config['SEED_ADMIN_PASSWORD'])
+                    )
+        with timed_startup_step('content journal'):
+            init_content_journal()
+            apply_content_changes()
+        with timed_startup_step('media references'):
+            rebuild_media_references()
+        with timed_startup_step('job store'):
+            init_job_store()
+        with timed_startup_step('memory baseline'):
+            record_memory_baseline()
+
+        app.config['APP_INITIALIZED'] = True
+
+    app.logger.info(
+        "Application initialized in %.1f ms (module load %.1f ms)",
+        sum(seconds for _, seconds in startup_timings) * 1000,
+        MODULE_LOAD_TIME * 1000
+    )
+    return app
+
+def start_background_workers():
+    """
+    Starts this process's background threads, once per process.
+    """
+    global background_workers_pid
+    with startup_lock:
+        if background_workers_pid == os.getpid():
+            return
+        background_workers_pid = os.getpid()
+    threads = [
+        start_mail_worker(), start_contact_writer(), start_content_follower(),
+        start_job_scheduler(), start_metrics_flusher()
+    ]
+    threads.extend(start_job_runners())
+    if session_store is not None:
+        threads.append(start_session_sweeper(session_store))
+    background_threads[:] = [thread for thread in threads if thread is not None]
+
+
+class StartupMiddleware:
+    """
+    Makes sure the app is initialized and this process's background threads
+    run before the first request is handled, whoever imported the module
+    (`gunicorn main:app`, tests, `flask run`...).
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not app.config.get('APP_INITIALIZED'):
+            create_app()
+        if background_workers_pid != os.getpid():
+            start_background_workers()
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = StartupMiddleware(app.wsgi_app)
+
+# REQUEST METRICS
+# ------------------------------------------------------------------------------
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.add_to_gauge('http_requests_in_flight', (), 1)
+
+@app.after_request
+def record_response_metrics(response):
+    g.response_status = response.status_code
+    g.response_size = response.content_length or 0
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    metrics.add_to_gauge('http_requests_in_flight', (), -1)
+    # Unmatched URLs share one label, so random paths cannot blow up the series
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    status = g.get('response_status', 500)
+    metrics.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method), ('status', str(status))))
+    metrics.observe('http_request_duration_seconds', (('endpoint', endpoint),), time.perf_counter() - started)
+    metrics.observe('http_response_size_bytes', (('endpoint', endpoint),), g.get('response_size', 0))
+
+# SERVER-TIMING
+# ------------------------------------------------------------------------------
+@app.before_request
+def start_server_timing():
+    if session.get('role') == 'admin' or random.random() < app.config['SERVER_TIMING_SAMPLE_RATE']:
+        g.timing_totals = {}
+        # Whatever the phases do not cover is the view building its content
+        g.timing_stack = [['content', time.perf_counter(), 0.0]]
+
+@app.after_request
+def add_server_timing_header(response):
+    stack = g.pop('timing_stack', None)
+    if stack is None:
+        return response
+    while stack:
+        close_timing_phase(stack)
+    entries = [
+        f'{phase};dur={g.timing_totals[phase] * 1000:.2f};desc="{label}"'
+        for phase, label in SERVER_TIMING_PHASES.items()
+        if phase in g.timing_totals
+    ]
+    entries.append(f'total;dur={(time.perf_counter() - g.request_started) * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+# PROFILING
+# ------------------------------------------------------------------------------
+@app.before_request
+def start_profiling():
+    reason = profile_reason()
+    if reason is None or not profile_lock.acquire(blocking=False):
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool is active in this process
+        profile_lock.release()
+        return
+    g.profiler = (profiler, reason)
+
+@app.teardown_request
+def finish_profiling(exc):
+    entry = g.pop('profiler', None)
+    if entry is None:
+        return
+    profiler, reason = entry
+    profiler.disable()
+    profile_lock.release()
+    try:
+        save_profile(profiler, reason, time.perf_counter() - g.request_started, g.get('response_status', 500))
+    except OSError:
+        app.logger.exception("Saving the request profile failed")
+
+# HEALTH CHECKS
+# ------------------------------------------------------------------------------
+@app.route('/healthz')
+def healthz():
+    """
+    Liveness: the process answers requests. Touches nothing else.
+    """
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness: initialized, stores reachable, upload folder writable and
+    background threads alive. Answers 503 while anything is missing.
+    """
+    checks = {
+        'initialized': bool(app.config.get('APP_INITIALIZED')),
+        'workers': background_workers_pid == os.getpid() and all(t.is_alive() for t in background_threads),
+        'uploads': os.access(app.config['UPLOAD_FOLDER'], os.W_OK)
+    }
+    for name, connect in (('outbox', outbox_connect), ('messages', messages_connect),
+                          ('content', content_journal_connect), ('jobs', jobs_connect)):
+        try:
+            with closing(connect()) as conn:
+                conn.execute("SELECT 1")
+            checks[name] = True
+        except sqlite3.Error:
+            checks[name] = False
+    ready = all(checks.values())
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus metrics for the whole server (all worker processes), for an
+    admin session or a scraper holding METRICS_TOKEN.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if not (
+        session.get('role') == 'admin'
+        or (token and tokens_match(authorization, f"Bearer {token}"))
+    ):
+        return Response("Accès refusé.\n", status=403, mimetype='text/plain')
+
+    totals = metrics.collect()
+    lookups = collections.defaultdict(dict)
+    for (name, labels), value in totals['counters'].items():
+        if name == 'cache_requests_total':
+            lookups[dict(labels)['cache']][dict(labels)['result']] = value
+    for cache, counts in lookups.items():
+        total = counts.get('hit', 0) + counts.get('miss', 0)
+        totals['gauges']['cache_hit_ratio', (('cache', cache),)] = counts.get('hit', 0) / total
+    for queue_name, stats in job_queue_stats().items():
+        totals['gauges']['jobs_waiting', (('queue', queue_name),)] = stats['due']
+        totals['gauges']['jobs_dead', (('queue', queue_name),)] = stats['dead']
+    return Response(render_metrics(totals), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('startup-report')
+def startup_report():
+    """
+    Prints how long the module load and each create_app() step took.
+    """
+    create_app()
+    print(f"{'module load':<20} {MODULE_LOAD_TIME * 1000:8.1f} ms")
+    for name, seconds in startup_timings:
+        print(f"{name:<20} {seconds * 1000:8.1f} ms")
+    total = MODULE_LOAD_TIME + sum(seconds for _, seconds in startup_timings)
+    print(f"{'total':<20} {total * 1000:8.1f} ms")
+
+@app.cli.command('memory-report')
+@click.option('--url', help="Report of a running server instead, e.g. http://127.0.0.1:8000 "
+                            "(sends METRICS_TOKEN from the environment).")
+@click.option('--trace', type=int, default=0, help="Also trace allocations for this many seconds.")
+def memory_report_command(url, trace):
+    """
+    Prints the memory report of this process (after create_app() and the
+    journal replay) or of one worker of a running server.
+    """
+    if url:
+        import urllib.request
+        req = urllib.request.Request(
+            url.rstrip('/') + '/manage/memory.json',
+            headers={'Authorization': f"Bearer {os.environ.get('METRICS_TOKEN', '')}"}
+        )
+        with urllib.request.urlopen(req) as response:
+            report = json.load(response)
+    else:
+        create_app()
+        if trace:
+            start_allocation_trace(trace)
+            time.sleep(trace + 0.5)
+        report = memory_report()
+
+    print(f"pid {report['pid']}, RSS {format_bytes(report['rss'])} "
+          f"(start {format_bytes(report['rss_at_start'])})")
+    print(f"{'collection':<20} {'items':>8} {'size':>10} {'start':>10} {'growth/h':>10} {'budget':>10}")
+    for entry in report['collections']:
+        print(
+            f"{entry['name']:<20} {entry['items']:>8} {format_bytes(entry['bytes']):>10} "
+            f"{format_bytes(entry['bytes_at_start']):>10} {format_bytes(entry['growth_per_hour']):>10} "
+            f"{format_bytes(entry['budget']):>10}"
+        )
+    print("objects: " + ', '.join(f"{name} {count}" for name, count in report['object_types']))
+    for stat in report['tracemalloc'].get('top', []):
+        print(f"{format_bytes(stat['bytes']):>10} {stat['blocks']:>8}  {stat['where']}")
+
 if __name__ == '__main__':
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     # app.run(debug=True)  # In production, turn debug=False or use a WSGI server
-    app.run(debug=True)
+    create_app().run(debug=True)
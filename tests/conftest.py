@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """
+    The app, initialized once for the test run with every store in a scratch
+    directory.
+    """
+    scratch = tmp_path_factory.mktemp('app')
+    return main.create_app({
+        'TESTING': True,
+        'SECRET_KEY': 'tests',
+        'MAIL_SUPPRESS_SEND': True,
+        'UPLOAD_FOLDER': str(scratch / 'uploads'),
+        'MAIL_OUTBOX_PATH': str(scratch / 'mail_outbox.sqlite3'),
+        'MESSAGES_DB_PATH': str(scratch / 'messages.sqlite3'),
+        'SESSION_SQLITE_PATH': str(scratch / 'sessions.sqlite3'),
+        'SESSION_FILE_DIR': str(scratch / 'sessions'),
+        'CONTENT_JOURNAL_PATH': str(scratch / 'content_journal.sqlite3'),
+        'JOBS_DB_PATH': str(scratch / 'jobs.sqlite3'),
+        'METRICS_DIR': str(scratch / 'metrics'),
+        'PROFILE_DIR': str(scratch / 'profiles'),
+    })
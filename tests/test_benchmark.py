@@ -0,0 +1,94 @@
+import math
+import random
+
+import pytest
+
+import benchmark
+
+
+# PERCENTILES
+# ------------------------------------------------------------------------------
+@pytest.mark.parametrize('fraction, expected', [
+    (0.0, 15), (0.05, 15), (0.2, 15), (0.3, 20), (0.4, 20), (0.5, 35), (0.95, 50), (1.0, 50),
+])
+def test_percentile_nearest_rank(fraction, expected):
+    assert benchmark.percentile([15, 20, 35, 40, 50], fraction) == expected
+
+
+def test_percentile_edges():
+    assert benchmark.percentile([], 0.5) is None
+    assert benchmark.percentile([7], 0.99) == 7
+    ordered = list(range(1, 101))
+    assert [benchmark.percentile(ordered, f) for f in (0.5, 0.95, 0.99)] == [50, 95, 99]
+
+
+def test_summarize():
+    stats = benchmark.summarize([0.001 * i for i in range(1, 21)], {200: 18, 404: 1, 0: 1}, 2.0)
+    assert stats['requests'] == 20
+    assert stats['errors'] == 2
+    assert stats['statuses'] == {'0': 1, '200': 18, '404': 1}
+    assert stats['throughput'] == 10.0
+    assert (stats['p50'], stats['p95'], stats['p99'], stats['max']) == (10.0, 19.0, 20.0, 20.0)
+    assert stats['mean'] == 10.5
+
+
+def test_summarize_without_requests():
+    stats = benchmark.summarize([], {0: 3}, 1.0)
+    assert stats['requests'] == 0
+    assert stats['p95'] is None and stats['mean'] is None
+
+
+# COMPARISON STATISTICS
+# ------------------------------------------------------------------------------
+def test_u_distribution():
+    assert benchmark.u_distribution(2, 2) == (1, 1, 2, 1, 1)
+    counts = benchmark.u_distribution(4, 6)
+    assert sum(counts) == math.comb(10, 4)
+    assert counts == counts[::-1]
+
+
+def test_mann_whitney_exact():
+    # U = 9 is the most extreme of the C(6, 3) = 20 orderings
+    assert benchmark.mann_whitney_less([1, 2, 3], [4, 5, 6]) == pytest.approx(1 / 20)
+    assert benchmark.mann_whitney_less([4, 5, 6], [1, 2, 3]) == 1.0
+    # Ties count for half a pair
+    assert benchmark.mann_whitney_less([1, 1], [1, 1]) == pytest.approx(4 / 6)
+    assert benchmark.mann_whitney_less([], [1]) == 1.0
+
+
+def test_mann_whitney_normal_approximation():
+    rng = random.Random(1)
+    xs = [rng.gauss(10, 1) for _ in range(30)]
+    ys = [rng.gauss(12, 1) for _ in range(30)]
+    assert benchmark.mann_whitney_less(xs, ys) < 1e-6
+    assert benchmark.mann_whitney_less(ys, xs) > 0.99
+    same = [rng.gauss(10, 1) for _ in range(30)]
+    assert 0.01 < benchmark.mann_whitney_less(xs, same) < 0.99
+
+
+def test_mann_whitney_approximation_matches_exact():
+    # 21 x 20 is past the exact cases: compare with the exact distribution
+    xs, ys = list(range(0, 42, 2)), list(range(3, 43, 2))
+    u = sum(x < y for x in xs for y in ys)
+    counts = benchmark.u_distribution(len(xs), len(ys))
+    exact = sum(counts[u:]) / sum(counts)
+    assert benchmark.mann_whitney_less(xs, ys) == pytest.approx(exact, abs=0.01)
+
+
+def trials(scale, count=3, seed=0):
+    rng = random.Random(seed)
+    return [{'samples': sorted(scale * rng.lognormvariate(0, 0.3) for _ in range(500))} for _ in range(count)]
+
+
+def test_p95_ratio_bound():
+    rng = random.Random(0)
+    base = trials(10)
+    assert benchmark.p95_ratio_bound(base, trials(10, seed=1), 0.05, 200, rng) < 1.1
+    assert benchmark.p95_ratio_bound(base, trials(20, seed=1), 0.05, 200, rng) > 1.5
+    assert benchmark.p95_ratio_bound(base, [{'samples': []}], 0.05, 200, rng) is None
+
+
+def test_thinned():
+    samples = list(range(1000))
+    assert benchmark.thinned(samples, 2000) is samples
+    assert benchmark.thinned(samples, 4) == [125, 375, 625, 875]
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from werkzeug.http import http_date
+
+CONTENT = bytes(range(256)) * 4  # 1 KiB
+
+
+@pytest.fixture
+def media(app):
+    """
+    A 1 KiB upload; returns (client, etag).
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'clip.mp4'), 'wb') as f:
+        f.write(CONTENT)
+    client = app.test_client()
+    response = client.get('/media/clip.mp4')
+    response.close()
+    yield client, response.headers['ETag']
+    os.remove(os.path.join(folder, 'clip.mp4'))
+
+
+def test_full_file(media):
+    client, _ = media
+    response = client.get('/media/clip.mp4')
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Type'] == 'video/mp4'
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert response.data == CONTENT
+
+
+@pytest.mark.parametrize('header, start, stop', [
+    ('bytes=0-99', 0, 100),
+    ('bytes=100-199', 100, 200),
+    ('bytes=1000-', 1000, 1024),
+    ('bytes=-24', 1000, 1024),
+    ('bytes=1000-5000', 1000, 1024),
+])
+def test_single_range(media, header, start, stop):
+    client, _ = media
+    response = client.get('/media/clip.mp4', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {start}-{stop - 1}/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == str(stop - start)
+    assert response.data == CONTENT[start:stop]
+
+
+@pytest.mark.parametrize('header', ['bytes=2000-3000', 'bytes=0-9,20-29'])
+def test_unsupported_range(media, header):
+    client, _ = media
+    response = client.get('/media/clip.mp4', headers={'Range': header})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_if_range_current_etag(media):
+    client, etag = media
+    response = client.get('/media/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == CONTENT[:10]
+
+
+def test_if_range_stale_etag(media):
+    client, _ = media
+    response = client.get('/media/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_if_range_date(media):
+    client, _ = media
+    last_modified = client.get('/media/clip.mp4').headers['Last-Modified']
+    response = client.get('/media/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': last_modified})
+    assert response.status_code == 206
+    response = client.get('/media/clip.mp4', headers={'Range': 'bytes=0-9', 'If-Range': http_date(0)})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_conditional_get(media):
+    client, etag = media
+    response = client.get('/media/clip.mp4', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_missing_file(media):
+    client, _ = media
+    assert client.get('/media/absent.mp4').status_code == 404
+    assert client.get('/media/..%2Fmain.py').status_code == 404
@@ -0,0 +1,69 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def message_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'MESSAGES_DB_PATH', str(tmp_path / 'messages.sqlite3'))
+    main.init_message_store()
+
+
+def message(message_id, lu=False):
+    return {
+        'id': message_id, 'nom': 'Awa', 'email': 'awa@example.com',
+        'message': 'Bonjour', 'lu': lu, 'received_at': 1_700_000_000.0
+    }
+
+
+def test_counters_follow_inserts(message_store):
+    main.store_messages([message('a'), message('b'), message('c', lu=True)])
+    assert main.inbox_counts() == {'total': 3, 'unread': 2}
+
+
+def test_counters_follow_read_state(message_store):
+    main.store_messages([message('a'), message('b'), message('c')])
+    main.mark_messages(['a', 'b', 'a'])
+    assert main.inbox_counts() == {'total': 3, 'unread': 1}
+    # Marking a message in the state it already has changes nothing
+    main.mark_messages(['a', 'c'])
+    assert main.inbox_counts() == {'total': 3, 'unread': 0}
+    main.mark_messages(['a'], lu=False)
+    main.toggle_message_read('b')
+    assert main.inbox_counts() == {'total': 3, 'unread': 2}
+
+
+def test_counters_follow_deletes(message_store):
+    main.store_messages([message('a'), message('b', lu=True)])
+    assert main.delete_message('a')['id'] == 'a'
+    assert main.delete_message('a') is None
+    main.delete_message('b')
+    assert main.inbox_counts() == {'total': 0, 'unread': 0}
+
+
+def test_search_totals_come_from_counters(message_store):
+    main.store_messages([message('a'), message('b', lu=True), message('c', lu=True)])
+    assert main.search_messages()[1] == 3
+    assert main.search_messages(status='read')[1] == 2
+    assert main.search_messages(status='unread')[1] == 1
+
+
+def test_counters_start_from_existing_rows(tmp_path, monkeypatch):
+    # A messages table from before the counters existed
+    path = str(tmp_path / 'messages.sqlite3')
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.execute(
+            "CREATE TABLE messages (id TEXT PRIMARY KEY, nom TEXT NOT NULL, email TEXT NOT NULL, "
+            "message TEXT NOT NULL, lu INTEGER NOT NULL DEFAULT 0, received_at REAL NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO messages VALUES (:id, :nom, :email, :message, :lu, :received_at)",
+            [message('a'), message('b', lu=True)]
+        )
+    monkeypatch.setitem(main.app.config, 'MESSAGES_DB_PATH', path)
+    main.init_message_store()
+    main.init_message_store()
+    assert main.inbox_counts() == {'total': 2, 'unread': 1}
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+import main
+
+ROUTE = (('endpoint', 'index'),)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setitem(main.app.config, 'METRICS_DIR', str(tmp_path))
+    return main.MetricsRegistry()
+
+
+def write_snapshot(directory, name, snapshot):
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump(snapshot, f)
+
+
+def test_observe_counts_each_value_in_one_bucket(registry):
+    for value in (0.001, 0.005, 0.3, 60):
+        registry.observe('http_request_duration_seconds', ROUTE, value)
+    entry = registry.histograms['http_request_duration_seconds', ROUTE]
+    assert entry[0] == 2  # le 0.005
+    assert entry[6] == 1  # le 0.5
+    assert sum(entry[:-2]) == 3  # 60 s is only in +Inf
+    assert entry[-2] == pytest.approx(60.306)
+    assert entry[-1] == 4
+
+
+def test_merge_adds_snapshots():
+    totals = {'counters': {}, 'histograms': {}, 'gauges': {}}
+    snapshot = json.loads(json.dumps({
+        'counters': [['http_requests_total', ROUTE, 2]],
+        'histograms': [['http_response_size_bytes', ROUTE, [1, 0, 0, 0, 0, 0, 0, 0, 100, 1]]],
+        'gauges': [['http_requests_in_flight', (), 1]],
+    }))
+    main.merge_metrics(totals, snapshot, gauges=True)
+    main.merge_metrics(totals, snapshot, gauges=False)
+    assert totals['counters'] == {('http_requests_total', ROUTE): 4}
+    assert totals['histograms'] == {('http_response_size_bytes', ROUTE): [2, 0, 0, 0, 0, 0, 0, 0, 200, 2]}
+    assert totals['gauges'] == {('http_requests_in_flight', ()): 1}
+    assert json.loads(json.dumps(main.metrics_snapshot(totals))) == {
+        'counters': [['http_requests_total', [list(ROUTE[0])], 4]],
+        'histograms': [['http_response_size_bytes', [list(ROUTE[0])], [2, 0, 0, 0, 0, 0, 0, 0, 200, 2]]],
+        'gauges': [['http_requests_in_flight', [], 1]],
+    }
+
+
+def test_collect_folds_finished_processes(registry, tmp_path, monkeypatch):
+    live, gone = 10**9 + 1, 10**9 + 2
+    monkeypatch.setattr(main, 'process_alive', lambda pid: pid == live)
+    for pid in (live, gone):
+        write_snapshot(tmp_path, f'{pid}.json', {
+            'counters': [['http_requests_total', ROUTE, 3]],
+            'gauges': [['http_requests_in_flight', [], 2]],
+        })
+    registry.inc('http_requests_total', ROUTE)
+
+    totals = registry.collect()
+    assert totals['counters'] == {('http_requests_total', ROUTE): 7}
+    # The finished process's gauges are dropped, its counters archived
+    assert totals['gauges'] == {('http_requests_in_flight', ()): 2}
+    assert sorted(os.listdir(tmp_path)) == ['.lock', f'{live}.json', 'archive.json']
+    assert registry.collect()['counters'] == {('http_requests_total', ROUTE): 7}
+
+
+def test_render_histogram():
+    totals = {'counters': {}, 'gauges': {}, 'histograms': {
+        ('http_request_duration_seconds', ROUTE): [1, 2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0.5, 4],
+    }}
+    lines = main.render_metrics(totals).splitlines()
+    assert lines[:4] == [
+        '# HELP http_request_duration_seconds Time spent handling a request, by endpoint.',
+        '# TYPE http_request_duration_seconds histogram',
+        'http_request_duration_seconds_bucket{endpoint="index",le="0.005"} 1',
+        'http_request_duration_seconds_bucket{endpoint="index",le="0.01"} 3',
+    ]
+    assert lines[-4:] == [
+        'http_request_duration_seconds_bucket{endpoint="index",le="10"} 3',
+        'http_request_duration_seconds_bucket{endpoint="index",le="+Inf"} 4',
+        'http_request_duration_seconds_sum{endpoint="index"} 0.5',
+        'http_request_duration_seconds_count{endpoint="index"} 4',
+    ]
+
+
+def test_render_escapes_label_values():
+    totals = {'histograms': {}, 'gauges': {}, 'counters': {
+        ('http_requests_total', (('endpoint', 'a"b\\c\nd'),)): 1,
+    }}
+    assert 'http_requests_total{endpoint="a\\"b\\\\c\\nd"} 1' in main.render_metrics(totals)
+
+
+def test_metrics_endpoint(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 'secret')
+    client = app.test_client()
+    client.get('/healthz')
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert 'http_requests_total{endpoint="healthz",method="GET",status="200"}' in response.get_data(as_text=True)
@@ -0,0 +1,105 @@
+"""
+Production entry point for the Tourisme Niger site.
+
+    gunicorn wsgi:app                     # any gunicorn setup imports `app` from here
+    python wsgi.py                        # gunicorn, gthread workers sized from the CPUs
+    python wsgi.py --worker-class gevent  # one event loop per CPU (pip install gevent)
+    python wsgi.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+
+Worker counts default to 2 * CPUs + 1 gthread workers of 4 threads each, or
+one gevent worker per CPU; WEB_CONCURRENCY and GUNICORN_THREADS override them.
+Workers are recycled after --max-requests requests (with jitter so they do not
+all restart together).
+
+Reloading: `kill -HUP <master pid>` starts fresh workers with the new code and
+stops the old ones once their requests are done. With --preload the code is
+loaded once in the master and shared by the workers (faster to start, less
+memory), but a HUP then only restarts the workers on the code already loaded;
+upgrade with USR2 + TERM instead. Without --preload each restarted worker also
+runs create_app(), mostly spent on the seed admin password hash; set
+SEED_ADMIN_PASSWORD_HASH to skip it.
+
+Behind a reverse proxy, set TRUSTED_PROXIES to the number of proxies (1 for
+nginx in front of gunicorn) so that the client IP used by the login throttle
+and the contact limiter comes from X-Forwarded-For; gunicorn only sees the
+proxy's address.
+
+Health: /healthz answers as soon as the process is up, /readyz once the stores
+are reachable and the background threads are running (503 until then).
+
+The content collections (destinations, culture, pages...) live in each worker's
+memory. Admin edits go through a shared journal (CONTENT_JOURNAL_PATH) that
+every worker follows, so the other workers see them within half a second
+(CONTENT_POLL_INTERVAL).
+"""
+import argparse
+import multiprocessing
+import os
+
+
+def load_app():
+    from main import create_app
+    return create_app()
+
+
+def default_workers(worker_class):
+    cpus = multiprocessing.cpu_count()
+    if worker_class == 'gevent':
+        return cpus
+    return cpus * 2 + 1
+
+
+def server_options(args):
+    options = {
+        'bind': args.bind,
+        'worker_class': args.worker_class,
+        'workers': args.workers or int(os.environ.get('WEB_CONCURRENCY', 0)) or default_workers(args.worker_class),
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'timeout': 30,
+        'graceful_timeout': 30,
+        'keepalive': 5,
+        'preload_app': args.preload,
+        'accesslog': '-',
+    }
+    if args.worker_class == 'gevent':
+        options['worker_connections'] = 1000
+    else:
+        options['threads'] = args.threads or int(os.environ.get('GUNICORN_THREADS', 4))
+    return options
+
+
+def serve(options):
+    from gunicorn.app.base import BaseApplication
+
+    class SiteApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Imported here: without --preload each worker imports the code
+            # itself, which is what lets a HUP pick up new code.
+            return load_app()
+
+    SiteApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the site under gunicorn.")
+    parser.add_argument('--bind', default=f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+    parser.add_argument('--worker-class', choices=['gthread', 'gevent'], default='gthread')
+    parser.add_argument('--workers', type=int, help="default: 2 * CPUs + 1 (gthread), CPUs (gevent)")
+    parser.add_argument('--threads', type=int, help="threads per gthread worker (default 4)")
+    parser.add_argument('--max-requests', type=int, default=10000,
+                        help="recycle a worker after this many requests (0: never)")
+    parser.add_argument('--preload', action='store_true',
+                        help="load the app in the master before forking the workers")
+    serve(server_options(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
+elif __name__ != '__mp_main__':
+    # Not when a process pool worker re-imports this script
+    app = load_app()